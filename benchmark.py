@@ -0,0 +1,419 @@
+#!/usr/bin/python3
+# coding=utf8
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from trigs.players.base import PlayerStatus
+from trigs.remote.protocol import PlayerClient, RequestType, ResponseType, EventType, Compression, \
+    encode_request, decode_request, encode_response, decode_response
+from trigs.remote.service import PlayerService
+from trigs.remote.shm import SharedMemoryConnection
+from trigs.remote.tcp import TCPConnection
+from trigs.remote.udp import DatagramServer, DatagramChannel
+from trigs.remote.unix import UnixConnection
+
+# region Argument parsing
+
+parser = argparse.ArgumentParser(description='Measures the performance of trigs components on the local machine.')
+subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+framing = subparsers.add_parser('framing', help='Measures round trip latency and bulk throughput of a connection'
+                                                ' on the local machine.')
+framing.add_argument('--transport', choices=('tcp', 'unix', 'shm'), default='tcp',
+                     help='The type of connection to measure.')
+framing.add_argument('--port', type=int, default=8765, help='The loopback port to use for TCP.')
+framing.add_argument('--rounds', type=int, default=5000, help='The number of small messages to exchange.')
+framing.add_argument('--size', type=int, default=2 ** 24, help='The size of the bulk messages, in bytes.')
+
+load = subparsers.add_parser('load', help='Measures the latency of queries to a player server, while many clients'
+                                          ' are connected and one of them uploads a large sequence.')
+load.add_argument('--transport', choices=('tcp', 'unix', 'shm'), default='tcp',
+                  help='The type of connection to use.')
+load.add_argument('--port', type=int, default=8766, help='The loopback port to use for TCP.')
+load.add_argument('--clients', type=int, default=50, help='The number of clients sending queries simultaneously.')
+load.add_argument('--rounds', type=int, default=200, help='The number of queries each client sends.')
+load.add_argument('--size', type=int, default=2 ** 26,
+                  help='The size of the sequence that is uploaded during the measurement, in bytes. 0 disables the'
+                       ' upload.')
+
+codec = subparsers.add_parser('codec', help='Measures how fast protocol messages are encoded and decoded.')
+codec.add_argument('--rounds', type=int, default=100000, help='The number of times each message is encoded and'
+                                                               ' decoded.')
+
+fastpath = subparsers.add_parser('fastpath', help='Measures the latency of commands sent over TCP and over the UDP'
+                                                  ' fast path, through proxies on the loopback interface that simulate'
+                                                  ' packet loss.')
+fastpath.add_argument('--port', type=int, default=8767,
+                      help='The loopback port for the server. The proxies use the port number above it.')
+fastpath.add_argument('--rounds', type=int, default=1000, help='The number of commands to send over each path.')
+fastpath.add_argument('--loss', type=float, default=0.05, help='The probability with which a packet is lost.')
+fastpath.add_argument('--rto', type=float, default=0.2,
+                      help='The number of seconds after which TCP retransmits a lost packet. The default is the'
+                           ' minimum retransmission timeout of Linux.')
+fastpath.add_argument('--copies', type=int, default=3, help='The number of times every datagram is sent.')
+fastpath.add_argument('--interval', type=float, default=0.002, help='The number of seconds between two copies.')
+
+triggers = subparsers.add_parser('triggers', help='Measures the latency from a button press to its handler, for a'
+                                                  ' virtual shutter device created via uinput. Requires evdev and'
+                                                  ' write access to /dev/uinput.')
+triggers.add_argument('--rounds', type=int, default=1000, help='The number of presses to measure.')
+
+dispatch = subparsers.add_parser('dispatch', help='Measures how long it takes to map a trigger event to an action, for'
+                                                  ' rigs of different numbers of triggers.')
+dispatch.add_argument('--rounds', type=int, default=100000, help='The number of events to dispatch per rig.')
+
+# endregion
+
+
+def report(name, seconds):
+    """
+    Prints the statistics of a set of time measurements.
+    :param name: The name of the quantity that was measured.
+    :param seconds: A list of durations, in seconds.
+    """
+    seconds = sorted(seconds)
+    n = len(seconds)
+    print("{}: n={}, mean={:.1f}us, p50={:.1f}us, p99={:.1f}us, max={:.1f}us".format(
+        name, n, sum(seconds) / n * 10 ** 6, seconds[n // 2] * 10 ** 6,
+        seconds[min(n - 1, int(n * 0.99))] * 10 ** 6, seconds[-1] * 10 ** 6))
+
+
+async def echo(connection):
+    """
+    Sends every message received over the given connection back to the sender.
+    """
+    try:
+        while True:
+            await connection.send(*(await connection.recv()))
+    except (EOFError, ConnectionError):
+        connection.close()
+
+
+async def serve_local(transport, port, s):
+    """
+    Creates a server on the local machine.
+    :param transport: One of 'tcp', 'unix' and 'shm'.
+    :param port: The loopback port to use for TCP.
+    :param s: A callback that accepts a Connection as its only argument.
+    :return: A pair (task, connect), where task is the asyncio.Task running the server and connect is a coroutine
+             function that opens a new connection to the server.
+    """
+    if transport == 'tcp':
+        task = asyncio.create_task(TCPConnection.serve('127.0.0.1', port, s))
+
+        async def connect():
+            return await TCPConnection.open_outgoing('127.0.0.1', port)
+    else:
+        ctype = SharedMemoryConnection if transport == 'shm' else UnixConnection
+        path = os.path.join(tempfile.mkdtemp(), 'trigs.sock')
+        task = asyncio.create_task(ctype.serve(path, s))
+
+        async def connect():
+            return await ctype.open_outgoing(path)
+
+    await asyncio.sleep(0.1)
+    return task, connect
+
+
+async def bench_framing(args):
+    server, connect = await serve_local(args.transport, args.port, echo)
+    try:
+        with await connect() as c:
+            message = ((5).to_bytes(4, 'big'), (1).to_bytes(4, 'big'))
+            rtts = []
+            for _ in range(args.rounds):
+                t0 = time.perf_counter()
+                await c.send(*message)
+                await c.recv()
+                rtts.append(time.perf_counter() - t0)
+            report("Round trip", rtts)
+
+            bulk = bytes(args.size)
+            t0 = time.perf_counter()
+            for _ in range(10):
+                await c.send(b'bulk', bulk)
+                await c.recv()
+            print("Bulk throughput: {:.0f} MB/s".format(20 * args.size / (time.perf_counter() - t0) / 10 ** 6))
+        await asyncio.sleep(0.1)  # Give the server the chance to notice that the connection has been closed.
+    finally:
+        server.cancel()
+
+
+async def bench_load(args):
+    service = PlayerService(None, verbose=False)
+    server, connect = await serve_local(args.transport, args.port, service.server.serve_client)
+    try:
+        clients = [PlayerClient(await connect()) for _ in range(args.clients)]
+
+        async def query(client):
+            latencies = []
+            for _ in range(args.rounds):
+                t0 = time.perf_counter()
+                await client.request(RequestType.GETSNAPSHOT)
+                latencies.append(time.perf_counter() - t0)
+            return latencies
+
+        async def upload(client):
+            data = os.urandom(args.size)
+            t0 = time.perf_counter()
+            await client.request(RequestType.STOREWAV, 2, 2, 44100, data)
+            return time.perf_counter() - t0
+
+        uploader = PlayerClient(await connect())
+        t0 = time.perf_counter()
+        upload = asyncio.create_task(upload(uploader)) if args.size > 0 else None
+        latencies = sum(await asyncio.gather(*(query(c) for c in clients)), [])
+        t = time.perf_counter() - t0
+        report("Query latency ({} clients)".format(args.clients), latencies)
+        print("Query throughput: {:.0f} requests/s".format(len(latencies) / t))
+        if upload is not None:
+            print("Upload of {} bytes: {:.3f}s".format(args.size, await upload))
+
+        for c in (*clients, uploader):
+            c.close()
+            c.connection.close()
+        await asyncio.sleep(0.1)  # Give the server the chance to notice that the connections have been closed.
+    finally:
+        server.cancel()
+
+
+class LossyDatagramProxy(asyncio.DatagramProtocol):
+    """
+    Forwards datagrams between a client and a server, dropping some of them at random.
+    """
+
+    def __init__(self, server, loss):
+        """
+        Creates a new proxy.
+        :param server: The address of the server.
+        :param loss: The probability with which a datagram is dropped.
+        """
+        super().__init__()
+        self._server = server
+        self._loss = loss
+        self._client = None
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr != self._server:
+            self._client = addr
+        if random.random() >= self._loss:
+            self._transport.sendto(data, self._client if addr == self._server else self._server)
+
+
+async def lossy_stream_proxy(port, server_port, loss, rto):
+    """
+    Forwards TCP connections to a server, delaying some of the data at random, as if a packet had been lost and
+    retransmitted. Data that follows delayed data is held back until the delayed data has been forwarded.
+    :param port: The port on which the proxy accepts connections.
+    :param server_port: The port of the server.
+    :param loss: The probability with which a piece of data is delayed.
+    :param rto: The number of seconds by which delayed data is delayed.
+    """
+    async def pump(reader, writer):
+        try:
+            while True:
+                data = await reader.read(2 ** 16)
+                if len(data) == 0:
+                    break
+                if random.random() < loss:
+                    await asyncio.sleep(rto)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_client(reader, writer):
+        sreader, swriter = await asyncio.open_connection('127.0.0.1', server_port)
+        await asyncio.gather(pump(reader, swriter), pump(sreader, writer))
+
+    server = await asyncio.start_server(handle_client, '127.0.0.1', port)
+    async with server:
+        await server.serve_forever()
+
+
+async def bench_fastpath(args):
+    service = PlayerService(None, verbose=False)
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.create_task(TCPConnection.serve('127.0.0.1', args.port, service.server.serve_client)),
+             asyncio.create_task(DatagramServer.serve('127.0.0.1', args.port, service.server)),
+             asyncio.create_task(lossy_stream_proxy(args.port + 1, args.port, args.loss, args.rto))]
+    proxy, _ = await loop.create_datagram_endpoint(lambda: LossyDatagramProxy(('127.0.0.1', args.port), args.loss),
+                                                   local_addr=('127.0.0.1', args.port + 1))
+    await asyncio.sleep(0.1)
+    try:
+        # SETMUTED takes the same path through the server as transport commands, but does not need an audio device:
+        client = PlayerClient(await TCPConnection.open_outgoing('127.0.0.1', args.port + 1))
+        latencies = []
+        for idx in range(args.rounds):
+            t0 = time.perf_counter()
+            await client.request(RequestType.SETMUTED, idx % 2)
+            latencies.append(time.perf_counter() - t0)
+        report("TCP with {:.0%} loss".format(args.loss), latencies)
+
+        channel = await DatagramChannel.open('127.0.0.1', args.port + 1, copies=args.copies, interval=args.interval,
+                                             timeout=2 * args.copies * args.interval + 0.01)
+        latencies = []
+        fallbacks = 0
+        for idx in range(args.rounds):
+            t0 = time.perf_counter()
+            try:
+                await channel.request(RequestType.SETMUTED, idx % 2)
+            except asyncio.TimeoutError:
+                fallbacks += 1
+                await client.request(RequestType.SETMUTED, idx % 2)
+            latencies.append(time.perf_counter() - t0)
+        report("UDP with {:.0%} loss, {} copies".format(args.loss, args.copies), latencies)
+        print("Fell back to TCP for {} of {} commands.".format(fallbacks, args.rounds))
+
+        channel.close()
+        client.close()
+        client.connection.close()
+        await asyncio.sleep(0.1)  # Give the server the chance to notice that the connection has been closed.
+    finally:
+        proxy.close()
+        for t in tasks:
+            t.cancel()
+
+
+async def bench_triggers(args):
+    import evdev
+    from trigs.triggers.bluetooth import BluetoothTrigger, BTN_SHUTTER, EV_VAL_PRESSED
+
+    ecodes = evdev.ecodes
+    with evdev.UInput({ecodes.EV_KEY: [BTN_SHUTTER], ecodes.EV_MSC: [ecodes.MSC_SCAN]}, name='trigs benchmark') as ui:
+        await asyncio.sleep(0.5)  # Give udev the chance to create the device file.
+
+        def press():
+            # Like the shutter devices we know, the stand-in reports a scan code, the press and the release:
+            ui.write(ecodes.EV_MSC, ecodes.MSC_SCAN, 0x90001)
+            ui.write(ecodes.EV_KEY, BTN_SHUTTER, EV_VAL_PRESSED)
+            ui.syn()
+            ui.write(ecodes.EV_KEY, BTN_SHUTTER, 0)
+            ui.syn()
+
+        async def measure(name, next_press):
+            latencies = []
+            for _ in range(args.rounds):
+                t0 = time.perf_counter()
+                press()
+                await next_press()
+                latencies.append(time.perf_counter() - t0)
+                await asyncio.sleep(0.001)
+            report(name, latencies)
+
+        # evdev's own asyncio adapter, which the previous ingestion path was a copy of:
+        device = evdev.InputDevice(ui.device.path)
+        try:
+            events = device.async_read_loop()
+
+            async def adapter():
+                async for e in events:
+                    if (e.type, e.value, e.code) == (ecodes.EV_KEY, EV_VAL_PRESSED, BTN_SHUTTER):
+                        return e
+
+            await measure("evdev asyncio adapter", adapter)
+        finally:
+            device.close()
+
+        with BluetoothTrigger(ui.device.path) as t:
+            async def pressed():
+                while not (await t.next()).pressed:
+                    pass
+
+            await measure("add_reader with batched reads", pressed)
+
+
+async def bench_codec(args):
+    requests = [
+        (RequestType.GETSNAPSHOT, ()),
+        (RequestType.SETPOSITION, (1234.5678, )),
+        (RequestType.UPLOADCHUNK, (7, 2 ** 20, Compression.NONE, bytes(2 ** 16))),
+        (RequestType.SCHEDULE, (42, 123456789012345, RequestType.SETPOSITION, 12.5)),
+        (RequestType.BATCH, (True, [(RequestType.STOP, ()), (RequestType.PREVIOUS, ()),
+                                    (RequestType.GETDURATION, ())])),
+    ]
+    responses = [
+        (RequestType.GETSNAPSHOT, ResponseType.VALUE, (PlayerStatus.PLAYING, 3, 1234.5678, 3600.0, 1.0)),
+        (None, ResponseType.EVENT, (EventType.POSITION, PlayerStatus.PLAYING, 3, 1234.5678, 3600.0, 17)),
+        (RequestType.GETTIME, ResponseType.VALUE, (123456789012345, 123456789012346)),
+        (RequestType.BATCH, ResponseType.VALUE, [(RequestType.STOP, ResponseType.SUCCESS, ()),
+                                                 (RequestType.GETDURATION, ResponseType.VALUE, (3600.0, ))]),
+    ]
+    for rt, a in requests:
+        chunks = encode_request(rt, *a)
+        t0 = time.perf_counter()
+        for _ in range(args.rounds):
+            encode_request(rt, *a)
+        t1 = time.perf_counter()
+        for _ in range(args.rounds):
+            decode_request(chunks)
+        t2 = time.perf_counter()
+        print("{}: encode {:.0f} messages/s, decode {:.0f} messages/s".format(
+            rt.name, args.rounds / (t1 - t0), args.rounds / (t2 - t1)))
+    for command, rt, values in responses:
+        chunks = encode_response(command, rt, *values)
+        t0 = time.perf_counter()
+        for _ in range(args.rounds):
+            encode_response(command, rt, *values)
+        t1 = time.perf_counter()
+        for _ in range(args.rounds):
+            decode_response(command, chunks)
+        t2 = time.perf_counter()
+        print("{} to {}: encode {:.0f} messages/s, decode {:.0f} messages/s".format(
+            rt.name, command.name if command is not None else '-', args.rounds / (t1 - t0), args.rounds / (t2 - t1)))
+
+
+async def bench_dispatch(args):
+    from trigs.engine import Action, Engine
+    from trigs.triggers.base import TriggerEvent
+    from trigs.triggers.virtual import VirtualTriggerWindow
+
+    class IdlePlayer:
+        # Just enough of a player for the engine to decide what to do:
+        @property
+        async def status(self):
+            return PlayerStatus.PAUSED
+
+    async def execute(event, command):
+        pass
+
+    actions = list(Action)
+    for n in (2, 12, 100):
+        triggers = [VirtualTriggerWindow.VirtualTrigger("t{}".format(i)) for i in range(n)]
+        engine = Engine(IdlePlayer(), ((t.uniq, actions[i % len(actions)]) for i, t in enumerate(triggers)), execute)
+        events = [TriggerEvent(triggers[i % n], 0) for i in range(args.rounds)]
+        t0 = time.perf_counter()
+        for e in events:
+            await engine.dispatch(e)
+        t1 = time.perf_counter()
+        print("{} triggers: {:.2f}us per event".format(n, (t1 - t0) / args.rounds * 10 ** 6))
+
+
+benchmarks = {
+    'framing': bench_framing,
+    'load': bench_load,
+    'codec': bench_codec,
+    'fastpath': bench_fastpath,
+    'triggers': bench_triggers,
+    'dispatch': bench_dispatch,
+}
+
+
+async def main():
+    args = parser.parse_args()
+    await benchmarks[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# coding=utf8
+
+import argparse
+import asyncio
+
+from trigs.remote.forwarding import TriggerForwarder
+from trigs.remote.tcp import TCPConnection
+from trigs.triggers.monitor import DeviceMonitor
+
+# region Argument parsing
+
+parser = argparse.ArgumentParser(description='Forwards the events of the trigger devices that are connected to this'
+                                             ' machine to a trigs process on another machine, which needs to be'
+                                             ' started with --forwarder.')
+
+parser.add_argument('hostname', type=str, help='The host name for which this forwarder should accept connections.')
+parser.add_argument('port', type=int, help='The port on which this forwarder should listen for connections.')
+parser.add_argument('--timeout', type=float, help='The number of seconds after which the connection to a silent client'
+                                                  ' is closed. Clients need to send heartbeats more often than this.')
+parser.add_argument('--devices', type=str, default='/dev/input',
+                    help='The directory in which the kernel exposes input devices.')
+
+# endregion
+
+
+async def main():
+
+    args = parser.parse_args()
+
+    monitor = DeviceMonitor(args.devices)
+    forwarder = TriggerForwarder(monitor, timeout=args.timeout)
+    tasks = []
+
+    try:
+        print("WARNING: The communication of this forwarder is not secure! Everyone on the network can read and"
+              " manipulate its communication! Use it only in environments where this is not a concern!")
+        print("Forwarding trigger events to clients on {}:{}...".format(args.hostname, args.port))
+        tasks.append(asyncio.create_task(forwarder.run()))
+        tasks.append(asyncio.create_task(TCPConnection.serve(args.hostname, args.port, forwarder.server.serve_client)))
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        forwarder.close()
+        monitor.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
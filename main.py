@@ -3,20 +3,35 @@
 
 import argparse
 import asyncio
+import functools
 import os
 import time
 
-from trigs.asynchronous import first
 from trigs.console import begin, done
 from trigs.display import Display
+from trigs.engine import Action, Engine
 from trigs.error import TrigsError
-from trigs.players.pyaudio import PyAudioPlayer, PlayerStatus
+from trigs.players.pyaudio import PyAudioPlayer
 from trigs.playlist import resolve_playlist, load_wav
 from trigs.pulsaudio import pacmdlist
+from trigs.recording import LatencyHistogram, Recording, replay
+from trigs.remote.clock import ClockEstimator
+from trigs.remote.failover import FailoverPlayer
+from trigs.remote.forwarding import TriggerReceiver
+from trigs.remote.group import GroupPlayer
 from trigs.remote.player import RemotePlayer
-from trigs.remote.protocol import PlayerClient
+from trigs.remote.protocol import PlayerClient, Compression, RequestType
 from trigs.remote.tcp import TCPConnection
+from trigs.remote.udp import DatagramChannel
+from trigs.remote.unix import UnixConnection
+from trigs.remote.shm import SharedMemoryConnection
 from trigs.triggers.bluetooth import BluetoothTrigger, TriggerError
+from trigs.triggers.gestures import Gesture, GestureRecognizer, binding
+from trigs.triggers.headless import HeadlessTrigger
+from trigs.triggers.hub import TriggerHub
+from trigs.triggers.monitor import DeviceMonitor
+from trigs.triggers.roles import RoleMap
+from trigs.triggers.scripted import script
 from trigs.triggers.virtual import VirtualTriggerWindow
 
 # region Argument parsing
@@ -36,9 +51,99 @@ parser.add_argument('--backward_double', action='store_true', default=False,
                          'have an effect. This allows the backward trigger to be used occasionally to prevent it'
                          'from going to powersave mode.')
 
-parser.add_argument('--remote', type=str, nargs=2, help='Instead of launching a local audio player, this will make'
-                                                        'the process connect to a trigs server on a remote machine.'
-                                                        'You need to give the host name and port number for that machine!')
+parser.add_argument('--gesture', type=str, nargs=3, action='append', metavar=('GESTURE', 'ROLES', 'ACTION'),
+                    help='Binds an action to a gesture, in addition to the actions given by --actions. GESTURE is one'
+                         ' of tap, double, long and chord. ROLES names the trigger that performs the gesture, or'
+                         ' for chords several triggers joined by "+", for example "forward+backward".'
+                         ' This option can be given several times.')
+
+parser.add_argument('--double_window', type=float, default=0.5,
+                    help='The maximum number of seconds between the two presses of a double tap.')
+
+parser.add_argument('--long_press', type=float, default=0.8,
+                    help='The minimum number of seconds that a trigger must be held down for a long press.')
+
+parser.add_argument('--chord_window', type=float, default=0.05,
+                    help='The maximum number of seconds between the presses of the triggers of a chord.')
+
+parser.add_argument('--debounce', type=float,
+                    help='The number of seconds within which a repeated press of the same trigger is ignored. Defaults'
+                         ' to 0 for --headless, such that the generated load is not thinned out, and to 0.03'
+                         ' otherwise.')
+
+parser.add_argument('--forwarder', type=str, nargs=2, metavar=('HOST', 'PORT'),
+                    help='Instead of expecting trigger devices to be connected to this machine, receives the events of'
+                         ' those connected to another machine, from forward.py running there.')
+
+parser.add_argument('--remote', type=str, nargs=2, action='append',
+                    help='Instead of launching a local audio player, this will make'
+                         'the process connect to a trigs server on a remote machine.'
+                         'You need to give the host name and port number for that machine!'
+                         ' This option can be given several times, to make several servers play in lockstep.')
+
+parser.add_argument('--standby', type=str, nargs=2,
+                    help='The host name and port number of a trigs server that plays along with the one given by'
+                         ' --remote, but muted, and that takes over if the former fails.')
+
+parser.add_argument('--unix', type=str, help='Instead of launching a local audio player, this will make'
+                                             ' the process connect to a trigs server on the same machine,'
+                                             ' via the Unix domain socket at the given path.')
+
+parser.add_argument('--shm', action='store_true', default=False,
+                    help='Pass audio sequences to the server given by --unix in shared memory.')
+
+parser.add_argument('--udp', action='store_true', default=False,
+                    help='Sends transport commands to remote trigs servers via UDP as well, such that packet loss does'
+                         ' not delay them. The servers need to use this option as well.')
+parser.add_argument('--heartbeat', type=float, default=0.5,
+                    help='The number of seconds of silence after which a heartbeat is sent to a remote trigs server.')
+
+parser.add_argument('--timeout', type=float, default=2.0,
+                    help='The number of seconds after which a heartbeat that a remote trigs server has not answered'
+                         ' makes this process consider the connection broken and reconnect.')
+
+parser.add_argument('--compress', action='store_true', default=False,
+                    help='Compress audio sequences before uploading them to a remote trigs server.')
+
+parser.add_argument('--schedule', type=float, help='Makes a remote trigs server execute every command exactly the given'
+                                                    ' number of milliseconds after the trigger event that caused it,'
+                                                    ' such that network jitter does not affect the timing of playback.')
+
+parser.add_argument('--actions', type=str, nargs='+', default=['forward', 'backward'],
+                    help='The actions that the triggers are to perform, one per trigger. Choose from forward, backward,'
+                         ' stop, pause, next and previous.')
+
+parser.add_argument('--roles', type=str, default=os.path.join(os.path.expanduser('~'), '.trigs_roles.json'),
+                    help='The file in which the roles of the trigger devices are recorded, such that devices that have'
+                         ' been calibrated before take on their roles again without the user having to participate.')
+
+parser.add_argument('--record', type=str,
+                    help='Records all trigger events, player commands and their latencies to the given file.')
+
+parser.add_argument('--replay', type=str,
+                    help='Instead of expecting trigger devices, replays the trigger events from the given recording,'
+                         ' then reports the latencies of the player commands they caused.')
+
+parser.add_argument('--replay_speed', type=float, default=1.0,
+                    help='The factor by which --replay is faster than the recording. Must be positive. Speeds other'
+                         ' than 1 change the time between events, and thus possibly the gestures they are recognized'
+                         ' as.')
+
+parser.add_argument('--headless', type=str, metavar='SOURCE',
+                    help='Instead of expecting trigger devices, fires headless triggers named after the roles, as'
+                         ' instructed by SOURCE: "stdin", "fifo:PATH" or "unix:PATH" read lines of the form'
+                         ' "ROLE [down|up]", "random:RATE" presses random triggers RATE times per second on average.'
+                         ' The distribution of the latencies of the player commands is reported periodically.')
+
+parser.add_argument('--duration', type=float,
+                    help='The number of seconds after which --headless stops firing triggers and the process exits.')
+
+parser.add_argument('--report', type=float, default=10.0,
+                    help='The number of seconds between two reports of the latency distribution for --headless.')
+
+parser.add_argument('--quiet', action='store_true', default=False,
+                    help='Does not log every gesture and command, but only problems and summaries. This is implied by'
+                         ' --headless, where logging every event would slow down the loop whose latency is measured.')
 
 parser.add_argument('--check_sink', type=str, help='Makes sure that the audio from this process is sent to an audio sink with the given device description.')
 parser.add_argument('--check_volume', type=str, help='Makes sure that the sink input used by this process is at the specified volume.')
@@ -50,119 +155,261 @@ def log(msg):
     print("{} {}".format(time.ctime(), msg))
 
 
-async def calibrate(display=None, forward_uniq=None, backward_uniq=None):
+def summarize(name, latencies):
     """
-    Waits for two trigger devices to be connected and asks the user to indicate their roles.
-    :param display: The Display object that should be used issue signals during the calibration process.
-    :param forward_uniq: The unique and persistent identifier of the device that should be used for the 'forward' trigger.
-                         If this is given and connected, the user won't be asked to actively participate in calibration.
-    :param backward_uniq: The unique and persistent identifier of the device that should be used for the 'backward' trigger.
-                         If this is given and connected, the user won't be asked to actively participate in calibration.
-    :return: A pair (forward, backward) of Trigger objects.
+    Logs statistics of a set of latencies.
+    :param name: A description of the latencies.
+    :param latencies: A list of nanosecond integers.
     """
+    if len(latencies) == 0:
+        log("{}: No commands.".format(name))
+        return
+    latencies = sorted(latencies)
+    n = len(latencies)
+    log("{}: n={}, mean={:.2f}ms, p50={:.2f}ms, p99={:.2f}ms, max={:.2f}ms".format(
+        name, n, sum(latencies) / n / 10 ** 6, latencies[n // 2] / 10 ** 6,
+        latencies[min(n - 1, int(n * 0.99))] / 10 ** 6, latencies[-1] / 10 ** 6))
 
-    while True:
-        triggers = []
-        log("Waiting for at least 2 trigger devices to be connected...")
 
-        if display is not None:
-            display.set_color(0, (0, 0, 255))
-            display.set_color(1, (0, 0, 255))
+async def attach(triggers, path):
+    """
+    Opens a trigger device, if it is of the supported kind and has not been opened yet.
+    :param triggers: A dict mapping device paths to the BluetoothTriggers that have been opened for them. The new
+                     trigger is added to it.
+    :param path: The path of the device file.
+    """
+    if path in triggers:
+        return
+    try:
+        trigger = await BluetoothTrigger.attach(path)
+    except (OSError, TriggerError) as e:
+        log("FAILED TO OPEN THE TRIGGER AT {}: {}".format(path, e))
+        return
+    if trigger is not None:  # Otherwise the device is of another kind, or has vanished again.
+        triggers[path] = trigger
 
-        while len(triggers) < 2:
-            triggers.clear()
 
-            await asyncio.sleep(0.2)
+def signal(display, ridx, rgb):
+    """
+    Indicates the progress of the calibration for a role to the user.
+    :param display: The Display object that should be used to issue the signal, or None.
+    :param ridx: The index of the role.
+    :param rgb: The color of the signal.
+    """
+    if display is not None:
+        display.set_color(ridx % len(display.colors), rgb)
 
-            try:
-                triggers = list(BluetoothTrigger.discover())
-            except TriggerError as te:
-                log("FAILED TO DISCOVER TRIGGERS: {}. Trying again...".format(str(te)))
-                pass
 
+def enough(uniqs, roles, known=None):
+    """
+    Decides whether enough trigger devices are connected for the calibration to begin.
+    :param uniqs: A collection of the unique identifiers of the connected devices.
+    :param roles: A sequence of the names of the roles that triggers are needed for.
+    :param known: A RoleMap recording the roles of devices that have been calibrated before, or None.
+    :return: Whether either all the recorded devices are connected, or enough devices to ask the user about.
+    """
+    return len(uniqs) >= len(roles) or (known is not None and all(known.uniq(r) in uniqs for r in roles))
 
-        log("Triggers connected!")
 
-        uniq2trig = {t.uniq: t for t in triggers}
+async def assign(triggers, roles, known=None, display=None):
+    """
+    Asks the user to indicate the roles of connected trigger devices.
+    :param triggers: A collection of the Trigger objects for the connected devices.
+    :param roles: A sequence of the names of the roles that triggers are needed for.
+    :param known: A RoleMap recording the roles of devices that have been calibrated before. Devices that are recorded
+                  in it take on their roles without the user having to participate. The roles that the user indicates
+                  are recorded in it.
+    :param display: The Display object that should be used issue signals during the calibration process.
+    :return: A dict mapping the names of the roles to Trigger objects.
+    :exception TriggerError: If one of the triggers fails before all roles have been assigned.
+    """
+    uniq2trig = {t.uniq: t for t in triggers}
+    assigned = {}
+
+    for ridx, role in enumerate(roles):
+        trigger = None if known is None else uniq2trig.get(known.uniq(role))
+        if trigger is None:
+            log("\tPlease trigger '{}' once!".format(role))
+            candidates = [t for t in triggers if t not in assigned.values()]
+            with TriggerHub(candidates) as hub:
+                event = await hub.next()
+                while not event.pressed:  # The release of a press that was meant for an earlier role.
+                    event = await hub.next()
+                trigger = event.source
+            log("\t'{}' triggered.".format(role))
+        assigned[role] = trigger
+        signal(display, ridx, (255, 255, 255))
+
+    log("CALIBRATION COMPLETE.")
+    if known is not None:
+        for role, trigger in assigned.items():
+            known.assign(trigger.uniq, role)
+        known.save()
+    return assigned
+
+
+async def calibrate(monitor, roles, known=None, display=None):
+    """
+    Waits for trigger devices to be connected and asks the user to indicate their roles.
+    :param monitor: The DeviceMonitor that reports input devices being connected and disconnected.
+    :param roles: A sequence of the names of the roles that triggers are needed for.
+    :param known: A RoleMap recording the roles of devices that have been calibrated before, see 'assign'.
+    :param display: The Display object that should be used issue signals during the calibration process.
+    :return: A dict mapping the names of the roles to Trigger objects.
+    """
 
-        while True:
+    opened = {}  # Maps device paths to BluetoothTriggers.
 
-            if display is not None:
-                display.set_color(0, (0, 0, 255))
-                display.set_color(0, (0, 0, 255))
+    def forget(trigger):
+        for path, t in list(opened.items()):
+            if t is trigger:
+                del opened[path]
+        trigger.close()
 
-            log("\tPlease trigger 'forward' once!")
-            loss = True
-            try:
-                forward = uniq2trig[forward_uniq]
-                await forward.next()
-                loss = False
-            except KeyError:
-                try:
-                    forward = (await first((t.next() for t in triggers))).source
-                    loss = False
-                except TriggerError:
-                    pass
-            except TriggerError:
-                pass
+    while True:
+        # Devices that are present already are opened right away, all others as soon as they are connected:
+        for path in monitor.devices:
+            await attach(opened, path)
 
-            if loss:
-                log("LOST CONNECTION TO A TRIGGER DURING CALIBRATION!")
-                break
+        log("Waiting for at least {} trigger devices to be connected...".format(len(roles)))
 
-            log("\tForward triggered.")
+        for ridx in range(len(roles)):
+            signal(display, ridx, (0, 0, 255))
 
-            if display is not None:
-                display.set_color(1, (255, 255, 255))
+        while not enough({t.uniq for t in opened.values()}, roles, known):
+            event = await monitor.next()
+            if event.added:
+                await attach(opened, event.path)
+            elif event.path in opened:
+                opened.pop(event.path).close()
 
-            log("\tPlease trigger 'backward' once!")
-            loss = True
-            try:
-                backward = uniq2trig[backward_uniq]
-                await backward.next()
-                loss = False
-            except KeyError:
-                try:
-                    loss = True
-                    backward = (await first((t.next() for t in triggers))).source
-                    loss = False
-                except TriggerError:
-                    pass
-            except TriggerError:
-                pass
+        log("Triggers connected!")
 
-            if loss:
-                log("LOST CONNECTION TO A TRIGGER DURING CALIBRATION!")
-                break
+        try:
+            assigned = await assign(list(opened.values()), roles, known, display)
+        except TriggerError as te:
+            log("LOST CONNECTION TO A TRIGGER DURING CALIBRATION!")
+            forget(te.trigger)
+            continue
 
-            log("\tBackward triggered.")
+        for t in opened.values():
+            if t not in assigned.values():
+                t.close()
+        return assigned
 
-            if display is not None:
-                display.set_color(0, (255, 255, 255))
 
-            if forward is backward:
-                log("Cannot use the same trigger for forward and backward! Please try again!")
-                continue
+async def calibrate_forwarded(receiver, roles, known=None, display=None):
+    """
+    Waits for trigger devices to be connected to another machine and asks the user to indicate their roles.
+    :param receiver: The TriggerReceiver via which the events of the devices are forwarded.
+    :param roles: A sequence of the names of the roles that triggers are needed for.
+    :param known: A RoleMap recording the roles of devices that have been calibrated before, see 'assign'.
+    :param display: The Display object that should be used issue signals during the calibration process.
+    :return: A dict mapping the names of the roles to RemoteTriggers.
+    """
+    log("Waiting for at least {} trigger devices to be connected to the forwarder...".format(len(roles)))
+
+    for ridx in range(len(roles)):
+        signal(display, ridx, (0, 0, 255))
+
+    while not enough(receiver.triggers.keys(), roles, known):
+        await receiver.changed()
 
-            log("CALIBRATION COMPLETE.")
-            return forward, backward
+    log("Triggers connected!")
 
+    # RemoteTriggers do not fail while the devices are absent, they just remain silent:
+    return await assign(list(receiver.triggers.values()), roles, known, display)
 
-async def measure_latency(awaitable):
+
+async def reattach(monitor, uniqs):
+    """
+    Waits for particular trigger devices to be connected again and opens them, leaving all other devices alone.
+    :param monitor: The DeviceMonitor that reports input devices being connected and disconnected.
+    :param uniqs: A container of the unique and persistent identifiers of the devices. The caller is expected to remove
+                  the identifier of every device that is yielded, and may add further ones while this is waiting.
+    :return: An asynchronous iterator of BluetoothTriggers, that ends once uniqs is empty.
+    """
+    while len(uniqs) > 0:
+        for path in monitor.devices:
+            if BluetoothTrigger.uniq_of(path) in uniqs:
+                opened = {}
+                await attach(opened, path)
+                if path in opened:
+                    yield opened[path]
+        if len(uniqs) > 0:
+            await monitor.next()
+
+
+async def measure_latency(awaitable, on_done=None, verbose=True):
     t0 = time.monotonic_ns()
     try:
         return await awaitable
     finally:
-        l = (time.monotonic_ns() - t0) / 10 ** 6
-        if l < 1:
-            log("Latency: <1ms")
-        else:
-            log("Latency: {:.1f}ms".format(l))
+        if on_done is not None:
+            on_done(time.monotonic_ns() - t0)
+        if verbose:
+            l = (time.monotonic_ns() - t0) / 10 ** 6
+            if l < 1:
+                log("Latency: <1ms")
+            else:
+                log("Latency: {:.1f}ms".format(l))
+
+
+async def execute(player, event, command, delay=None, recording=None, histograms=(), verbose=True):
+    """
+    Makes the player execute a transport command in response to a trigger event.
+    :param player: The player that is to execute the command.
+    :param event: The TriggerEvent that caused the command.
+    :param command: One of RequestType.PLAY, PAUSE, STOP, NEXT and PREVIOUS.
+    :param delay: If this is not None, the command is scheduled for this number of nanoseconds after the event.
+                  This requires the player to be a GroupPlayer or a RemotePlayer with a ClockEstimator.
+    :param recording: A Recording in which the command and its latency should be logged. For scheduled commands, the
+                      skew is logged instead of the latency.
+    :param histograms: An iterable of LatencyHistograms in which the latency (or skew) should be counted.
+    :param verbose: Whether the latency (or skew) should be logged.
+    """
+    def on_latency(latency_ns):
+        if recording is not None:
+            recording.latency(command, latency_ns)
+        for h in histograms:
+            h.add(latency_ns)
+
+    def log_nodes():
+        if verbose and isinstance(player, GroupPlayer):
+            for idx, (l, s) in enumerate(player.latencies):
+                log("\tNode {}: Latency {}, skew {}".format(idx, "?" if l is None else "{:.1f}ms".format(l / 10 ** 6),
+                                                           "?" if s is None else "{:.3f}ms".format(s / 10 ** 6)))
+
+    if recording is not None:
+        recording.command(command)
+
+    if delay is None:
+        try:
+            await measure_latency({RequestType.PLAY: player.play,
+                                   RequestType.PAUSE: player.pause,
+                                   RequestType.STOP: player.stop,
+                                   RequestType.NEXT: player.next,
+                                   RequestType.PREVIOUS: player.previous}[command](),
+                                  on_latency, verbose)
+        except ConnectionError as ce:
+            log("{} MAY HAVE BEEN LOST: {}".format(command, ce))
+        log_nodes()
+        return
+
+    def on_done(skew):
+        if not skew.cancelled() and skew.exception() is None:
+            on_latency(skew.result())
+            if verbose:
+                log("Skew: {:.3f}ms".format(skew.result() / 10 ** 6))
+            log_nodes()
+
+    (await player.schedule(event.time_ns + delay, command)).add_done_callback(on_done)
 
 
 async def main():
 
     args = parser.parse_args()
+    started = time.monotonic_ns()
 
     def on_window_closed():
         for t in asyncio.all_tasks():
@@ -170,10 +417,19 @@ async def main():
                 t.cancel()
 
     window = None
+    hub = None
+    gestures = None
+    recording = None
+    recorded = None
+    histograms = ()
+    monitor = None
+    receiver = None
     player = None
-    connection = None
-
-    backward_time = None
+    connections = []
+    clients = []
+    clocks = []
+    tasks = []
+    delay = None
 
     try:
         begin("Reading audio sequences")
@@ -184,22 +440,71 @@ async def main():
             sw, nc, fr = sequences[0][:3]
         done()
 
-        if args.remote is None:
+        if args.remote is None and args.unix is None:
             player = PyAudioPlayer(sw, nc, fr)
         else:
-            host, port = args.remote
-            begin("Connecting to {}:{}", host, port)
-            connection = await TCPConnection.open_outgoing(host, int(port))
-            player = RemotePlayer(PlayerClient(connection))
-            done()
+            if args.remote is not None:
+                if args.standby is not None:
+                    if len(args.remote) > 1:
+                        raise TrigsError("A standby server can only be given for a single remote server!")
+                    args.remote.append(args.standby)
+                for host, port in args.remote:
+                    begin("Connecting to {}:{}", host, port)
+                    connect = functools.partial(TCPConnection.open_outgoing, host, int(port))
+                    fast = await DatagramChannel.open(host, int(port)) if args.udp else None
+                    connections.append((await connect(), connect, fast))
+                    done()
+            else:
+                begin("Connecting to {}", args.unix)
+                ctype = SharedMemoryConnection if args.shm else UnixConnection
+                connect = functools.partial(ctype.open_outgoing, args.unix)
+                connections.append((await connect(), connect, None))
+                done()
+
+            def on_reconnect(t, resumed):
+                log("Reconnected after {:.1f}ms, {}.".format(t / 10 ** 6, "resuming the session" if resumed else
+                                                              "STARTING A NEW SESSION"))
+
+            if args.schedule is not None:
+                delay = int(args.schedule * 10 ** 6)
+            players = []
+            for connection, connect, fast in connections:
+                client = PlayerClient(connection, reconnect=connect, heartbeat=args.heartbeat, timeout=args.timeout,
+                                      on_reconnect=on_reconnect)
+                clients.append(client)
+                clock = None
+                # Groups need synchronized clocks to play in lockstep:
+                if args.schedule is not None or len(connections) > 1:
+                    clock = ClockEstimator(client)
+                    clocks.append(clock)
+                players.append(RemotePlayer(client,
+                                            chunk_size=None if args.shm else 2 ** 18,
+                                            compression=Compression.ZLIB if args.compress else Compression.NONE,
+                                            clock=clock, fast=fast))
+
+            if len(clocks) > 0:
+                begin("Synchronizing clocks")
+                await asyncio.gather(*(c.sync() for c in clocks))
+                tasks = [asyncio.create_task(c.run()) for c in clocks]
+                done()
+
+            if args.standby is not None:
+                player = FailoverPlayer(*players, on_failover=lambda t: log(
+                    "LOST CONNECTION TO THE PRIMARY SERVER! The standby server took over after {:.1f}ms.".format(
+                        t / 10 ** 6)))
+            else:
+                player = players[0] if len(players) == 1 else GroupPlayer(players)
 
         begin("Initializing playlist")
-        await player.clear_sequences()
-        for wav in sequences:
-            await player.append_sequence(wav)
+        await player.set_sequences(sequences)
         done()
 
-        if not args.virtual and not args.remote:
+        if isinstance(player, FailoverPlayer):
+            # Heartbeats are only sent from now on, such that the upload cannot delay them:
+            tasks.append(asyncio.create_task(player.run()))
+
+        testing = args.virtual or args.replay is not None or args.headless is not None
+        if not testing and args.remote is None and args.unix is None:
 
             d = pacmdlist()
 
@@ -258,92 +563,209 @@ async def main():
                 print("Did not find a PulseAudio sink input for my process!")
                 return
 
-        if args.virtual:
-            window = VirtualTriggerWindow([("Stop (Key: s)", "s"), ("Next (Key: k)", "k")], on_close=on_window_closed)
+        actions = [Action.parse(a) for a in args.actions]
+        roles = []  # Every trigger plays a role, named after its action.
+        for action in actions:
+            n = sum(1 for a in actions[:len(roles)] if a is action)
+            roles.append(action.value if n == 0 else "{} ({})".format(action.value, n + 1))
+
+        if args.replay is not None:
+            if not args.replay_speed > 0:
+                raise TrigsError("The replay speed must be positive!")
+            recorded = Recording.load(args.replay)
+            try:
+                triggers = {role: HeadlessTrigger(recorded.roles[role]) for role in roles}
+            except KeyError as ke:
+                raise TrigsError("The recording does not contain a trigger for the role {}!".format(ke))
+        elif args.headless is not None:
+            triggers = {role: HeadlessTrigger(role) for role in roles}
+            histograms = (LatencyHistogram(), LatencyHistogram())  # For the latest report and for the whole run.
+            headless = tuple(triggers.values())
+
+            def report_dropped():
+                dropped = sum(t.dropped for t in headless)
+                if dropped > 0:
+                    log("DROPPED {} TRIGGER EVENTS, because they were fired faster than they were processed!".format(
+                        dropped))
+        elif args.virtual:
+            keys = iter(k for k in "1234567890abcdefghijlmnopqrtuvwxyz" if k not in "ks")
+            lkpairs = []
+            for action, role in zip(actions, roles):
+                if action is Action.FORWARD and all(k != "k" for _, k in lkpairs):
+                    key = "k"
+                elif action is Action.BACKWARD and all(k != "s" for _, k in lkpairs):
+                    key = "s"
+                else:
+                    key = next(keys)
+                lkpairs.append(("{} (Key: {})".format(role.capitalize(), key), key))
+            window = VirtualTriggerWindow(lkpairs, on_close=on_window_closed)
+            triggers = dict(zip(roles, window.triggers))
+        elif args.forwarder is not None:
+            host, port = args.forwarder
+            window = Display(2, on_close=on_window_closed)
+            receiver = TriggerReceiver(functools.partial(TCPConnection.open_outgoing, host, int(port)),
+                                       heartbeat=args.heartbeat, timeout=args.timeout,
+                                       on_connect=lambda clock: log(
+                                           "Receiving trigger events from {}:{}, round trip delay {:.1f}ms.".format(
+                                               host, port, clock.delay / 10 ** 6)),
+                                       on_disconnect=lambda e: log(
+                                           "LOST CONNECTION TO THE FORWARDER {}:{}: {}".format(host, port, e)),
+                                       on_device=lambda t: log("Trigger {} {} the forwarder.".format(
+                                           t.uniq, "connected to" if t.present else "DISCONNECTED FROM")))
+            receiver.start()
+            triggers = await calibrate_forwarded(receiver, roles, known=RoleMap(args.roles), display=window)
         else:
             window = Display(2, on_close=on_window_closed)
+            monitor = DeviceMonitor()
+            triggers = await calibrate(monitor, roles, known=RoleMap(args.roles), display=window)
 
-        if args.virtual:
-            backward, forward = window.triggers
-        else:
-            forward, backward = await calibrate(display=window)
+        log("READY AFTER {:.3f}s.".format((time.monotonic_ns() - started) / 10 ** 9))
+
+        if args.record is not None or args.replay is not None:
+            recording = Recording()
+            for role, trigger in triggers.items():
+                recording.role(role, trigger.uniq)
+
+        mapping = []
+        for role, action in zip(roles, actions):
+            gesture = Gesture.DOUBLE if args.backward_double and action is Action.BACKWARD else Gesture.TAP
+            mapping.append((binding(gesture, triggers[role].uniq), action))
+        for gesture, members, action in args.gesture or ():
+            try:
+                uniqs = [triggers[role].uniq for role in members.split("+")]
+                mapping.append((binding(Gesture(gesture.lower()), *uniqs), Action.parse(action)))
+            except KeyError as ke:
+                raise TrigsError("Unknown role {} for --gesture! Choose from {}.".format(ke, ", ".join(roles)))
+            except ValueError as ve:
+                raise TrigsError("Invalid gesture '{} {}': {}".format(gesture, members, ve))
+
+        verbose = not (args.quiet or args.headless is not None)
+        engine = Engine(player, mapping, lambda event, command: execute(player, event, command, delay, recording,
+                                                                         histograms, verbose))
+        hub = TriggerHub(triggers.values())
+        debounce = args.debounce
+        if debounce is None:
+            debounce = 0 if args.headless is not None else 0.03
+        gestures = GestureRecognizer(hub if recording is None else recording.tap(hub), engine.keys, debounce=debounce, double=args.double_window,
+                                     long=args.long_press, chord=args.chord_window)
+
+        # Triggers that have lost their connection are reattached in the background, while the others remain in use:
+        lost = {}  # Maps the uniqs of lost triggers to pairs (role, time of loss).
+        recovery = None
+
+        async def recover():
+            async for trigger in reattach(monitor, lost):
+                role, t0 = lost.pop(trigger.uniq)
+                triggers[role] = trigger
+                hub.add(trigger)
+                log("RECONNECTED THE '{}' TRIGGER AFTER {:.3f}s.".format(role.upper(), (time.monotonic_ns() - t0) / 10 ** 9))
+
+        if recorded is not None:
+            control = asyncio.current_task()
+
+            async def drive():
+                n = await replay(recorded, {t.uniq: t for t in triggers.values()}, args.replay_speed)
+                # Give the last events the time to be recognized and to take effect:
+                await asyncio.sleep(max(args.double_window, args.long_press, args.chord_window) + 1)
+                log("Replayed {} trigger events.".format(n))
+                control.cancel()
+
+            tasks.append(asyncio.create_task(drive()))
+        elif args.headless is not None:
+            control = asyncio.current_task()
+            source = script(args.headless, triggers)
+
+            async def drive():
+                try:
+                    await asyncio.wait_for(source, args.duration)
+                except asyncio.TimeoutError:
+                    pass
+                # Give the last events the time to be recognized and to take effect:
+                await asyncio.sleep(max(args.double_window, args.long_press, args.chord_window) + 1)
+                control.cancel()
+
+            async def report():
+                while True:
+                    await asyncio.sleep(args.report)
+                    log("Latencies: {}".format(histograms[0].summary()))
+                    histograms[0].clear()
+                    report_dropped()
+
+            tasks.append(asyncio.create_task(drive()))
+            tasks.append(asyncio.create_task(report()))
 
         while True:
 
             try:
-                event = await first((forward.next(), backward.next()))
+                event = await gestures.next()
             except TriggerError as te:
-                if args.virtual:
+                if testing or receiver is not None:
                     raise
                 else:
-                    log("LOST CONNECTION TO THE '{}' TRIGGER!".format("FORWARD" if te.trigger is forward else "BACKWARD"))
-                    # Close the triggers, to make sure none of them remain grabbed:
-                    fu = forward.uniq
-                    bu = backward.uniq
-                    forward.close()
-                    backward.close()
-                    del forward, backward
-                    forward, backward = await calibrate(display=window, forward_uniq=fu, backward_uniq=bu)
+                    role = next(r for r, t in triggers.items() if t is te.trigger)
+                    log("LOST CONNECTION TO THE '{}' TRIGGER!".format(role.upper()))
+                    # Close the trigger, to make sure it does not remain grabbed, but keep using the others:
+                    hub.remove(te.trigger)
+                    te.trigger.close()
+                    lost[te.trigger.uniq] = (role, time.monotonic_ns())
+                    if recovery is None or recovery.done():
+                        recovery = asyncio.create_task(recover())
+                        tasks.append(recovery)
                     continue
 
-            if event.source is forward:
-                # If this happens while a sequence is still underway, ignore it.
-                if await player.status == PlayerStatus.PLAYING:
-                    log("IGNORED FORWARD, because sequence still playing!")
-                    continue
-                # Begin with the next sequence:
-                await measure_latency(player.play())
+            command = await engine.dispatch(event)
+
+            if verbose:
+                log("{} recognized after {:.1f}ms.".format(event, event.delay_ns / 10 ** 6))
+
+            if command is None:
+                if verbose:
+                    log("IGNORED {}.".format(event))
+                continue
 
-                if not args.virtual:
+            if isinstance(window, Display):
+                if command is RequestType.PLAY:
                     d = await player.duration
                     window.flash(0, (0, 255, 0), duration=d)
                     window.flash(1, (0, 255, 0), duration=d)
-
-                log("FORWARD!")
-            elif event.source is backward:
-                now = time.monotonic_ns()
-                delta = None if backward_time is None else (now - backward_time) / 10 ** 9
-                backward_time = now
-
-                if args.backward_double:
-                    if delta is None or delta > 0.5:
-                        continue
-
-                if await player.status != PlayerStatus.PLAYING:
-                    # If this happens while we are NOT playing a sequence, it happens while we are sitting in-between two
-                    # sequences. We then want to jump back to the predecessor sequence:
-                    await measure_latency(player.previous())
-
-                    if not args.virtual:
-                        window.flash(0, (255, 0, 0))
-                        window.flash(1, (255, 0, 0))
-
-                    log("BACKWARD!")
                 else:
-                    # The previous FORWARD was a mistake and should be undone. Since the only FORWARDs that ever take
-                    # effect are those that we receive while we are paused in-between sequences, we just have to stop
-                    # playback:
-                    await measure_latency(player.stop())
+                    window.flash(0, (255, 0, 0))
+                    window.flash(1, (255, 0, 0))
 
-                    if not args.virtual:
-                        window.flash(0, (255, 0, 0))
-                        window.flash(1, (255, 0, 0))
-
-                    log("UNDO!")
-            else:
-                log("UNKNOWN EVENT:", event)
+            if verbose:
+                log("{}!".format(command.name))
 
     except TrigsError as te:
         log(str(te))
     except asyncio.exceptions.CancelledError:
         log("Exiting.")
     finally:
+        if gestures is not None:
+            gestures.close()
+        if hub is not None:
+            hub.close()
+        if monitor is not None:
+            monitor.close()
+        if receiver is not None:
+            receiver.close()
+            log("Forwarding latencies: {}".format(receiver.latencies.summary()))
         if window is not None:
             window.close()
+        for t in tasks:
+            t.cancel()
         if player is not None:
             await player.terminate()
-        if connection is not None:
-            connection.close()
+        for client in clients:
+            client.connection.close()
+        if recording is not None:
+            if args.record is not None:
+                recording.save(args.record)
+            if recorded is not None:
+                summarize("Recorded latencies", recorded.latencies())
+            summarize("Latencies", recording.latencies())
+        if len(histograms) > 0:
+            log("Latencies over the whole run: {}".format(histograms[1].summary()))
+            report_dropped()
 
 
 if __name__ == '__main__':
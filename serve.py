@@ -3,10 +3,14 @@
 
 import argparse
 import asyncio
+import time
 
-from trigs.remote.protocol import PlayerServer, RequestType, ResponseType, pformat
+from trigs.remote.service import PlayerService
 from trigs.remote.tcp import TCPConnection
-from trigs.players.pyaudio import PyAudioPlayer, PlayerStatus
+from trigs.remote.udp import DatagramServer
+from trigs.remote.unix import UnixConnection
+from trigs.remote.shm import SharedMemoryConnection
+from trigs.players.pyaudio import PyAudioPlayer
 
 # region Argument parsing
 
@@ -15,6 +19,24 @@ parser = argparse.ArgumentParser(description='Serves as an audio player to which
 
 parser.add_argument('hostname', type=str, help='The host name for which this server should accept connections.')
 parser.add_argument('port', type=int, help='The port on which this server should listen for connections.')
+parser.add_argument('--unix', type=str, help='The path of a Unix domain socket on which this server should'
+                                             ' additionally listen for connections from the same machine.')
+parser.add_argument('--shm', action='store_true', default=False,
+                    help='Makes connections via the Unix domain socket pass large payloads in shared memory.'
+                         ' Clients need to use this option as well!')
+parser.add_argument('--udp', action='store_true', default=False,
+                    help='Additionally receives transport commands via UDP, on the same port number.')
+parser.add_argument('--timeout', type=float, help='The number of seconds after which the connection to a silent client'
+                                                  ' is closed. Clients need to send heartbeats more often than this.')
+parser.add_argument('--mute_on_loss', action='store_true', default=False,
+                    help='Mutes the player when the connection to the client that unmuted it is lost, rather than'
+                         ' terminated. Useful for the primary of a failover pair, together with --timeout.')
+parser.add_argument('--store', type=str,
+                    help='The path of a directory in which received sequences, the playlist and the transport state'
+                         ' are persisted. When the server is restarted, it restores them from there.')
+parser.add_argument('--backlog', type=int, default=16,
+                    help='The number of requests per client that may be waiting to be executed. Beyond this, the'
+                         ' server stops receiving from the client until it has caught up.')
 
 
 # endregion
@@ -24,111 +46,38 @@ async def main():
 
     args = parser.parse_args()
 
-    player = None
-    listener = None
+    t0 = time.monotonic()
+    service = PlayerService(PyAudioPlayer, directory=args.store, timeout=args.timeout, backlog=args.backlog,
+                            mute_on_loss=args.mute_on_loss)
+    listeners = []
 
     try:
+        if args.store is not None:
+            n = await service.restore()
+            print("Restored {} sequences of a playlist from {} in {:.0f}ms.".format(
+                n, args.store, (time.monotonic() - t0) * 1000))
+            listeners.append(asyncio.create_task(service.persist()))
+
         print("WARNING: The communication of this server is not secure! Everyone on the network can read and manipulate "
               "its communication! Use this server only in environments where this is not a concern!")
         print("Serving for {}:{}...".format(args.hostname, args.port))
-        server = PlayerServer()
-        listener = asyncio.create_task(TCPConnection.serve(args.hostname, args.port, server.serve_client))
-
-        while True:
-            request = await server.next_request()
-            rt = None
-            values = ()
-            try:
-
-                if request.rtype == RequestType.APPENDWAV:
-                    *swncfr, _ = request.args
-                    if player is None:
-                        player = PyAudioPlayer(*swncfr)
-                    await player.append_sequence(request.args)
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.GETNUMSEQUENCES:
-                    values = (0, ) if player is None else (player.num_sequences, )
-                    rt = ResponseType.VALUE
-                elif request.rtype == RequestType.CLEAR:
-                    if player is not None:
-                        await player.clear_sequences()
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.GETSTATUS:
-                    values = (PlayerStatus.STOPPED, ) if player is None else (await player.status, )
-                    rt = ResponseType.VALUE
-
-                if rt is not None:
-                    continue
-
-                if player is None:
-                    rt = ResponseType.ERROR_UNINITIALIZED
-                elif request.rtype == RequestType.GETVOLUME:
-                    values = (await player.volume, )
-                    rt = ResponseType.VALUE
-                elif request.rtype == RequestType.SETVOLUME:
-                    await player.set_volume(*values)
-                    rt = ResponseType.SUCCESS
-
-                if rt is not None:
-                    continue
-
-                if await player.num_sequences == 0:
-                    rt = ResponseType.ERROR_NOSEQUENCES
-                elif request.rtype == RequestType.GETSEQUENCE:
-                    sidx, = request.args
-                    values = tuple(*(await player.get_sequence(sidx)))
-                    rt = ResponseType.VALUE
-                elif request.rtype == RequestType.REMOVESEQUENCE:
-                    sidx, = request.args
-                    await player.remove_sequence(sidx)
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.GETDURATION:
-                    values = (await player.duration, )
-                    rt = ResponseType.VALUE
-                elif request.rtype == RequestType.PLAY:
-                    await player.play()
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.PAUSE:
-                    await player.pause()
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.STOP:
-                    await player.stop()
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.NEXT:
-                    await player.next()
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.PREVIOUS:
-                    await player.previous()
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.GETPOSITION:
-                    values = (await player.position, )
-                    rt = ResponseType.VALUE
-                elif request.rtype == RequestType.SETPOSITION:
-                    await player.set_position(*values)
-                    rt = ResponseType.SUCCESS
-                elif request.rtype == RequestType.TERMINATECONNECTION:
-                    rt = ResponseType.SUCCESS
-                else:
-                    raise NotImplementedError(request.rtype)
-
-            except NotImplementedError:
-                rt = ResponseType.ERROR_NOTIMPLEMENTED
-                values = ()
-            except:
-                rt = ResponseType.ERROR_UNKNOWN
-                values = ()
-            finally:
-                request.serve(rt, *values)
-                print("<-- {}".format(request))
-                print("\t--> {}".format(pformat(rt, *values)))
+        server = service.server
+        listeners.append(asyncio.create_task(TCPConnection.serve(args.hostname, args.port, server.serve_client)))
+        if args.udp:
+            print("Receiving transport commands via UDP on {}:{}...".format(args.hostname, args.port))
+            listeners.append(asyncio.create_task(DatagramServer.serve(args.hostname, args.port, server)))
+        if args.unix is not None:
+            print("Serving for {}...".format(args.unix))
+            ctype = SharedMemoryConnection if args.shm else UnixConnection
+            listeners.append(asyncio.create_task(ctype.serve(args.unix, server.serve_client)))
+
+        await asyncio.gather(*listeners)
 
     finally:
-        if listener is not None:
+        for listener in listeners:
             listener.cancel()
-        if player is not None:
-            player.terminate()
+        await service.terminate()
 
 
 if __name__ == '__main__':
     asyncio.run(main())
-
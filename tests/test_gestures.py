@@ -0,0 +1,101 @@
+import asyncio
+import time
+import unittest
+
+from trigs.triggers.base import Trigger, TriggerEvent
+from trigs.triggers.gestures import Gesture, GestureRecognizer, binding
+
+MS = 10 ** 6
+
+
+class Button(Trigger):
+    """
+    A trigger that never fires by itself. Its events are fed into the recognizer directly, so it also serves as a
+    source that never delivers anything.
+    """
+
+    async def next(self):
+        await asyncio.get_running_loop().create_future()
+
+    def close(self):
+        pass
+
+
+class GestureRecognizerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.a, self.b = Button('A'), Button('B')
+        self.errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: self.errors.append(context))
+        self.t0 = time.monotonic_ns()
+
+    def recognize(self, *keys, **kwargs):
+        recognizer = GestureRecognizer(Button('source'), keys, **kwargs)
+        self.addCleanup(recognizer.close)
+        return recognizer
+
+    def press(self, recognizer, trigger, ms, pressed=True):
+        recognizer.feed(TriggerEvent(trigger, self.t0 + ms * MS, pressed=pressed))
+
+    async def gestures(self, recognizer, n, timeout=2.0):
+        return [await asyncio.wait_for(recognizer.next(), timeout) for _ in range(n)]
+
+    async def test_tap(self):
+        r = self.recognize(binding(Gesture.TAP, 'A'))
+        self.press(r, self.a, 0)
+        g, = await self.gestures(r, 1, timeout=0.01)
+        self.assertEqual((g.gesture, g.key, g.time_ns), (Gesture.TAP, 'A', self.t0))
+
+    async def test_debounce(self):
+        r = self.recognize(binding(Gesture.TAP, 'A'), debounce=0.03)
+        self.press(r, self.a, 0)
+        self.press(r, self.a, 10)
+        self.press(r, self.a, 40)
+        gestures = await self.gestures(r, 2, timeout=0.01)
+        self.assertEqual([g.time_ns for g in gestures], [self.t0, self.t0 + 40 * MS])
+
+    async def test_double(self):
+        r = self.recognize(binding(Gesture.TAP, 'A'), binding(Gesture.DOUBLE, 'A'), double=0.1)
+        self.press(r, self.a, 0)
+        self.press(r, self.a, 50)
+        g, = await self.gestures(r, 1, timeout=0.01)
+        self.assertEqual(g.key, (Gesture.DOUBLE, 'A'))
+        # A single press becomes a tap once a double tap is impossible:
+        self.press(r, self.a, 200)
+        g, = await self.gestures(r, 1)
+        self.assertEqual((g.key, g.time_ns), ('A', self.t0 + 200 * MS))
+        self.assertGreaterEqual(g.delay_ns, 100 * MS)
+
+    async def test_long(self):
+        r = self.recognize(binding(Gesture.TAP, 'A'), binding(Gesture.LONG, 'A'), long=0.1)
+        self.press(r, self.a, -300)
+        self.press(r, self.a, -250, pressed=False)
+        self.press(r, self.a, -200)
+        self.press(r, self.a, -50, pressed=False)
+        gestures = await self.gestures(r, 2, timeout=0.01)
+        self.assertEqual([g.key for g in gestures], ['A', (Gesture.LONG, 'A')])
+
+    async def test_chord(self):
+        r = self.recognize(binding(Gesture.TAP, 'A'), binding(Gesture.TAP, 'B'), binding(Gesture.CHORD, 'A', 'B'))
+        self.press(r, self.a, 0)
+        self.press(r, self.b, 20)
+        g, = await self.gestures(r, 1, timeout=0.01)
+        self.assertEqual((g.key, g.time_ns), ((Gesture.CHORD, frozenset('AB')), self.t0 + 20 * MS))
+
+    async def test_chord_after_press(self):
+        r = self.recognize(binding(Gesture.TAP, 'A'), binding(Gesture.TAP, 'B'), binding(Gesture.DOUBLE, 'A'),
+                           binding(Gesture.CHORD, 'A', 'B'))
+        self.press(r, self.a, 0)
+        self.press(r, self.b, 60)
+        self.press(r, self.a, 70)
+        gestures = await self.gestures(r, 2, timeout=0.01)
+        self.assertEqual([(g.key, g.time_ns) for g in gestures],
+                         [('A', self.t0), ((Gesture.CHORD, frozenset('AB')), self.t0 + 70 * MS)])
+        # No timers must be left for the presses that have been resolved:
+        await asyncio.sleep(0.6)
+        self.assertEqual(self.errors, [])
+        self.assertEqual(len(r._gestures), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
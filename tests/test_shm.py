@@ -0,0 +1,31 @@
+import gc
+import os
+import unittest
+
+from trigs.remote.shm import _export, _import
+
+
+@unittest.skipUnless(os.path.isdir('/proc/self/fd'), "Counting file descriptors requires /proc.")
+class SharedMemoryTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        chunk = bytes(range(256)) * 1000
+        view = _import(_export(chunk))
+        self.assertEqual(bytes(view), chunk)
+        view.release()
+
+    def test_imports_do_not_leak_descriptors(self):
+        def count():
+            gc.collect()
+            return len(os.listdir('/proc/self/fd'))
+
+        _import(_export(bytes(4096))).release()
+        before = count()
+        for _ in range(50):
+            view = _import(_export(bytes(4096)))
+            view.release()
+        self.assertLessEqual(count(), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
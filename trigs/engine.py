@@ -0,0 +1,115 @@
+from enum import Enum
+
+from trigs.error import TrigsError
+from trigs.players.base import PlayerStatus
+from trigs.remote.protocol import RequestType
+
+
+class Action(Enum):
+    """
+    The things that a trigger can be configured to do.
+    """
+    FORWARD = 'forward'  # Plays the next sequence, unless a sequence is still playing.
+    BACKWARD = 'backward'  # Goes back to the previous sequence, or undoes a FORWARD if a sequence is still playing.
+    STOP = 'stop'  # Stops playback.
+    PAUSE = 'pause'  # Pauses playback.
+    NEXT = 'next'  # Skips to the next sequence, without playing it.
+    PREVIOUS = 'previous'  # Goes back to the previous sequence, without playing it.
+
+    @staticmethod
+    def parse(name):
+        """
+        Looks up an action by its name.
+        :param name: A string, for example 'forward'.
+        :return: An Action.
+        :exception TrigsError: If there is no action of the given name.
+        """
+        try:
+            return Action(name.lower())
+        except ValueError:
+            raise TrigsError("Unknown action '{}'! Choose from {}.".format(name, ", ".join(a.value for a in Action)))
+
+
+class Engine:
+    """
+    Makes a player react to trigger events, according to a mapping of triggers to actions.
+    The mapping is compiled into a dispatch table once, such that handling an event takes the same time no matter how
+    many triggers there are.
+    """
+
+    def __init__(self, player, mapping, execute):
+        """
+        Creates a new engine.
+        :param player: The Player object that is to be controlled.
+        :param mapping: An iterable of pairs (key, action), where 'key' is the unique identifier of a trigger or a
+                        key computed by trigs.triggers.gestures.binding, and 'action' is the Action that the trigger or
+                        gesture is to perform.
+        :param execute: A coroutine function that makes the player execute a command in response to an event. It is
+                        called with the TriggerEvent and a RequestType.
+        """
+        self._player = player
+        self._execute = execute
+        self._table = {}  # Maps the keys of events to coroutine functions that handle them.
+        for key, action in mapping:
+            self._table[key] = self._compile(action)
+
+    def _compile(self, action):
+        """
+        Creates a handler for the events of the triggers that are to perform an action.
+        :param action: An Action.
+        :return: A coroutine function that accepts a TriggerEvent and returns the RequestType that has been executed,
+                 or None if the event has been ignored.
+        """
+        player, execute = self._player, self._execute
+
+        if action is Action.FORWARD:
+            async def handle(event):
+                # If this happens while a sequence is still underway, ignore it.
+                if await player.status == PlayerStatus.PLAYING:
+                    return None
+                await execute(event, RequestType.PLAY)
+                return RequestType.PLAY
+        elif action is Action.BACKWARD:
+            async def handle(event):
+                if await player.status != PlayerStatus.PLAYING:
+                    # If this happens while we are NOT playing a sequence, it happens while we are sitting in-between
+                    # two sequences. We then want to jump back to the predecessor sequence:
+                    command = RequestType.PREVIOUS
+                else:
+                    # The previous FORWARD was a mistake and should be undone. Since the only FORWARDs that ever take
+                    # effect are those that we receive while we are paused in-between sequences, we just have to stop
+                    # playback:
+                    command = RequestType.STOP
+                await execute(event, command)
+                return command
+        else:
+            command = {Action.STOP: RequestType.STOP,
+                       Action.PAUSE: RequestType.PAUSE,
+                       Action.NEXT: RequestType.NEXT,
+                       Action.PREVIOUS: RequestType.PREVIOUS}[action]
+
+            async def handle(event):
+                await execute(event, command)
+                return command
+
+        return handle
+
+    @property
+    def keys(self):
+        """
+        The keys of the events that this engine reacts to.
+        :return: A tuple of unique identifiers of triggers and keys computed by trigs.triggers.gestures.binding.
+        """
+        return tuple(self._table.keys())
+
+    async def dispatch(self, event):
+        """
+        Makes the player react to a trigger event.
+        :param event: A TriggerEvent, for example a GestureEvent.
+        :return: The RequestType that the player has executed, or None if the event has been ignored, for example
+                 because no action is bound to its key.
+        """
+        handle = self._table.get(event.key)
+        if handle is None:
+            return None
+        return await handle(event)
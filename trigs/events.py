@@ -54,5 +54,9 @@ class Event:
         """
         return self._time_ns
 
+    def __lt__(self, other):
+        # Events are ordered by the time at which they occurred.
+        return self._time_ns < other.time_ns
+
     def __str__(self):
         return "Event from {}".format(self._source)
\ No newline at end of file
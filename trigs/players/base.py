@@ -39,6 +39,15 @@ class Player(abc.ABC):
         """
         pass
 
+    async def set_sequences(self, sequences):
+        """
+        Replaces the playlist of this player.
+        :param sequences: An iterable of objects that encode the sequences the playlist should consist of.
+        """
+        await self.clear_sequences()
+        for s in sequences:
+            await self.append_sequence(s)
+
     @property
     @abc.abstractmethod
     async def num_sequences(self):
@@ -57,6 +66,15 @@ class Player(abc.ABC):
         """
         pass
 
+    @property
+    @abc.abstractmethod
+    async def sequence_index(self):
+        """
+        The index of the current sequence in the playlist of this player.
+        :return: A nonnegative integer.
+        """
+        pass
+
     @property
     @abc.abstractmethod
     async def status(self):
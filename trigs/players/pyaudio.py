@@ -1,4 +1,7 @@
+import asyncio
+import heapq
 import io
+import threading
 import time
 
 import pyaudio
@@ -11,14 +14,24 @@ class PyAudioPlayer(Player):
     A player based on pyaudio.
     """
 
-    def __init__(self, sampwidth, nchannels, framerate, interval=1/100):
+    def __init__(self, sampwidth, nchannels, framerate, interval=1/100, on_end=None):
         """
         Launches a new audio player based on PyAudio (and thus libportaudio).
+        :param on_end: A procedure without arguments that is called whenever playback stops because the end of a
+                       sequence has been reached. It is called on the thread running the event loop that was running
+                       when this player was created.
         """
         super().__init__()
 
+        self._on_end = on_end
+        self._lock = threading.RLock()
+        self._loop = None if on_end is None else asyncio.get_running_loop()
+        self._scheduled = []
+        self._num_scheduled = 0
+
         self._status = PlayerStatus.STOPPED
-        self._volume = 1
+        self._volume = 1.0
+        self._muted = False
         self._sequences = []
         self._sidx = 0
         self._swncfr = (sampwidth, nchannels, framerate)
@@ -34,41 +47,129 @@ class PyAudioPlayer(Player):
                          stream_callback=self._produce,
                          output=True)
 
+    def atomic(self):
+        """
+        Makes changes to the state of this player take effect together: As long as the returned context manager is
+        entered, no audio is produced. It must thus only be held for very short periods of time.
+        :return: A context manager.
+        """
+        return self._lock
+
+    def schedule(self, t, command, *args, on_done=None):
+        """
+        Makes this player execute a transport command at a given point in time, with the accuracy of a single frame.
+        :param t: The time.monotonic_ns() time at which the effect of the command should become audible.
+        :param command: One of 'play', 'pause', 'stop', 'next', 'previous' and 'set_position'.
+        :param args: The arguments for the command.
+        :param on_done: A procedure that is called with the skew of the execution, i.e. with the number of
+                        nanoseconds by which the effect of the command became audible later than requested.
+                        It is called on the thread running the event loop that is running while this method is called.
+        """
+        try:
+            command = {'play': self._play, 'pause': self._pause, 'stop': self._stop, 'next': self._next,
+                       'previous': self._previous, 'set_position': self._set_position}[command]
+        except KeyError:
+            raise ValueError("{} is not a transport command that can be scheduled!".format(command))
+        if on_done is not None:
+            self._loop = asyncio.get_running_loop()
+        with self._lock:
+            # The counter makes sure that commands for the same time are executed in the order of scheduling.
+            heapq.heappush(self._scheduled, (t / 10 ** 9, self._num_scheduled, command, args, on_done))
+            self._num_scheduled += 1
+
     def _produce(self, _, frame_count, time_info, status):
-        now = time.monotonic()
+        with self._lock:
+            sw, nc, fr = self._swncfr
+            # The time at which the first frame of this buffer will be audible:
+            start = time.monotonic() + (time_info['output_buffer_dac_time'] - time_info['current_time'])
+            self._buffer.seek(0, io.SEEK_SET)
+            self._buffer.truncate()
+
+            # Scheduled commands split the buffer into segments:
+            done = 0
+            while len(self._scheduled) > 0:
+                t, _, command, args, on_done = self._scheduled[0]
+                k = max(done, round((t - start) * fr))
+                if k >= frame_count:
+                    break
+                heapq.heappop(self._scheduled)
+                self._render(k - done, start + done / fr)
+                done = k
+                at = start + k / fr
+                command(at, *args)
+                if on_done is not None:
+                    self._loop.call_soon_threadsafe(on_done, round((at - t) * 10 ** 9))
+
+            self._render(frame_count - done, start + done / fr)
+
+            r = self._buffer.getvalue()
+            assert len(r) == frame_count * nc * sw
+            return r, pyaudio.paContinue
+
+    def _render(self, n, at):
+        """
+        Writes frames into the output buffer.
+        :param n: The number of frames to write.
+        :param at: The time.monotonic() time at which the first of these frames will be audible.
+        """
+        if n == 0:
+            return
         sw, nc, fr = self._swncfr
-        self._buffer.seek(0, io.SEEK_SET)
         bs = b''
         offset, _ = self._offsetat
         if self._status == PlayerStatus.PLAYING:
-            bs = self._sequences[self._sidx][offset:offset + frame_count * nc * sw]
-            if len(bs) < frame_count * nc * sw: # We've reached the end of the current sequence!
+            bs = self._sequences[self._sidx][offset:offset + n * nc * sw]
+            if len(bs) < n * nc * sw:  # We've reached the end of the current sequence!
                 # Stop playback:
                 self._status = PlayerStatus.STOPPED
-                self._offsetat = (0, now)
+                self._offsetat = (0, at)
                 self._sidx = min(len(self._sequences) - 1, self._sidx + 1)
+                if self._on_end is not None:
+                    self._loop.call_soon_threadsafe(self._on_end)
             else:
-                self._offsetat = (offset + len(bs),
-                                  now + (time_info['output_buffer_dac_time'] - time_info['current_time']))
-
+                self._offsetat = (offset + len(bs), at + n / fr)
         elif self._status == PlayerStatus.STOPPED:
-            self._offsetat = (0, now)
+            self._offsetat = (0, at)
         elif self._status == PlayerStatus.PAUSED:
-            self.offsetat = (offset, now)
+            self._offsetat = (offset, at)
 
+        if self._muted:
+            bs = b''
         self._buffer.write(bs)
+        self._buffer.write(b'\00' * (n * nc * sw - len(bs)))
+
+    def _play(self, at):
+        self._status = PlayerStatus.PLAYING
+        self._offsetat = (self._offsetat[0], at)
 
-        self._buffer.write(b'\00' * ((self._frames_per_buffer - len(bs)) * nc * sw))
-        r = self._buffer.getvalue()
-        assert len(r) == frame_count * nc * sw
-        return (r, pyaudio.paContinue)
+    def _pause(self, at):
+        self._status = PlayerStatus.PAUSED
+        self._offsetat = (self._offsetat[0], at)
+
+    def _stop(self, at):
+        self._status = PlayerStatus.STOPPED
+        self._offsetat = (0, at)
+
+    def _next(self, at):
+        self._sidx = min(len(self._sequences) - 1, self._sidx + 1)
+        self._offsetat = (0, at)
+
+    def _previous(self, at):
+        self._sidx = max(0, self._sidx - 1)
+        self._offsetat = (0, at)
+
+    def _set_position(self, at, pos):
+        sw, nc, fr = self._swncfr
+        self._offsetat = (int(pos * fr) * (sw * nc), at)
+        if self._status == PlayerStatus.STOPPED and self._offsetat[0] > 0:
+            self._status = PlayerStatus.PAUSED
 
     async def append_sequence(self, data):
         if len(data) != 4:
             raise ValueError("The given sequence should be a 4-tuple holding WAV information and samples!")
         (*swncfr, data) = data
-        if not isinstance(data, bytes):
-            raise ValueError("The last entry of the 4-tuple must be a 'bytes' object!")
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise ValueError("The last entry of the 4-tuple must be a bytes-like object!")
 
         if tuple(swncfr) != self._swncfr:
             raise ValueError("The given WAV sequence has sample width {}, {} channels and framerate {}, "
@@ -79,7 +180,9 @@ class PyAudioPlayer(Player):
     async def remove_sequence(self, sidx):
         if self._sidx == sidx:
             await self.stop()
-        self._sequences.remove(sidx)
+        del self._sequences[sidx]
+        if self._sidx > sidx or self._sidx >= len(self._sequences):
+            self._sidx = max(0, self._sidx - 1)
 
     async def clear_sequences(self):
         await self.stop()
@@ -93,29 +196,33 @@ class PyAudioPlayer(Player):
     async def get_sequence(self, sidx):
         return self._sequences[sidx]
 
+    @property
+    async def sequence_index(self):
+        return self._sidx
+
     @property
     async def status(self):
         return self._status
 
     async def play(self):
-        self._status = PlayerStatus.PLAYING
-        self._offsetat = (self._offsetat[0], time.monotonic())
+        with self._lock:
+            self._play(time.monotonic())
 
     async def pause(self):
-        self._status = PlayerStatus.PAUSED
-        self._offsetat = (self._offsetat[0], time.monotonic())
+        with self._lock:
+            self._pause(time.monotonic())
 
     async def stop(self):
-        self._status = PlayerStatus.STOPPED
-        self._offsetat = (0, time.monotonic())
+        with self._lock:
+            self._stop(time.monotonic())
 
     async def next(self):
-        self._sidx = min(self.num_sequences - 1, self._sidx + 1)
-        self._offsetat = (0, time.monotonic())
+        with self._lock:
+            self._next(time.monotonic())
 
     async def previous(self):
-        self._sidx = max(0, self._sidx - 1)
-        self._offsetat = (0, time.monotonic())
+        with self._lock:
+            self._previous(time.monotonic())
 
     @property
     async def position(self):
@@ -128,10 +235,8 @@ class PyAudioPlayer(Player):
             return pos
 
     async def set_position(self, pos):
-        sw, nc, fr = self._swncfr
-        self._offsetat = (int(pos * fr) * (sw * nc), time.monotonic())
-        if self._status == PlayerStatus.STOPPED and self._offsetat[0] > 0:
-            self._status = PlayerStatus.PAUSED
+        with self._lock:
+            self._set_position(time.monotonic(), pos)
 
     @property
     async def duration(self):
@@ -145,6 +250,22 @@ class PyAudioPlayer(Player):
     async def set_volume(self, value):
         raise NotImplementedError("Cannot change the volume of a PyAudio stream!")
 
+    @property
+    async def muted(self):
+        """
+        Whether this player is muted. A muted player advances through its sequences as usual, but outputs silence.
+        :return: A bool.
+        """
+        return self._muted
+
+    async def set_muted(self, muted):
+        """
+        Mutes or unmutes this player. This takes effect with the next audio buffer.
+        :param muted: A bool.
+        """
+        with self._lock:
+            self._muted = muted
+
     async def terminate(self):
         if self._stream is not None:
             self._stream.close()
@@ -46,6 +46,10 @@ class VLCPlayer(Player):
     async def get_sequence(self, sidx):
         raise NotImplementedError("get_sequence")
 
+    @property
+    async def sequence_index(self):
+        raise NotImplementedError("sequence_index")
+
     async def terminate(self):
         if self._process is not None:
             self._process.terminate()
@@ -1,5 +1,6 @@
 import os.path
 import glob
+import hashlib
 import wave
 import io
 
@@ -43,3 +44,17 @@ def load_wav(path, chunk_size=44100):
                 if len(chunk) == 0:
                     return w, c, r, s.getvalue()
                 s.write(chunk)
+
+
+def wav_digest(wav):
+    """
+    Computes a digest that identifies a sequence by its content.
+    :param wav: A tuple (w, c, r, data), as returned by load_wav.
+    :return: A bytes object of length 32.
+    """
+    w, c, r, data = wav
+    h = hashlib.blake2b(digest_size=32)
+    h.update(bytes((w, c)))
+    h.update(r.to_bytes(4, 'big'))
+    h.update(data)
+    return h.digest()
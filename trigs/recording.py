@@ -0,0 +1,304 @@
+import array
+import asyncio
+import math
+import os
+import struct
+import sys
+import time
+from enum import Enum
+
+from trigs.error import TrigsError
+from trigs.remote.protocol import RequestType
+
+
+class RecordType(Enum):
+    """
+    The kinds of things that a Recording keeps track of.
+    """
+    PRESS = 0  # A trigger has been pressed. The subject is the uniq of the trigger.
+    RELEASE = 1  # A trigger has been released. The subject is the uniq of the trigger.
+    COMMAND = 2  # A command has been issued to the player. The subject is the RequestType.
+    LATENCY = 3  # The player has executed a command. The subject is the RequestType, the value the latency in ns.
+
+
+# Every record consists of this many 64 bit integers: The type, the subject, a time stamp and a value.
+_width = 4
+
+_magic = b'TRGREC'
+_version = 1
+_types = {t.value: t for t in RecordType}
+_requests = {t.value: t for t in RequestType}
+
+
+def _pack_string(s):
+    b = s.encode('utf-8')
+    return struct.pack('<H', len(b)) + b
+
+
+def _unpack_string(data, offset):
+    n, = struct.unpack_from('<H', data, offset)
+    offset += 2
+    return bytes(data[offset:offset + n]).decode('utf-8'), offset + n
+
+
+class Recording:
+    """
+    A log of the trigger events, player commands and response latencies of a run, kept in a flat array of integers
+    such that recording an entry costs next to nothing.
+    """
+
+    def __init__(self):
+        """
+        Creates a new, empty recording.
+        """
+        self._records = array.array('q')
+        self._uniqs = []  # The uniqs of the triggers, in the order in which they first appeared.
+        self._indices = {}  # Maps uniqs to their indices in self._uniqs.
+        self._roles = {}  # Maps role names to uniqs.
+
+    def __len__(self):
+        return len(self._records) // _width
+
+    def _index(self, uniq):
+        try:
+            return self._indices[uniq]
+        except KeyError:
+            idx = self._indices[uniq] = len(self._uniqs)
+            self._uniqs.append(uniq)
+            return idx
+
+    def role(self, role, uniq):
+        """
+        Records the role that a trigger plays, such that a replay can bind the same actions to it.
+        :param role: The name of the role.
+        :param uniq: The unique identifier of the trigger.
+        """
+        self._roles[role] = uniq
+        self._index(uniq)
+
+    @property
+    def roles(self):
+        """
+        The roles of the triggers.
+        :return: A dict mapping role names to uniqs.
+        """
+        return dict(self._roles)
+
+    def event(self, event):
+        """
+        Records a trigger event.
+        :param event: A TriggerEvent.
+        """
+        self._records.extend((RecordType.PRESS.value if event.pressed else RecordType.RELEASE.value,
+                              self._index(event.source.uniq), event.time_ns, 0))
+
+    def command(self, command, time_ns=None):
+        """
+        Records that a command has been issued to the player.
+        :param command: The RequestType of the command.
+        :param time_ns: The time at which the command was issued, in the format of time.monotonic_ns. By default, this
+                        is the current time.
+        """
+        self._records.extend((RecordType.COMMAND.value, command.value,
+                              time.monotonic_ns() if time_ns is None else time_ns, 0))
+
+    def latency(self, command, latency_ns, time_ns=None):
+        """
+        Records the time the player took to execute a command.
+        :param command: The RequestType of the command.
+        :param latency_ns: The latency, as a nanosecond integer.
+        :param time_ns: The time at which the command was completed, in the format of time.monotonic_ns. By default,
+                        this is the current time.
+        """
+        self._records.extend((RecordType.LATENCY.value, command.value,
+                              time.monotonic_ns() if time_ns is None else time_ns, latency_ns))
+
+    def __iter__(self):
+        """
+        Iterates over the entries of this recording, in the order in which they were recorded.
+        :return: An iterator of quadruples (rtype, subject, time_ns, value), where 'subject' is a uniq or a RequestType,
+                 depending on rtype.
+        """
+        r = self._records
+        for i in range(0, len(r), _width):
+            rtype = _types[r[i]]
+            if rtype is RecordType.PRESS or rtype is RecordType.RELEASE:
+                subject = self._uniqs[r[i + 1]]
+            else:
+                subject = _requests[r[i + 1]]
+            yield rtype, subject, r[i + 2], r[i + 3]
+
+    def latencies(self):
+        """
+        Lists the latencies recorded for the commands.
+        :return: A list of nanosecond integers.
+        """
+        r = self._records
+        return [r[i + 3] for i in range(0, len(r), _width) if r[i] == RecordType.LATENCY.value]
+
+    def tap(self, source):
+        """
+        Records the events that pass through a source of TriggerEvents.
+        :param source: An object with a 'next' coroutine function that returns TriggerEvents, for example a TriggerHub.
+        :return: An object with a 'next' coroutine function that returns the same TriggerEvents as the source.
+        """
+        recording = self
+
+        class Tap:
+            async def next(self):
+                event = await source.next()
+                recording.event(event)
+                return event
+
+        return Tap()
+
+    def save(self, path):
+        """
+        Writes this recording to a file.
+        :param path: The path of the file.
+        """
+        records = array.array('q', self._records)
+        if sys.byteorder != 'little':
+            records.byteswap()
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_magic + struct.pack('<HHH', _version, len(self._uniqs), len(self._roles)))
+            for uniq in self._uniqs:
+                f.write(_pack_string(uniq))
+            for role, uniq in self._roles.items():
+                f.write(_pack_string(role) + struct.pack('<H', self._indices[uniq]))
+            f.write(struct.pack('<Q', len(self)))
+            f.write(records.tobytes())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path):
+        """
+        Reads a recording from a file that has been written by Recording.save.
+        :param path: The path of the file.
+        :return: A Recording.
+        :exception TrigsError: If the file is not a recording.
+        """
+        with open(path, 'rb') as f:
+            data = memoryview(f.read())
+        try:
+            if bytes(data[:len(_magic)]) != _magic:
+                raise TrigsError("{} is not a trigs recording!".format(path))
+            version, nuniqs, nroles = struct.unpack_from('<HHH', data, len(_magic))
+            if version != _version:
+                raise TrigsError("{} has been recorded in an unsupported format!".format(path))
+            offset = len(_magic) + 6
+            recording = Recording()
+            for _ in range(nuniqs):
+                uniq, offset = _unpack_string(data, offset)
+                recording._index(uniq)
+            for _ in range(nroles):
+                role, offset = _unpack_string(data, offset)
+                idx, = struct.unpack_from('<H', data, offset)
+                offset += 2
+                recording._roles[role] = recording._uniqs[idx]
+            n, = struct.unpack_from('<Q', data, offset)
+            offset += 8
+            recording._records.frombytes(data[offset:offset + n * _width * 8])
+        except (struct.error, IndexError, UnicodeDecodeError, ValueError) as e:
+            raise TrigsError("{} is not a valid trigs recording!".format(path)) from e
+        if len(recording._records) != n * _width:
+            raise TrigsError("{} is truncated!".format(path))
+        if sys.byteorder != 'little':
+            recording._records.byteswap()
+        return recording
+
+
+class LatencyHistogram:
+    """
+    Keeps track of the distribution of a number of latencies in constant space, by counting them in logarithmically
+    spaced buckets. This is meant for runs that are too long to record every latency.
+    """
+
+    # The number of buckets per factor of 10. Percentiles are accurate to about 6 percent:
+    resolution = 20
+
+    def __init__(self):
+        """
+        Creates a new, empty histogram.
+        """
+        self._counts = array.array('q', [0] * (12 * LatencyHistogram.resolution))  # From 1ns up to 1000s.
+        self._n = 0
+        self._sum = 0
+        self._max = 0
+
+    def __len__(self):
+        return self._n
+
+    def add(self, latency_ns):
+        """
+        Counts a latency.
+        :param latency_ns: A nanosecond integer.
+        """
+        idx = 0 if latency_ns < 1 else int(math.log10(latency_ns) * LatencyHistogram.resolution)
+        self._counts[min(idx, len(self._counts) - 1)] += 1
+        self._n += 1
+        self._sum += latency_ns
+        self._max = max(self._max, latency_ns)
+
+    def percentile(self, p):
+        """
+        Approximates a percentile of the latencies that have been counted.
+        :param p: A number between 0 and 1, for example 0.99.
+        :return: A nanosecond number, which is the upper bound of the bucket that contains the percentile.
+        """
+        if self._n == 0:
+            raise ValueError("No latencies have been counted!")
+        rank = min(self._n - 1, int(self._n * p))
+        total = 0
+        for idx, c in enumerate(self._counts):
+            total += c
+            if total > rank:
+                return min(self._max, 10 ** ((idx + 1) / LatencyHistogram.resolution))
+        return self._max
+
+    def summary(self):
+        """
+        Describes the distribution of the latencies that have been counted.
+        :return: A string.
+        """
+        if self._n == 0:
+            return "n=0"
+        return "n={}, mean={:.2f}ms, p50={:.2f}ms, p99={:.2f}ms, p99.9={:.2f}ms, max={:.2f}ms".format(
+            self._n, self._sum / self._n / 10 ** 6, self.percentile(0.5) / 10 ** 6, self.percentile(0.99) / 10 ** 6,
+            self.percentile(0.999) / 10 ** 6, self._max / 10 ** 6)
+
+    def clear(self):
+        """
+        Forgets all latencies that have been counted.
+        """
+        for idx in range(len(self._counts)):
+            self._counts[idx] = 0
+        self._n = self._sum = self._max = 0
+
+
+async def replay(recording, triggers, speed=1.0):
+    """
+    Fires HeadlessTriggers the way the triggers of a recording were used.
+    :param recording: The Recording to replay.
+    :param triggers: A dict mapping the uniqs of the recorded triggers to HeadlessTriggers. Events of triggers that
+                     are not contained are skipped.
+    :param speed: The factor by which the replay is faster than the recording. Must be positive: The gestures the
+                  events are recognized as depend on the time between them.
+    :return: The number of events that have been fired.
+    """
+    if not speed > 0:
+        raise ValueError("The replay speed must be positive!")
+    events = [(rtype, uniq, t) for rtype, uniq, t, _ in recording
+              if (rtype is RecordType.PRESS or rtype is RecordType.RELEASE) and uniq in triggers]
+    if len(events) == 0:
+        return 0
+    t0 = events[0][2]
+    start = time.monotonic_ns()
+    for rtype, uniq, t in events:
+        at = start + int((t - t0) / speed)
+        delay = at - time.monotonic_ns()
+        if delay > 0:
+            await asyncio.sleep(delay / 10 ** 9)
+        triggers[uniq].fire(at, pressed=rtype is RecordType.PRESS)
+    return len(events)
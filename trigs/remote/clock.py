@@ -0,0 +1,116 @@
+import asyncio
+import collections
+import time
+
+from .protocol import RequestType
+
+
+class ClockEstimator:
+    """
+    Estimates how the clock of a remote server relates to time.monotonic_ns on the local machine, in the way NTP
+    does: Every measurement yields an offset between the clocks and the round trip delay with which it was obtained.
+    Offset and drift are then fitted to those measurements that suffered the smallest delays.
+    """
+
+    def __init__(self, client, window=32):
+        """
+        Creates a new clock estimator.
+        :param client: The PlayerClient via which the server is to be queried.
+        :param window: The number of most recent measurements to base the estimate on.
+        """
+        self._client = client
+        self._samples = collections.deque(maxlen=window)
+        self._reference = 0
+        self._offset = 0
+        self._drift = 0.0
+
+    async def measure(self):
+        """
+        Queries the clock of the server once and updates the estimate.
+        :return: A pair (offset, delay) of nanosecond integers for this measurement.
+        """
+        t0 = time.monotonic_ns()
+        t1, t2 = await self._client.request(RequestType.GETTIME)
+        t3 = time.monotonic_ns()
+        offset = ((t1 - t0) + (t2 - t3)) // 2
+        delay = (t3 - t0) - (t2 - t1)
+        self._samples.append(((t0 + t3) // 2, offset, delay))
+        self._fit()
+        return offset, delay
+
+    async def sync(self, rounds=8, interval=0.01):
+        """
+        Measures the clock of the server several times in quick succession.
+        :param rounds: The number of measurements.
+        :param interval: The time to wait in between two measurements, in seconds.
+        """
+        for _ in range(rounds):
+            await self.measure()
+            await asyncio.sleep(interval)
+
+    async def run(self, interval=2):
+        """
+        Keeps measuring the clock of the server, until cancelled.
+        :param interval: The time to wait in between two measurements, in seconds.
+        """
+        while True:
+            await self.measure()
+            await asyncio.sleep(interval)
+
+    def _fit(self):
+        """
+        Fits offset and drift to the measurements with the smallest delays.
+        """
+        best = sorted(self._samples, key=lambda s: s[2])[:max(2, len(self._samples) // 2)]
+        self._reference, self._offset, _ = best[0]
+        self._drift = 0.0
+        if len(best) < 2:
+            return
+        n = len(best)
+        mt = sum(t for t, _, _ in best) / n
+        mo = sum(o for _, o, _ in best) / n
+        var = sum((t - mt) ** 2 for t, _, _ in best)
+        if var < (10 ** 9) ** 2:  # Less than a second of spread in time says nothing about drift.
+            return
+        self._drift = sum((t - mt) * (o - mo) for t, o, _ in best) / var
+        self._reference, self._offset = int(mt), int(mo)
+
+    @property
+    def offset(self):
+        """
+        The current estimate of the difference between the clock of the server and the local clock.
+        :return: A number of nanoseconds.
+        """
+        t = time.monotonic_ns()
+        return self.to_server(t) - t
+
+    @property
+    def drift(self):
+        """
+        The estimated rate at which the offset changes, in nanoseconds per nanosecond.
+        """
+        return self._drift
+
+    @property
+    def delay(self):
+        """
+        The smallest round trip delay among the measurements the estimate is based on.
+        :return: A number of nanoseconds, or None if there are no measurements yet.
+        """
+        return min((d for _, _, d in self._samples), default=None)
+
+    def to_server(self, t):
+        """
+        Converts a local time into the clock domain of the server.
+        :param t: A time.monotonic_ns() time.
+        :return: A nanosecond integer.
+        """
+        return t + self._offset + round(self._drift * (t - self._reference))
+
+    def to_local(self, t):
+        """
+        Converts a time in the clock domain of the server into a local time.
+        :param t: A nanosecond integer.
+        :return: A time.monotonic_ns() time.
+        """
+        return round((t - self._offset + self._drift * self._reference) / (1 + self._drift))
@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+from trigs.players.base import PlayerStatus
+from .group import GroupPlayer
+from .protocol import RequestType
+
+
+class FailoverPlayer(GroupPlayer):
+    """
+    Represents a pair of remote players, a primary and a standby, that play the same playlist in lockstep, with only
+    the primary being audible. The primary is monitored by heartbeats. When these stop, the standby is unmuted and
+    takes over, at the position the primary had reached.
+    """
+
+    def __init__(self, primary, standby, interval=0.02, timeout=None, minimum_timeout=0.05, tolerance=0.02,
+                 on_failover=None, **kwargs):
+        """
+        Pairs two remote players.
+        :param primary: The RemotePlayer that should be audible as long as it is available.
+        :param standby: The RemotePlayer that should take over if the primary fails.
+        :param interval: The time between two heartbeats, in seconds.
+        :param timeout: The time after which a heartbeat that has not been answered is considered lost, in seconds. If
+                        this is None, the timeout is derived from the round trip delays of the heartbeats, the way TCP
+                        derives its retransmission timeout, such that a slow network does not cause failovers.
+        :param minimum_timeout: The lower bound for a timeout that is derived from round trip delays, in seconds.
+        :param tolerance: The difference in position, in seconds, from which on the standby is repositioned when it
+                          takes over.
+        :param on_failover: A procedure that is called with the failover time, once the standby has taken over.
+                            The failover time is the number of nanoseconds between the last heartbeat that the
+                            primary answered and the moment the standby was unmuted.
+        :param kwargs: Further arguments for GroupPlayer.
+        """
+        super().__init__((primary, standby), **kwargs)
+        self._primary = primary
+        self._standby = standby
+        self._interval = interval
+        self._timeout = timeout
+        self._minimum_timeout = minimum_timeout
+        self._srtt = None  # The smoothed round trip delay of the heartbeats, in seconds.
+        self._rttvar = None  # The smoothed deviation of the round trip delay, in seconds.
+        self._tolerance = tolerance
+        self._on_failover = on_failover
+        self._failing = asyncio.Lock()
+        self._alive = None
+        self._failover_time = None
+        self._silencing = None
+
+    @property
+    def active(self):
+        """
+        The member that is currently audible.
+        :return: A RemotePlayer object.
+        """
+        return self._players[0]
+
+    @property
+    def failover_time(self):
+        """
+        The number of nanoseconds between the last heartbeat that the primary answered and the moment the standby was
+        unmuted, or None if no failover has happened.
+        """
+        return self._failover_time
+
+    @property
+    def timeout(self):
+        """
+        The time after which a heartbeat that has not been answered is considered lost, in seconds.
+        """
+        if self._timeout is not None:
+            return self._timeout
+        if self._srtt is None:
+            return 1.0  # Nothing is known about the network yet.
+        return max(self._minimum_timeout, self._srtt + 4 * self._rttvar)
+
+    def _observe(self, delay):
+        """
+        Updates the estimate of the round trip delay of the heartbeats.
+        :param delay: The round trip delay of a heartbeat, in nanoseconds.
+        """
+        r = delay / 10 ** 9
+        if self._srtt is None:
+            self._srtt, self._rttvar = r, r / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - r)
+            self._srtt = 0.875 * self._srtt + 0.125 * r
+
+    async def _silence(self, player):
+        """
+        Makes a best effort to mute a player that has stopped answering heartbeats, and then stops communicating with
+        it.
+        :param player: The RemotePlayer to silence.
+        """
+        try:
+            await asyncio.wait_for(player.set_muted(True), self.timeout)
+        except (asyncio.TimeoutError, EOFError, ConnectionError):
+            pass
+        finally:
+            player.close()
+
+    async def _all(self, f):
+        """
+        Applies a coroutine function to all members concurrently. If the connection to the primary breaks down while
+        doing so, the standby takes over and the primary is left out of the results.
+        :param f: A coroutine function that accepts a RemotePlayer as its only argument.
+        :return: The list of results, in the order of the members that are left.
+        """
+        players = list(self._players)
+        results = await asyncio.gather(*(self._timed(p, f) for p in players), return_exceptions=True)
+        survivors = []
+        for p, r in zip(players, results):
+            if p is self._primary and isinstance(r, (EOFError, ConnectionError)):
+                await self._failover()
+            elif isinstance(r, BaseException):
+                raise r
+            else:
+                survivors.append(r)
+        return survivors
+
+    async def schedule(self, t, command, *args):
+        """
+        Makes both members execute a transport command at a given point in time.
+        :param t: The time.monotonic_ns() time at which the effect of the command should become audible.
+        :param command: One of RequestType.PLAY, PAUSE, STOP, NEXT, PREVIOUS and SETPOSITION.
+        :param args: The arguments for the command.
+        :return: A future that will hold the skew with which the standby executed the command. As the standby follows
+                 the primary in lockstep, this is the skew that remains audible after a failover.
+        """
+        return (await self._all(lambda p: self._schedule(p, t, command, args)))[-1]
+
+    async def run(self):
+        """
+        Mutes the standby and then monitors the primary by heartbeats, until a failover has happened.
+        This coroutine should be running for as long as this player is used, but should only be started once the
+        playlist has been set: Uploads would delay the heartbeats and thus cause spurious failovers.
+        """
+        await self._standby.set_muted(True)
+        await self._primary.set_muted(False)
+        # Make sure that the positions of both members are being tracked:
+        await self._primary.status
+        await self._standby.status
+
+        if self._primary.clock.delay is not None:
+            self._observe(self._primary.clock.delay)
+        self._alive = time.monotonic_ns()
+        while self._primary in self._players:
+            try:
+                _, delay = await asyncio.wait_for(self._primary.clock.measure(), self.timeout)
+            except (asyncio.TimeoutError, EOFError, ConnectionError):
+                await self._failover()
+                return
+            self._observe(delay)
+            self._alive = time.monotonic_ns()
+            await asyncio.sleep(self._interval)
+
+    async def _failover(self):
+        """
+        Makes the standby take over from the primary.
+        """
+        async with self._failing:
+            if self._primary not in self._players:
+                return
+            self._players.remove(self._primary)
+
+            # The position the primary has reached, according to the events it pushed last:
+            if self._primary.mirrored:
+                status, sidx = await self._primary.status, await self._primary.sequence_index
+                position = await self._primary.position
+            else:  # The primary has never pushed any events.
+                status = PlayerStatus.STOPPED
+
+            # The primary may merely be unreachable, but still playing, so we try to silence it in the meantime:
+            self._silencing = asyncio.create_task(self._silence(self._primary))
+
+            async with self._standby.batch(atomic=True) as b:
+                if status != PlayerStatus.STOPPED and await self._standby.sequence_index == sidx \
+                        and abs(await self._standby.position - position) > self._tolerance:
+                    if status == PlayerStatus.PLAYING:
+                        # The new position should be reached once the request has arrived:
+                        position += (self._standby.clock.delay or 0) / 2 / 10 ** 9
+                    b.set_position(position)
+                b.request(RequestType.SETMUTED, 0)
+
+            self._failover_time = time.monotonic_ns() - (self._alive or time.monotonic_ns())
+            if self._on_failover is not None:
+                self._on_failover(self._failover_time)
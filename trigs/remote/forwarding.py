@@ -0,0 +1,378 @@
+import asyncio
+import collections
+import functools
+import time
+
+from trigs.recording import LatencyHistogram
+from trigs.triggers.base import Trigger, TriggerEvent, TriggerError
+from trigs.triggers.bluetooth import BluetoothTrigger
+from trigs.triggers.hub import TriggerHub
+from .clock import ClockEstimator
+from .protocol import PlayerClient, PlayerServer, RequestType, ResponseType
+
+
+class TriggerForwarder:
+    """
+    Makes the trigger devices that are connected to this machine usable on another one: Devices are opened as soon as
+    they are connected, and their events are pushed to the subscribed clients of a PlayerServer, in TRIGGER messages
+    that carry the time stamps the kernel gave them. Clients can relate those to their own clocks via GETTIME
+    requests, which the server answers by itself. Devices that fail are closed and announced as absent, in DEVICE
+    messages, until they are connected again.
+    """
+
+    def __init__(self, monitor, timeout=None, backlog=16, verbose=True):
+        """
+        Creates a new forwarder.
+        :param monitor: The DeviceMonitor that reports input devices being connected and disconnected.
+        :param timeout: The number of seconds after which the connection to a client that has not sent anything is
+                        closed. Clients that use heartbeats must send them more often than this.
+        :param backlog: The number of requests per client that may be waiting to be handled.
+        :param verbose: Whether devices being opened and failing should be printed.
+        """
+        self._monitor = monitor
+        self._server = PlayerServer(self.handle, concurrent=(RequestType.SUBSCRIBE, RequestType.TERMINATECONNECTION),
+                                    timeout=timeout, backlog=backlog)
+        self._triggers = {}  # Maps device paths to BluetoothTriggers.
+        self._hub = TriggerHub()
+        self._verbose = verbose
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def server(self):
+        """
+        The PlayerServer that clients should be served by.
+        """
+        return self._server
+
+    @property
+    def triggers(self):
+        """
+        The triggers whose events are currently being forwarded.
+        :return: A tuple of BluetoothTriggers.
+        """
+        return tuple(self._triggers.values())
+
+    async def handle(self, request):
+        """
+        Handles a request that the server has received.
+        :param request: A PlayerServer.Request object.
+        :return: A pair (rt, values).
+        """
+        if request.rtype == RequestType.SUBSCRIBE:
+            self._server.subscribe(request.connection)
+            # The client learns about the devices that are present already before the subscription is confirmed:
+            for trigger in self._triggers.values():
+                await self._server.push(ResponseType.DEVICE, trigger.uniq.encode('utf-8'), True,
+                                        connections=(request.connection, ))
+            return ResponseType.SUCCESS, ()
+        elif request.rtype == RequestType.TERMINATECONNECTION:
+            return ResponseType.SUCCESS, ()
+        return ResponseType.ERROR_NOTIMPLEMENTED, ()
+
+    async def _attach(self, path):
+        """
+        Opens a device, if it is a trigger that has not been opened yet, and announces it to the clients.
+        :param path: The path of the device file.
+        """
+        if path in self._triggers:
+            return
+        try:
+            trigger = await BluetoothTrigger.attach(path)
+        except (OSError, TriggerError) as e:
+            if self._verbose:
+                print("Failed to open the trigger at {}: {}".format(path, e))
+            return
+        if trigger is None or path in self._triggers:
+            if trigger is not None:
+                trigger.close()
+            return
+        self._triggers[path] = trigger
+        self._hub.add(trigger)
+        if self._verbose:
+            print("Forwarding the events of {} ({}).".format(trigger.uniq, path))
+        await self._server.push(ResponseType.DEVICE, trigger.uniq.encode('utf-8'), True)
+
+    async def _detach(self, trigger):
+        """
+        Closes a trigger that has failed and announces its absence to the clients.
+        :param trigger: A BluetoothTrigger.
+        """
+        self._hub.remove(trigger)
+        trigger.close()
+        for path, t in list(self._triggers.items()):
+            if t is trigger:
+                del self._triggers[path]
+        if self._verbose:
+            print("Lost the connection to {}.".format(trigger.uniq))
+        await self._server.push(ResponseType.DEVICE, trigger.uniq.encode('utf-8'), False)
+
+    async def _watch(self):
+        """
+        Opens trigger devices as they are connected, until cancelled.
+        """
+        for path in self._monitor.devices:
+            await self._attach(path)
+        while True:
+            event = await self._monitor.next()
+            if event.added:
+                await self._attach(event.path)
+            # Devices that are disconnected fail, which _forward takes care of.
+
+    async def _forward(self):
+        """
+        Pushes the events of the triggers to the clients, until cancelled.
+        """
+        push, hub = self._server.push, self._hub
+        while True:
+            try:
+                event = await hub.next()
+            except TriggerError as te:
+                await self._detach(te.trigger)
+                continue
+            await push(ResponseType.TRIGGER, event.source.uniq.encode('utf-8'), event.time_ns, event.pressed)
+
+    async def run(self):
+        """
+        Opens trigger devices and forwards their events, until cancelled.
+        """
+        watch = asyncio.create_task(self._watch())
+        try:
+            await self._forward()
+        finally:
+            watch.cancel()
+
+    def close(self):
+        """
+        Stops forwarding and closes all triggers. The monitor is not closed.
+        """
+        self._hub.close()
+        for trigger in self._triggers.values():
+            trigger.close()
+        self._triggers.clear()
+
+
+class RemoteTrigger(Trigger):
+    """
+    A trigger device that is connected to another machine, from which a TriggerForwarder forwards its events. The
+    events carry time stamps in the local clock domain, that have been converted from the time stamps the kernel of
+    the other machine gave them.
+    """
+
+    def __init__(self, uniq, capacity=256):
+        """
+        Creates a new RemoteTrigger.
+        :param uniq: The unique identifier of the device.
+        :param capacity: The maximum number of events that are kept while nobody awaits them. Beyond this, the oldest
+                         events are dropped.
+        """
+        super().__init__(uniq)
+        self._events = collections.deque(maxlen=capacity)
+        self._waiter = None
+        self._closed = False
+        self.present = False  # Whether the device is currently connected to the other machine and reachable.
+
+    def deliver(self, time_ns, pressed):
+        """
+        Makes this trigger hand out an event that has been forwarded.
+        :param time_ns: The time at which the event occurred, as a nanosecond integer relative to the reference point
+                        of time.monotonic_ns.
+        :param pressed: Whether the device has been pressed, as opposed to released.
+        """
+        if self._closed:
+            return
+        self._events.append(TriggerEvent(self, time_ns, pressed=pressed))
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def next(self):
+        """
+        Waits for the device to be used one more time. While the device or the other machine cannot be reached, this
+        simply keeps waiting.
+        :return: A TriggerEvent.
+        :exception TriggerError: If this trigger has been closed.
+        """
+        while len(self._events) == 0:
+            if self._closed:
+                raise TriggerError("The remote trigger was closed!", self)
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._events.popleft()
+
+    def close(self):
+        """
+        Closes this instance. Events that have been forwarded before are still handed out.
+        """
+        self._closed = True
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+
+class TriggerReceiver:
+    """
+    Receives the events that a TriggerForwarder on another machine forwards, and hands them out via RemoteTriggers.
+    The clock of the other machine is estimated continuously, to convert the time stamps of the events. For every
+    event, the forwarding latency is measured, i.e. the time from the kernel of the other machine registering the
+    input to this object receiving it.
+    Whenever the connection breaks down, it is replaced, retrying with exponential backoff. In the meantime, the
+    triggers simply remain silent.
+    """
+
+    def __init__(self, connect, heartbeat=0.5, timeout=None, interval=2, backoff=(0.05, 5.0), on_connect=None,
+                 on_disconnect=None, on_device=None):
+        """
+        Creates a new receiver. Receiving starts with a call of 'start'.
+        :param connect: A coroutine function without arguments that opens a new Connection to the forwarder.
+        :param heartbeat: The number of seconds of silence after which a HEARTBEAT request is sent to the forwarder.
+        :param timeout: The number of seconds after which a HEARTBEAT request that has not been answered makes the
+                        receiver consider the connection broken. Defaults to four heartbeat intervals.
+        :param interval: The number of seconds between two measurements of the clock of the forwarder.
+        :param backoff: A pair (initial, maximum) of the number of seconds to wait between two attempts to connect.
+        :param on_connect: A procedure that is called with the ClockEstimator of a new connection, once the clock has
+                           been synchronized and events are being forwarded.
+        :param on_disconnect: A procedure that is called with the exception that broke a connection.
+        :param on_device: A procedure that is called with a RemoteTrigger whenever the device becomes present or
+                          absent.
+        """
+        self._connect = connect
+        self._heartbeat = heartbeat
+        self._timeout = timeout
+        self._interval = interval
+        self._backoff = backoff
+        self._on_connect = on_connect
+        self._on_disconnect = on_disconnect
+        self._on_device = on_device
+        self._triggers = {}  # Maps uniqs to RemoteTriggers.
+        self._latencies = LatencyHistogram()
+        self._waiter = None
+        self._task = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def triggers(self):
+        """
+        The triggers that are currently present.
+        :return: A dict mapping uniqs to RemoteTriggers.
+        """
+        return {uniq: t for uniq, t in self._triggers.items() if t.present}
+
+    @property
+    def latencies(self):
+        """
+        The forwarding latencies of the events received so far.
+        :return: A LatencyHistogram.
+        """
+        return self._latencies
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _trigger(self, uniq):
+        uniq = bytes(uniq).decode('utf-8')
+        try:
+            return self._triggers[uniq]
+        except KeyError:
+            trigger = self._triggers[uniq] = RemoteTrigger(uniq)
+            return trigger
+
+    def _present(self, trigger, present):
+        if trigger.present != present:
+            trigger.present = present
+            if self._on_device is not None:
+                self._on_device(trigger)
+            self._wake()
+
+    def _forwarded(self, clock, uniq, time_ns, pressed):
+        """
+        Hands out an event that has been forwarded. This procedure is called by the PlayerClient.
+        :param clock: The ClockEstimator for the connection via which the event was received.
+        """
+        received = time.monotonic_ns()
+        t = clock.to_local(time_ns)
+        self._latencies.add(received - t)
+        trigger = self._trigger(uniq)
+        self._present(trigger, True)
+        trigger.deliver(t, pressed)
+
+    def _announced(self, uniq, present):
+        self._present(self._trigger(uniq), present)
+
+    async def _receive(self, connection):
+        """
+        Synchronizes with the clock of the forwarder and subscribes to its events, then keeps measuring the clock until
+        the connection breaks down.
+        :param connection: The Connection to the forwarder.
+        """
+        client = PlayerClient(connection, heartbeat=self._heartbeat, timeout=self._timeout)
+        clock = ClockEstimator(client)
+        client.add_listener(functools.partial(self._forwarded, clock), ResponseType.TRIGGER)
+        client.add_listener(self._announced, ResponseType.DEVICE)
+        try:
+            await clock.sync()
+            await client.request(RequestType.SUBSCRIBE)
+            if self._on_connect is not None:
+                self._on_connect(clock)
+            await clock.run(self._interval)
+        finally:
+            client.close()
+
+    async def _run(self):
+        delay, maximum = self._backoff
+        while True:
+            try:
+                connection = await self._connect()
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(maximum, 2 * delay)
+                continue
+            delay = self._backoff[0]
+            try:
+                await self._receive(connection)
+            except (OSError, EOFError) as e:
+                if self._on_disconnect is not None:
+                    self._on_disconnect(e)
+            finally:
+                connection.close()
+                for trigger in self._triggers.values():
+                    self._present(trigger, False)
+            await asyncio.sleep(delay)
+
+    def start(self):
+        """
+        Starts connecting to the forwarder in the background.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def changed(self):
+        """
+        Waits for a device to become present or absent.
+        """
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+    def close(self):
+        """
+        Stops receiving and closes all triggers.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for trigger in self._triggers.values():
+            trigger.close()
@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+from trigs.players.base import Player
+from .protocol import RequestType
+
+
+class GroupPlayer(Player):
+    """
+    Represents a group of remote players that play the same playlist in lockstep, for example to feed several zones
+    of a PA system from separate machines.
+    Transport commands are scheduled on all members for the same point in time, such that their effects become audible
+    simultaneously. All other commands are sent to all members concurrently. Queries are answered by the first member.
+    """
+
+    def __init__(self, players, lead=0.05):
+        """
+        Groups a number of remote players.
+        :param players: A nonempty iterable of RemotePlayer objects. Each of them must have a ClockEstimator that
+                        has been synchronized.
+        :param lead: The minimum time, in seconds, between issuing a transport command and its execution. This must
+                     be long enough for the command to reach every member and to pass the output latency of its audio
+                     device. The actual lead is extended to twice the largest round trip delay observed by the clock
+                     estimators of the members.
+        """
+        super().__init__()
+        self._players = list(players)
+        if len(self._players) == 0:
+            raise ValueError("A GroupPlayer needs at least one member!")
+        if any(p.clock is None for p in self._players):
+            raise ValueError("Every member of a GroupPlayer must have a ClockEstimator!")
+        self._lead = int(lead * 10 ** 9)
+        self._latencies = {}
+        self._skews = {}
+
+    @property
+    def players(self):
+        """
+        The members of this group.
+        :return: A list of RemotePlayer objects.
+        """
+        return list(self._players)
+
+    @property
+    def latencies(self):
+        """
+        The performance of the members of this group for the most recent command.
+        :return: A list that contains a pair (latency, skew) for every member, where latency is the number of
+                 nanoseconds the member took to acknowledge the most recent command, and skew is the number of
+                 nanoseconds by which the most recent scheduled command became audible later than requested. Either
+                 entry may be None, if no such command has been completed yet.
+        """
+        return [(self._latencies.get(p), self._skews.get(p)) for p in self._players]
+
+    async def _timed(self, player, f):
+        """
+        Applies a coroutine function to a member and records its latency.
+        :param player: The member.
+        :param f: A coroutine function that accepts a RemotePlayer as its only argument.
+        :return: The result of the coroutine function.
+        """
+        t0 = time.monotonic_ns()
+        try:
+            return await f(player)
+        finally:
+            self._latencies[player] = time.monotonic_ns() - t0
+
+    async def _all(self, f):
+        """
+        Applies a coroutine function to all members concurrently and records their latencies.
+        :param f: A coroutine function that accepts a RemotePlayer as its only argument.
+        :return: The list of results, in the order of the members.
+        """
+        return await asyncio.gather(*(self._timed(p, f) for p in self._players))
+
+    async def _schedule(self, player, t, command, args):
+        """
+        Schedules a transport command on a member and makes sure that its skew is recorded.
+        :return: The future that will hold the skew.
+        """
+        skew = await player.schedule(t, command, *args)
+
+        def record(skew):
+            if not skew.cancelled() and skew.exception() is None:
+                self._skews[player] = skew.result()
+        skew.add_done_callback(record)
+        return skew
+
+    async def schedule(self, t, command, *args):
+        """
+        Makes all members execute a transport command at a given point in time.
+        :param t: The time.monotonic_ns() time at which the effect of the command should become audible.
+        :param command: One of RequestType.PLAY, PAUSE, STOP, NEXT, PREVIOUS and SETPOSITION.
+        :param args: The arguments for the command.
+        :return: A future that will hold the largest skew among the members, i.e. the number of nanoseconds by which
+                 the effect became audible later than requested on the member that was latest.
+        """
+        skews = await self._all(lambda p: self._schedule(p, t, command, args))
+
+        async def latest():
+            return max(await asyncio.gather(*skews))
+        return asyncio.ensure_future(latest())
+
+    async def _transport(self, command, *args):
+        """
+        Makes all members execute a transport command as soon as it can be done simultaneously.
+        :param command: One of RequestType.PLAY, PAUSE, STOP, NEXT, PREVIOUS and SETPOSITION.
+        :param args: The arguments for the command.
+        """
+        delay = max((p.clock.delay or 0) for p in self._players)
+        await self.schedule(time.monotonic_ns() + max(self._lead, 2 * delay), command, *args)
+
+    async def append_sequence(self, data):
+        await self._all(lambda p: p.append_sequence(data))
+
+    async def set_sequences(self, sequences):
+        """
+        Replaces the playlists of all members. The sequences are uploaded to all members in parallel.
+        :param sequences: An iterable of tuples (w, c, r, data), as returned by trigs.playlist.load_wav.
+        """
+        sequences = list(sequences)
+        await self._all(lambda p: p.set_sequences(sequences))
+
+    async def remove_sequence(self, sidx):
+        await self._all(lambda p: p.remove_sequence(sidx))
+
+    async def clear_sequences(self):
+        await self._all(lambda p: p.clear_sequences())
+
+    @property
+    async def num_sequences(self):
+        return await self._players[0].num_sequences
+
+    async def get_sequence(self, sidx):
+        return await self._players[0].get_sequence(sidx)
+
+    @property
+    async def sequence_index(self):
+        return await self._players[0].sequence_index
+
+    @property
+    async def status(self):
+        return await self._players[0].status
+
+    async def play(self):
+        await self._transport(RequestType.PLAY)
+
+    async def pause(self):
+        await self._transport(RequestType.PAUSE)
+
+    async def stop(self):
+        await self._transport(RequestType.STOP)
+
+    async def next(self):
+        await self._transport(RequestType.NEXT)
+
+    async def previous(self):
+        await self._transport(RequestType.PREVIOUS)
+
+    @property
+    async def position(self):
+        return await self._players[0].position
+
+    async def set_position(self, value):
+        await self._transport(RequestType.SETPOSITION, value)
+
+    @property
+    async def duration(self):
+        return await self._players[0].duration
+
+    @property
+    async def volume(self):
+        return await self._players[0].volume
+
+    async def set_volume(self, value):
+        await self._all(lambda p: p.set_volume(value))
+
+    async def terminate(self):
+        await asyncio.gather(*(p.terminate() for p in self._players), return_exceptions=True)
@@ -1,7 +1,111 @@
+import asyncio
 import time
 
-from trigs.players.base import Player
-from .protocol import RequestType
+from trigs.players.base import Player, PlayerStatus
+from trigs.playlist import wav_digest
+from .protocol import RequestType, Compression
+
+
+# The requests that must not be repeated if it is unknown whether the server has executed them:
+_unrepeatable = {RequestType.NEXT, RequestType.PREVIOUS, RequestType.APPENDWAV, RequestType.REMOVESEQUENCE}
+
+
+class Batch:
+    """
+    A number of requests to a remote player that are sent to the server in one message, when the batch is exited.
+    Each request made on the batch returns a future that holds the outcome of the request after the batch has been
+    exited.
+    """
+
+    def __init__(self, client, atomic=False):
+        """
+        Creates a new, empty batch.
+        :param client: The PlayerClient object that is used to communicate with the remote player.
+        :param atomic: Whether the server should apply the requests such that no audio is produced while only some of
+                       them have taken effect.
+        """
+        self._client = client
+        self._atomic = atomic
+        self._requests = []
+        self._futures = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None or len(self._requests) == 0:
+            for f in self._futures:
+                f.cancel()
+            return
+
+        error = None
+        for f, r in zip(self._futures, await self._client.batch(self._requests, atomic=self._atomic)):
+            if r.cancelled():
+                f.cancel()
+            elif r.exception() is not None:
+                f.set_exception(r.exception())
+                f.exception()  # The first error is raised below, so the others need not be reported as unretrieved.
+                error = error or r.exception()
+            else:
+                f.set_result(r.result())
+
+        if error is not None:
+            raise error
+
+    def request(self, command, *args):
+        """
+        Adds a request to this batch.
+        :param command: The RequestType.
+        :param args: The arguments for the request.
+        :return: A future that holds the outcome of the request after the batch has been exited.
+        """
+        f = asyncio.get_running_loop().create_future()
+        self._requests.append((command, args))
+        self._futures.append(f)
+        return f
+
+    def clear_sequences(self):
+        return self.request(RequestType.CLEAR)
+
+    def remove_sequence(self, sidx):
+        return self.request(RequestType.REMOVESEQUENCE, sidx)
+
+    @property
+    def num_sequences(self):
+        return self.request(RequestType.GETNUMSEQUENCES)
+
+    def play(self):
+        return self.request(RequestType.PLAY)
+
+    def pause(self):
+        return self.request(RequestType.PAUSE)
+
+    def stop(self):
+        return self.request(RequestType.STOP)
+
+    def next(self):
+        return self.request(RequestType.NEXT)
+
+    def previous(self):
+        return self.request(RequestType.PREVIOUS)
+
+    @property
+    def position(self):
+        return self.request(RequestType.GETPOSITION)
+
+    def set_position(self, value):
+        return self.request(RequestType.SETPOSITION, value)
+
+    @property
+    def duration(self):
+        return self.request(RequestType.GETDURATION)
+
+    @property
+    def volume(self):
+        return self.request(RequestType.GETVOLUME)
+
+    def set_volume(self, value):
+        return self.request(RequestType.SETVOLUME, value)
 
 
 class RemotePlayer(Player):
@@ -9,78 +113,360 @@ class RemotePlayer(Player):
     Represents a player that is running on a remote machine.
     """
 
-    def __init__(self, client, ttl=1/1000):
+    def __init__(self, client, chunk_size=2 ** 18, window=4, compression=Compression.NONE, progress=None,
+                 clock=None, fast=None):
         """
         Makes a remote player available as a local object.
-        :param client: The PlayerClient object that is used to communicate with the remote player.
-        :param ttl: The "time to live" of information queried from the remote player, in seconds.
-                    Certain information queried from
-                    the player will be cached for this amount of time. This assumes that the remote player does not
-                    change its state in a relevant way during that time and avoids unnecessary network traffic.
+        The status, sequence index, position and duration of the remote player are served from a local mirror that the
+        remote server keeps up to date by pushing events. The mirror is established on first use. If the client
+        reconnects and the server starts a new session, the mirror is established again, and the playlist that was set
+        last is restored, before any further request is sent.
+        :param client: The PlayerClient object that is used to communicate with the remote player. If this client
+                       replaces broken connections, requests that were pending when the connection broke down are
+                       repeated, unless repeating them could have an effect that was not requested.
+        :param chunk_size: The number of bytes in which sequences are uploaded to the server. If this is None,
+                           every sequence is uploaded as a whole, in a single request. This is preferable for
+                           connections that pass large chunks in shared memory.
+        :param window: The maximum number of chunks that may be underway to the server at the same time.
+        :param compression: The Compression to apply to the chunks that are uploaded.
+        :param progress: A procedure that is called with the number of bytes received by the server and the total
+                         number of bytes, whenever the server has received a chunk of a sequence.
+        :param clock: The trigs.remote.clock.ClockEstimator for the server. This is required for scheduling commands.
+        :param fast: A trigs.remote.udp.DatagramChannel to the server, via which transport commands are sent, in order
+                     not to be delayed by retransmissions on the connection of the client. NEXT and PREVIOUS are made
+                     idempotent by sending them only for the sequence index that the local mirror shows. The server
+                     answers them with the resulting state, which updates the mirror right away. A command that is not
+                     answered via the channel in time is sent via the client instead.
         """
         super().__init__()
         self._client = client
-        self._ttl = ttl
-        self._status_ttl = (None, None)
+        self._state = None
+        self._version = 0  # The version of the state in the mirror, see EventType.
+        self._chunk_size = chunk_size
+        self._window = window
+        self._compression = compression
+        self._progress = progress
+        self._clock = clock
+        self._fast = fast
+        self._sequences = None  # The playlist that was set last, as a pair (sequences, digests), if unchanged since.
+        self._restoring = None
+        client.add_listener(self._update)
+        client.add_session_listener(self._on_session)
+
+    def _update(self, et, status, sidx, position, duration, version):
+        """
+        Updates the local mirror of the remote player state. This procedure is called for every event that the server
+        pushes to our client. Events that are older than the state in the mirror are ignored: They may arrive late,
+        after the response to a command that was sent via the datagram channel.
+        """
+        if self._state is not None and version < self._version:
+            return
+        self._state = (status, sidx, position, duration, time.monotonic_ns())
+        self._version = version
+
+    def _on_session(self, resumed):
+        """
+        Makes sure that a new session with the server does not lack the state of the previous one. This procedure is
+        called by the client.
+        :param resumed: Whether the server resumed the previous session.
+        """
+        if resumed or (self._state is None and self._sequences is None) or self._restoring is not None:
+            return
+        # The server does not push events to a new session, so the mirror would freeze:
+        subscribed, self._state = self._state is not None, None
+        self._version = 0  # The versions of a new session start over.
+        self._restoring = asyncio.create_task(self._restore(subscribed))
+
+    async def _restore(self, subscribed):
+        """
+        Restores the playlist that was set last, if the server does not hold it anymore, and subscribes to state events
+        again.
+        :param subscribed: Whether the previous session was subscribed to state events.
+        """
+        try:
+            if self._sequences is not None:
+                sequences, digests = self._sequences
+                if [info[4] for info in await self._client.request(RequestType.GETPLAYLISTINFO)] != digests:
+                    await self._set_playlist(sequences, digests)
+            if subscribed and self._state is None:
+                await self._client.request(RequestType.SUBSCRIBE)
+        finally:
+            self._restoring = None
+
+    async def _mirror(self):
+        """
+        Retrieves the local mirror of the remote player state, subscribing to state events if necessary.
+        :return: A tuple (status, sidx, position, duration, t), where t is the time.monotonic_ns() at which the
+                 mirror was last updated.
+        """
+        if self._state is None:
+            await self._request(RequestType.SUBSCRIBE)
+        return self._state
+
+    async def _request(self, command, *args):
+        """
+        Sends a request to the server and awaits the response. If the connection breaks down while the request is
+        pending and the client replaces the connection, idempotent requests are repeated.
+        :param command: The RequestType.
+        :param args: The arguments for the request.
+        :return: The value the server responded with.
+        """
+        if self._restoring is not None:
+            await asyncio.shield(self._restoring)
+        try:
+            return await self._client.request(command, *args)
+        except ConnectionError:
+            if not self._client.reconnects or command in _unrepeatable:
+                raise
+            return await self._client.request(command, *args)
+
+    async def _transport(self, command, *args):
+        """
+        Sends a transport command to the server, preferably via the datagram channel.
+        :param command: One of RequestType.PLAY, PAUSE, STOP, NEXT, PREVIOUS and SETPOSITION.
+        :param args: The arguments for the command.
+        """
+        if self._fast is None:
+            return await self._request(command, *args)
+        if self._restoring is not None:
+            await asyncio.shield(self._restoring)
+        if command not in (RequestType.NEXT, RequestType.PREVIOUS):
+            try:
+                return await self._fast.request(command, *args)
+            except asyncio.TimeoutError:
+                # As the command is idempotent, it does not matter whether the server has received it already:
+                return await self._request(command, *args)
+
+        args = (await self.sequence_index, command, *args)
+        try:
+            result = await self._fast.request(RequestType.ATINDEX, *args)
+        except asyncio.TimeoutError:
+            result = await self._request(RequestType.ATINDEX, *args)
+        # A second command must not be sent for the old index, even if the events that report the new one are delayed:
+        if self._state is not None:
+            self._update(None, *result)
+
+    @property
+    def mirrored(self):
+        """
+        Whether the state of the remote player is mirrored locally, such that it can be read without any requests.
+        """
+        return self._state is not None
+
+    @property
+    def clock(self):
+        """
+        The ClockEstimator for the server, or None if commands cannot be scheduled.
+        """
+        return self._clock
+
+    async def schedule(self, t, command, *args):
+        """
+        Makes the remote player execute a transport command at a given point in time.
+        :param t: The time.monotonic_ns() time at which the effect of the command should become audible.
+        :param command: One of RequestType.PLAY, PAUSE, STOP, NEXT, PREVIOUS and SETPOSITION.
+        :param args: The arguments for the command.
+        :return: A future that will hold the skew of the execution, i.e. the number of nanoseconds by which the effect
+                 became audible later than requested.
+        """
+        if self._clock is None:
+            raise RuntimeError("Commands can only be scheduled for RemotePlayers that have a ClockEstimator!")
+        return await self._client.schedule(self._clock.to_server(t), command, *args)
+
+    def batch(self, atomic=False):
+        """
+        Groups a number of requests, such that they are sent to the server in one message:
+
+            async with player.batch() as b:
+                b.stop()
+                b.previous()
+                d = b.duration
+            print(d.result())
+
+        :param atomic: Whether the server should apply the requests such that no audio is produced while only some of
+                       them have taken effect. In that case the server stops executing requests after the first one
+                       that fails, and the batch may only contain transport requests, as well as set_muted and
+                       set_volume.
+        :return: A Batch object, to be used as an asynchronous context manager.
+        """
+        return Batch(self._client, atomic=atomic)
+
+    async def snapshot(self):
+        """
+        Queries the complete state of the remote player, in one round trip. This also updates the local mirror.
+        :return: A tuple (status, sidx, position, duration, volume).
+        """
+        status, sidx, position, duration, volume = await self._request(RequestType.GETSNAPSHOT)
+        if self._state is not None:
+            self._update(None, status, sidx, position, duration, self._version)
+        return status, sidx, position, duration, volume
+
+    async def playlist_info(self):
+        """
+        Queries information about all the sequences in the playlist of the remote player, without transferring the
+        sequences themselves.
+        :return: A list of tuples (duration, w, c, r, digest), where duration is given in seconds, w, c and r are the
+                 sample width, number of channels and frame rate of the sequence and digest is the digest computed by
+                 trigs.playlist.wav_digest.
+        """
+        return await self._request(RequestType.GETPLAYLISTINFO)
 
     async def clear_sequences(self):
-        await self._client.request(RequestType.CLEAR)
+        self._sequences = None
+        await self._request(RequestType.CLEAR)
 
     @property
     async def num_sequences(self):
-        return await self._client.request(RequestType.GETNUMSEQUENCES)
+        return await self._request(RequestType.GETNUMSEQUENCES)
 
     async def get_sequence(self, sidx):
-        return await self._client.request(RequestType.GETSEQUENCE, sidx)
+        return await self._request(RequestType.GETSEQUENCE, sidx)
 
     async def append_sequence(self, wav):
+        self._sequences = None
         (sw, nc, fr, data) = wav
-        await self._client.request(RequestType.APPENDWAV, sw, nc, fr, data)
+        await self._request(RequestType.APPENDWAV, sw, nc, fr, data)
+
+    async def set_sequences(self, sequences):
+        """
+        Replaces the playlist of the remote player. Only those sequences that the remote server does not hold yet are
+        transferred over the network. If the connection breaks down and is replaced, the procedure starts over.
+        :param sequences: An iterable of tuples (w, c, r, data), as returned by trigs.playlist.load_wav.
+        """
+        sequences = list(sequences)
+        digests = [wav_digest(wav) for wav in sequences]
+        await self._set_playlist(sequences, digests)
+        self._sequences = (sequences, digests)
+
+    async def _set_playlist(self, sequences, digests):
+        """
+        Makes the server hold the given sequences and sets them as its playlist. See set_sequences.
+        :param sequences: A list of tuples (w, c, r, data).
+        :param digests: The list of the digests of the sequences.
+        """
+        while True:
+            try:
+                held = await self._client.request(RequestType.QUERYDIGESTS, *digests)
+                for wav, d, h in zip(sequences, digests, held):
+                    if not h:
+                        if await self.upload(wav) != d:
+                            raise IOError("The server computed a different digest for an uploaded sequence!")
+                await self._client.request(RequestType.SETPLAYLIST, *digests)
+                return
+            except ConnectionError:
+                # Starting over is cheap, because the sequences that have been uploaded completely are not sent again:
+                if not self._client.reconnects:
+                    raise
+
+    async def upload(self, wav):
+        """
+        Transfers a sequence into the store of the remote server, in chunks. The sequence is not added to the playlist.
+        Other requests may be issued while the upload is underway, they will be interleaved with the chunks.
+        :param wav: A tuple (w, c, r, data), as returned by trigs.playlist.load_wav.
+        :return: The digest under which the server has stored the sequence.
+        """
+        if self._chunk_size is None:
+            return await self._client.request(RequestType.STOREWAV, *wav)
+
+        sw, nc, fr, data = wav
+        data = memoryview(data)
+        uid = await self._client.request(RequestType.BEGINUPLOAD, sw, nc, fr, len(data))
+
+        underway = set()
+        try:
+            for offset in range(0, len(data), self._chunk_size):
+                chunk = data[offset:offset + self._chunk_size]
+                compression = self._compression
+                compressed = compression.compress(chunk)
+                if len(compressed) >= len(chunk):
+                    compression, compressed = Compression.NONE, chunk
+
+                if len(underway) >= self._window:
+                    done, underway = await asyncio.wait(underway, return_when=asyncio.FIRST_COMPLETED)
+                    for d in done:
+                        received = d.result()
+                        if self._progress is not None:
+                            self._progress(received, len(data))
+
+                underway.add(asyncio.create_task(self._client.request(RequestType.UPLOADCHUNK,
+                                                                      uid, offset, compression, compressed)))
+            for d in asyncio.as_completed(underway):
+                received = await d
+                if self._progress is not None:
+                    self._progress(received, len(data))
+        finally:
+            for u in underway:
+                u.cancel()
+
+        return await self._client.request(RequestType.ENDUPLOAD, uid)
 
     async def remove_sequence(self, sidx):
-        await self._client.request(RequestType.REMOVESEQUENCE, sidx)
+        self._sequences = None
+        await self._request(RequestType.REMOVESEQUENCE, sidx)
 
     @property
-    async def status(self):
-        _, ts = self._status_ttl
-        now = time.monotonic_ns()
-        if ts is None or now - ts > self._ttl * 10 ** 9:
-            self._status_ttl = (await self._client.request(RequestType.GETSTATUS), now)
+    async def sequence_index(self):
+        return (await self._mirror())[1]
 
-        return self._status_ttl[0]
+    @property
+    async def status(self):
+        return (await self._mirror())[0]
 
     async def play(self):
-        await self._client.request(RequestType.PLAY)
+        await self._transport(RequestType.PLAY)
 
     async def pause(self):
-        await self._client.request(RequestType.PAUSE)
+        await self._transport(RequestType.PAUSE)
 
     async def stop(self):
-        await self._client.request(RequestType.STOP)
+        await self._transport(RequestType.STOP)
 
     async def next(self):
-        await self._client.request(RequestType.NEXT)
+        await self._transport(RequestType.NEXT)
 
     async def previous(self):
-        await self._client.request(RequestType.PREVIOUS)
+        await self._transport(RequestType.PREVIOUS)
 
     @property
     async def position(self):
-        return await self._client.request(RequestType.GETPOSITION)
+        status, _, position, duration, t = await self._mirror()
+        if status == PlayerStatus.PLAYING:
+            return min(duration, position + (time.monotonic_ns() - t) / 10 ** 9)
+        return position
 
     async def set_position(self, value):
-        await self._client.request(RequestType.SETPOSITION, value)
+        await self._transport(RequestType.SETPOSITION, value)
 
     @property
     async def duration(self):
-        return await self._client.request(RequestType.GETDURATION)
+        return (await self._mirror())[3]
 
     @property
     async def volume(self):
-        return await self._client.request(RequestType.GETVOLUME)
+        return await self._request(RequestType.GETVOLUME)
 
     async def set_volume(self, value):
-        await self._client.request(RequestType.SETVOLUME, value)
+        await self._request(RequestType.SETVOLUME, value)
+
+    async def set_muted(self, muted):
+        """
+        Mutes or unmutes the remote player. A muted player advances through its sequences as usual, but outputs
+        silence.
+        :param muted: A bool.
+        """
+        await self._request(RequestType.SETMUTED, int(muted))
+
+    def close(self):
+        """
+        Stops communicating with the remote player, without notifying the server. This is meant for servers that have
+        become unreachable.
+        """
+        self._client.close()
+        if self._fast is not None:
+            self._fast.close()
 
     async def terminate(self):
-        return await self._client.request(RequestType.TERMINATECONNECTION)
+        try:
+            return await self._request(RequestType.TERMINATECONNECTION)
+        finally:
+            self.close()
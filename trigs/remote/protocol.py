@@ -1,6 +1,10 @@
 import asyncio
+import collections
+import contextlib
 import io
 import struct
+import time
+import zlib
 from enum import Enum
 
 from trigs.players.base import PlayerStatus
@@ -21,12 +25,28 @@ class RequestType(Enum):
     GETVOLUME = 8
     GETDURATION = 9
     GETSTATUS = 10
+    GETSNAPSHOT = 11
+    SETMUTED = 12
     CLEAR = 100
     APPENDWAV = 101
     GETNUMSEQUENCES = 102
     GETSEQUENCE = 103
     REMOVESEQUENCE = 104
+    QUERYDIGESTS = 105
+    STOREWAV = 106
+    SETPLAYLIST = 107
+    BEGINUPLOAD = 108
+    UPLOADCHUNK = 109
+    ENDUPLOAD = 110
+    GETPLAYLISTINFO = 111
     TERMINATECONNECTION = 1001
+    SUBSCRIBE = 1002
+    BATCH = 1003
+    GETTIME = 1004
+    SCHEDULE = 1005
+    HELLO = 1006
+    HEARTBEAT = 1007
+    ATINDEX = 1008
 
 
 class ResponseType(Enum):
@@ -40,43 +60,391 @@ class ResponseType(Enum):
     ERROR_FORMAT = 4
     ERROR_UNINITIALIZED = 5
     ERROR_NOSEQUENCES = 6
+    EVENT = 7
+    ERROR_MISSING = 8
+    REPORT = 9
+    TRIGGER = 10
+    DEVICE = 11
 
 
-def c2b(c):
+class EventType(Enum):
     """
-    Converts a chunk, i.e. a Python object that can be part of a request, to a bytes object.
-    :param c: The Python object to be converted into bytes. Only certain types of objects are supported.
+    The types of events that a server pushes to its subscribed clients, in the form of EVENT responses.
+    Every EVENT carries the complete player state (status, sequence index, position, duration) and its version, the
+    event type only indicates the most significant change that caused it. The version is incremented with every change
+    of the state, such that clients can tell whether an EVENT is older than a state they have learned about otherwise.
+    """
+    POSITION = 0
+    STATUS = 1
+    SEQUENCE = 2
+    ENDOFSEQUENCE = 3
+
+
+class Compression(Enum):
+    """
+    The ways in which the chunks of an upload can be compressed.
+    """
+    NONE = 0
+    ZLIB = 1
+
+    def compress(self, data):
+        """
+        Compresses a chunk of data.
+        :param data: A bytes-like object.
+        :return: A bytes-like object.
+        """
+        if self == Compression.ZLIB:
+            return zlib.compress(data, 1)
+        return data
+
+    def decompress(self, data, limit=None):
+        """
+        Reverses the compression of a chunk of data.
+        :param data: A bytes-like object.
+        :param limit: The maximum number of bytes the decompressed chunk may take up, or None. Decompression stops
+                      as soon as this is exceeded, such that small chunks cannot make the receiver allocate huge
+                      amounts of memory.
+        :return: A bytes-like object.
+        :exception ValueError: If the data is corrupt, or would exceed the limit.
+        """
+        if self == Compression.ZLIB:
+            d = zlib.decompressobj()
+            try:
+                # A max_length of 0 would mean no limit at all, so we allow one byte more than the limit:
+                data = d.decompress(data, 0 if limit is None else limit + 1)
+            except zlib.error as e:
+                raise ValueError("The chunk could not be decompressed: {}".format(e))
+            if len(d.unconsumed_tail) > 0 or not d.eof:
+                raise ValueError("The chunk is incomplete, or decompresses to more than {} bytes!".format(limit))
+        if limit is not None and len(data) > limit:
+            raise ValueError("The chunk takes up more than {} bytes!".format(limit))
+        return data
+
+
+class Nanoseconds(int):
+    """
+    A signed integer number of nanoseconds. In a Layout, this type stands for a signed 8 byte integer, in contrast to
+    int, which stands for an unsigned 4 byte integer.
+    """
+    pass
+
+
+class Layout:
+    """
+    The way in which the values of one kind of message are encoded. A message is a tag (a RequestType or a
+    ResponseType), followed by values of fixed types. The tag and all values of fixed size are packed into the first
+    chunk of the message by a single precompiled struct.Struct, every bytes value forms a chunk of its own.
+    """
+
+    # The struct format characters for the types of values of fixed size:
+    _codes = {int: 'I', bool: '?', float: 'd', Nanoseconds: 'q', PlayerStatus: 'B', EventType: 'B',
+              Compression: 'B', RequestType: 'H', ResponseType: 'B'}
+
+    _tag = struct.Struct('>H')
+
+    def __init__(self, *types, variadic=False, nested=False):
+        """
+        Compiles a new layout.
+        :param types: The types of the values of the message, in order. Apart from bytes, these must be keys of
+                      Layout._codes.
+        :param variadic: Whether the message is followed by any number of further bytes values. Their number is packed
+                         along with the values of fixed size.
+        :param nested: Whether the message is followed by any number of further messages, that take up all its
+                       remaining chunks.
+        """
+        self.types = types
+        self.variadic = variadic
+        self.nested = nested
+        fixed = [t for t in types if t is not bytes]
+        codes = ''.join(Layout._codes[t] for t in fixed) + ('I' if variadic else '')
+        self._head = struct.Struct('>H' + codes)
+        self._body = struct.Struct('>' + codes)
+        self._blobs = tuple(idx for idx, t in enumerate(types) if t is bytes)
+        # Looking up enum members by value in a dict is much faster than calling the enum type:
+        self._enums = tuple((idx, {m.value: m for m in t}) for idx, t in enumerate(fixed) if issubclass(t, Enum))
+        self._simple = len(self._blobs) == 0 and len(self._enums) == 0 and not variadic and not nested
+
+    def pack(self, tag, *values):
+        """
+        Encodes a message.
+        :param tag: The integer value of the RequestType or ResponseType of the message.
+        :param values: The values of the message, one for every type of this layout. For variadic layouts, these are
+                       followed by the extra bytes values, for nested layouts by the chunks of the nested messages.
+        :return: A list of bytes-like objects, the chunks of the message.
+        """
+        if self._simple:
+            return [self._head.pack(tag, *values)]
+        n = len(self.types)
+        fixed = [v for idx, v in enumerate(values[:n]) if idx not in self._blobs]
+        for idx, _ in self._enums:
+            fixed[idx] = fixed[idx]._value_
+        blobs = [values[idx] for idx in self._blobs]
+        if self.variadic:
+            fixed.append(len(values) - n)
+        return [self._head.pack(tag, *fixed), *blobs, *values[n:]]
+
+    def unpack(self, chunks, idx=0):
+        """
+        Decodes a message.
+        :param chunks: A sequence of bytes-like objects.
+        :param idx: The index of the chunk at which the message begins.
+        :return: A pair (values, idx), where values is the list of the values of the message and idx is the index of
+                 the first chunk after the message. For nested layouts, the values are followed by the chunks of the
+                 nested messages.
+        """
+        head = chunks[idx]
+        if len(head) != self._head.size:
+            raise IOError("Expected a message head of {} bytes, but received {}!".format(self._head.size, len(head)))
+        if self._simple:
+            return list(self._body.unpack_from(head, 2)), idx + 1
+        fixed = list(self._body.unpack_from(head, 2))
+        idx += 1
+        try:
+            for i, members in self._enums:
+                fixed[i] = members[fixed[i]]
+        except KeyError as e:
+            raise IOError("Received an unknown enum value: {}".format(e))
+        n = len(self._blobs) + (fixed.pop() if self.variadic else 0)
+        if self.nested:
+            n = len(chunks) - idx
+        if idx + n > len(chunks):
+            raise IOError("The message announced more chunks than it consists of!")
+        blobs = iter(chunks[idx:idx + len(self._blobs)])
+        fixed = iter(fixed)
+        values = [next(blobs) if t is bytes else next(fixed) for t in self.types]
+        values.extend(chunks[idx + len(self._blobs):idx + n])
+        return values, idx + n
+
+    @staticmethod
+    def peek(chunks, idx=0):
+        """
+        Determines the tag of a message.
+        :param chunks: A sequence of bytes-like objects.
+        :param idx: The index of the chunk at which the message begins.
+        :return: The integer value of the RequestType or ResponseType of the message.
+        """
+        return Layout._tag.unpack_from(chunks[idx])[0]
+
+
+_nothing = Layout()
+_float = Layout(float)
+_int = Layout(int)
+_bytes = Layout(bytes)
+_event = Layout(EventType, PlayerStatus, int, float, float, int)
+_report = Layout(int, Nanoseconds)
+_trigger = Layout(bytes, Nanoseconds, bool)
+_device = Layout(bytes, bool)
+
+# Maps every RequestType to a pair (arguments, value), where arguments is the Layout of the request and value is the
+# Layout of the VALUE response to it:
+schema = {
+    RequestType.PLAY: (_nothing, _nothing),
+    RequestType.PAUSE: (_nothing, _nothing),
+    RequestType.STOP: (_nothing, _nothing),
+    RequestType.NEXT: (_nothing, _nothing),
+    RequestType.PREVIOUS: (_nothing, _nothing),
+    RequestType.SETPOSITION: (_float, _nothing),
+    RequestType.GETPOSITION: (_nothing, _float),
+    RequestType.SETVOLUME: (_float, _nothing),
+    RequestType.GETVOLUME: (_nothing, _float),
+    RequestType.GETDURATION: (_nothing, _float),
+    RequestType.GETSTATUS: (_nothing, Layout(PlayerStatus)),
+    RequestType.GETSNAPSHOT: (_nothing, Layout(PlayerStatus, int, float, float, float)),
+    RequestType.SETMUTED: (Layout(bool), _nothing),
+    RequestType.CLEAR: (_nothing, _nothing),
+    RequestType.APPENDWAV: (Layout(int, int, int, bytes), _nothing),
+    RequestType.GETNUMSEQUENCES: (_nothing, _int),
+    RequestType.GETSEQUENCE: (_int, _bytes),
+    RequestType.REMOVESEQUENCE: (_int, _nothing),
+    RequestType.QUERYDIGESTS: (Layout(variadic=True), _bytes),
+    RequestType.STOREWAV: (Layout(int, int, int, bytes), _bytes),
+    RequestType.SETPLAYLIST: (Layout(variadic=True), _nothing),
+    RequestType.BEGINUPLOAD: (Layout(int, int, int, int), _int),
+    RequestType.UPLOADCHUNK: (Layout(int, int, Compression, bytes), _int),
+    RequestType.ENDUPLOAD: (_int, _bytes),
+    RequestType.GETPLAYLISTINFO: (_nothing, _bytes),
+    RequestType.TERMINATECONNECTION: (_nothing, _nothing),
+    RequestType.SUBSCRIBE: (_nothing, _nothing),
+    RequestType.BATCH: (Layout(bool, nested=True), Layout(nested=True)),
+    RequestType.GETTIME: (_nothing, Layout(Nanoseconds, Nanoseconds)),
+    RequestType.SCHEDULE: (Layout(int, Nanoseconds, nested=True), _nothing),
+    RequestType.HELLO: (_bytes, Layout(bytes, bool)),
+    RequestType.HEARTBEAT: (_nothing, _nothing),
+    RequestType.ATINDEX: (Layout(int, nested=True), Layout(PlayerStatus, int, float, float, int)),
+}
+
+# The requests an atomic batch may consist of. Executing them never has to wait for anything, which is what allows the
+# server to keep the player from producing audio while they are being executed:
+atomic_requests = frozenset({RequestType.PLAY, RequestType.PAUSE, RequestType.STOP, RequestType.NEXT,
+                             RequestType.PREVIOUS, RequestType.SETPOSITION, RequestType.SETMUTED,
+                             RequestType.SETVOLUME})
+
+# Enum attributes are comparatively slow to access, so the codec looks up everything it needs in these tables:
+_arguments = {rt: (rt.value, arguments) for rt, (arguments, _) in schema.items()}
+_requests = {rt.value: (rt, arguments) for rt, (arguments, _) in schema.items()}
+_values = {rt: value for rt, (_, value) in schema.items()}
+_pushed = {ResponseType.EVENT: _event, ResponseType.REPORT: _report, ResponseType.TRIGGER: _trigger,
+           ResponseType.DEVICE: _device}
+_responses = {rt: (rt.value, _pushed.get(rt, _nothing)) for rt in ResponseType}
+_response_types = {rt.value: rt for rt in ResponseType}
+
+
+def encode_request(rt, *args):
+    """
+    Encodes a request.
+    :param rt: The RequestType.
+    :param args: The arguments of the request. For BATCH, these are a bool indicating whether the batch is atomic and
+                 a list of pairs (rt, args) for the requests in the batch. For SCHEDULE, these are the ticket, the
+                 number of nanoseconds at which the command should take effect, the RequestType of the command and its arguments.
+                 For ATINDEX, these are the expected sequence index, the RequestType of the command and its arguments.
+    :return: A list of bytes-like objects, the chunks of the message.
+    """
+    tag, arguments = _arguments[rt]
+    if arguments.nested:
+        if rt == RequestType.BATCH:
+            atomic, requests = args
+            args = [atomic]
+            for srt, sargs in requests:
+                args.extend(encode_request(srt, *sargs))
+        else:
+            k = len(arguments.types)
+            args = (*args[:k], *encode_request(args[k], *args[k + 1:]))
+    return arguments.pack(tag, *args)
+
+
+def decode_request(chunks, idx=0):
+    """
+    Reverses encode_request.
+    :param chunks: A sequence of bytes-like objects.
+    :param idx: The index of the chunk at which the request begins.
+    :return: A triple (rt, args, idx), where args is the list of arguments in the form that encode_request accepts them
+             and idx is the index of the first chunk after the request.
+    :exception IOError: If the chunks do not form a valid request.
+    """
+    try:
+        rt, arguments = _requests[Layout.peek(chunks, idx)]
+    except (KeyError, struct.error) as e:
+        raise IOError("Received a message that is not a valid request!") from e
+    args, idx = arguments.unpack(chunks, idx)
+    if arguments.nested:
+        if rt == RequestType.BATCH:
+            atomic, *nested = args
+            requests = []
+            sidx = 0
+            while sidx < len(nested):
+                srt, sargs, sidx = decode_request(nested, sidx)
+                requests.append((srt, sargs))
+            args = [atomic, requests]
+        else:
+            k = len(arguments.types)
+            srt, sargs, _ = decode_request(args[k:])
+            args = [*args[:k], srt, *sargs]
+    return rt, args, idx
+
+
+def encode_response(command, rt, *values):
+    """
+    Encodes a response.
+    :param command: The RequestType of the request that is responded to. This is ignored for messages that the server
+                    pushes unrequested, like EVENT and REPORT.
+    :param rt: The ResponseType.
+    :param values: The values of the response. For a VALUE response to a BATCH, these are triples (command, rt, values),
+                   one for every request in the batch that has been executed.
+    :return: A list of bytes-like objects, the chunks of the message.
+    """
+    tag, layout = _responses[rt]
+    if rt is ResponseType.VALUE:
+        layout = _values[command]
+        if layout.nested:
+            values = [c for scommand, srt, svalues in values for c in encode_response(scommand, srt, *svalues)]
+    return layout.pack(tag, *values)
+
+
+def decode_response(command, chunks, idx=0):
+    """
+    Reverses encode_response.
+    :param command: The RequestType of the request that is responded to, or None for messages that the
+                    server pushes unrequested, like EVENT and REPORT.
+    :param chunks: A sequence of bytes-like objects.
+    :param idx: The index of the chunk at which the response begins.
+    :return: A triple (rt, values, idx), where idx is the index of the first chunk after the response. For a VALUE
+             response to a BATCH, values are the chunks of the responses to the requests of the batch, which are to be
+             decoded by further calls of this function.
+    :exception IOError: If the chunks do not form a valid response.
+    """
+    try:
+        rt = _response_types[Layout.peek(chunks, idx)]
+    except (KeyError, struct.error) as e:
+        raise IOError("Received a message that is not a valid response!") from e
+    layout = _values[command] if rt is ResponseType.VALUE else _responses[rt][1]
+    values, idx = layout.unpack(chunks, idx)
+    return rt, values, idx
+
+
+_sequence_info = struct.Struct('>dBBI32s')
+
+
+def pack_playlist_info(infos):
+    """
+    Packs information about the sequences of a playlist into a single bytes object.
+    :param infos: An iterable of tuples (duration, w, c, r, digest), where duration is given in seconds, w, c and r
+                  are the sample width, number of channels and frame rate of the sequence and digest is the digest
+                  computed by trigs.playlist.wav_digest.
     :return: A bytes object.
     """
-    if isinstance(c, (RequestType, ResponseType, PlayerStatus)):
-        c = c.value
-    if isinstance(c, int):
-        assert c >= 0
-        assert c.bit_length() <= 32
-        return c.to_bytes(4, 'big')
-    elif isinstance(c, float):
-        return struct.pack('f', c)
-    elif isinstance(c, bytes):
-        return c
+    infos = list(infos)
+    b = bytearray(_sequence_info.size * len(infos))
+    for idx, info in enumerate(infos):
+        _sequence_info.pack_into(b, idx * _sequence_info.size, *info)
+    return bytes(b)
 
 
-def b2c(t, b):
+def unpack_playlist_info(b):
     """
-    Converts a bytes object into a Python object of the given type.
-    :param t: The type to convert the bytes into. Only certian types are supported.
-    :return: An object of the given type.
+    Reverses pack_playlist_info.
+    :param b: A bytes-like object.
+    :return: A list of tuples (duration, w, c, r, digest).
     """
+    return list(_sequence_info.iter_unpack(b))
 
-    if t in (int, RequestType, ResponseType, PlayerStatus):
-        assert len(b) == 4
-        b = int.from_bytes(b, 'big')
-        if t is int:
-            return b
-        return t(b)
-    elif t is float:
-        return struct.unpack('f', b)[0]
-    elif t is bytes:
-        return b
+
+def interpret(command, rt, values):
+    """
+    Interprets the response to a request.
+    :param command: The RequestType of the request.
+    :param rt: The ResponseType of the response.
+    :param values: The list of values that were decoded from the response.
+    :return: None, or the value that the server responded with. If the server responded with several values, a tuple
+             of these is returned.
+    :exception Exception: If the server reported an error.
+    """
+    if rt == ResponseType.SUCCESS:
+        if len(values) != 0:
+            raise IOError("The server responded with {}, but also sent values, which is a violation of the protocol!".format(rt))
+        return
+    elif rt == ResponseType.ERROR_FORMAT:
+        raise ValueError("The server claims that the arguments given for {}"
+                         " were of the wrong kind or number!".format(command))
+    elif rt == ResponseType.ERROR_UNKNOWN:
+        raise IOError("The server reported an unknown error!")
+    elif rt == ResponseType.ERROR_NOSEQUENCES:
+        raise RuntimeError("The remote playlist is empty!")
+    elif rt == ResponseType.ERROR_UNINITIALIZED:
+        raise RuntimeError("The remote player has not been initialized ever!")
+    elif rt == ResponseType.ERROR_NOTIMPLEMENTED:
+        raise NotImplementedError("Serving this request has not been implemented in the server!")
+    elif rt == ResponseType.ERROR_MISSING:
+        raise KeyError("The server does not hold all the sequences that {} refers to!".format(command))
+    elif rt == ResponseType.VALUE:
+        if command == RequestType.BATCH:
+            return values
+        elif command == RequestType.GETPLAYLISTINFO:
+            return unpack_playlist_info(values[0])
+        elif len(values) == 1:
+            return values[0]
+        return tuple(values)
+    else:
+        raise IOError("The server reported an unknown error!")
 
 
 class PlayerClient:
@@ -84,12 +452,214 @@ class PlayerClient:
     This object controls a remote player.
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, reconnect=None, heartbeat=None, timeout=None, backoff=(0.05, 5.0),
+                 on_reconnect=None):
         """
         Creates a new local client for the player protocol.
         :param connection: The Connection via which the requests to the server should be issued.
+        :param reconnect: A coroutine function without arguments that opens a new Connection to the server. If this is
+                          given, the client establishes a session with the server and replaces the connection whenever
+                          it breaks down, resuming the session. Requests that are pending while the connection breaks
+                          down fail with a ConnectionError, later requests wait for the connection to be replaced.
+        :param heartbeat: The number of seconds after which the client sends a HEARTBEAT request if it has not received
+                          anything from the server. If this is None, no heartbeats are sent.
+        :param timeout: The number of seconds after which a HEARTBEAT request that has not been answered makes the
+                        client consider the connection broken. Defaults to four heartbeat intervals.
+        :param backoff: A pair (initial, maximum) of the number of seconds to wait between two attempts to reconnect.
+                        The time is doubled after every failed attempt.
+        :param on_reconnect: A procedure that is called with the number of nanoseconds it took to recover from a broken
+                             connection and a bool indicating whether the server resumed the session.
         """
         self._connection = connection
+        self._pending = collections.deque()
+        self._receiver = None
+        self._error = None
+        # Maps the values of the ResponseTypes that the server pushes unrequested to lists of listeners:
+        self._listeners = {rt.value: [] for rt in (ResponseType.EVENT, ResponseType.TRIGGER, ResponseType.DEVICE)}
+        self._reports = {}
+        self._num_scheduled = 0
+        self._reconnect = reconnect
+        self._heartbeat = heartbeat
+        self._timeout = timeout if timeout is not None or heartbeat is None else 4 * heartbeat
+        self._backoff = backoff
+        self._on_reconnect = on_reconnect
+        self._session_listeners = []
+        self._token = b''
+        self._recovery = None
+        self._heart = None
+        self._received = time.monotonic()
+
+    @property
+    def connection(self):
+        """
+        The Connection via which requests are currently issued.
+        """
+        return self._connection
+
+    @property
+    def reconnects(self):
+        """
+        Whether this client replaces its connection when it breaks down.
+        """
+        return self._reconnect is not None
+
+    def add_listener(self, callback, rt=ResponseType.EVENT):
+        """
+        Registers a procedure that is called for every message of a certain type that the server pushes to this client.
+        Messages are only pushed after a SUBSCRIBE request has been issued.
+        :param callback: A procedure that accepts the values of the message as arguments. For EVENT, these are an
+                         EventType, a PlayerStatus, the index of the current sequence, the position in that sequence,
+                         its duration and the version of the state. For TRIGGER, these are the uniq of a trigger (as UTF-8 bytes), the time of its
+                         input event in the clock domain of the server and whether it was pressed. For DEVICE, these
+                         are the uniq of a trigger and whether it is present.
+        :param rt: One of ResponseType.EVENT, TRIGGER and DEVICE.
+        """
+        self._listeners[rt.value].append(callback)
+
+    def add_session_listener(self, callback):
+        """
+        Registers a procedure that is called whenever a session with the server has been established or resumed. This
+        happens before any further request is sent, so the callback can make sure that later requests do not rely on
+        state that a new session lacks. Sessions are only used by clients that reconnect.
+        :param callback: A procedure that accepts a bool indicating whether the server resumed the session.
+        """
+        self._session_listeners.append(callback)
+
+    async def _receive(self):
+        """
+        Receives all messages from the server, for as long as the connection is open. Responses are matched with the
+        pending requests (in the order in which those requests were sent), pushed messages are passed to the listeners.
+        """
+        try:
+            while True:
+                chunks = await self._connection.recv()
+                self._received = time.monotonic()
+                rt = Layout.peek(chunks)
+                listeners = self._listeners.get(rt)
+                if listeners is not None:
+                    _, values, _ = decode_response(None, chunks)
+                    for l in listeners:
+                        l(*values)
+                elif rt == ResponseType.REPORT.value:
+                    _, (ticket, skew), _ = decode_response(None, chunks)
+                    report = self._reports.pop(ticket, None)
+                    if report is not None and not report.done():
+                        report.set_result(skew)
+                elif len(self._pending) == 0:
+                    raise IOError("The server sent a response to a request that was never issued!")
+                else:
+                    response = self._pending.popleft()
+                    if not response.done():  # The request might have been cancelled.
+                        response.set_result(chunks)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self._reconnect is None:
+                self._fail(e)
+            else:
+                self._fail(ConnectionError("The connection to the server broke down: {}".format(e)), final=False)
+                self._receiver = None
+                if self._recovery is None:
+                    self._recovery = asyncio.create_task(self._recover())
+
+    def _fail(self, e, final=True):
+        """
+        Makes all pending requests fail.
+        :param e: The exception that the requests should raise.
+        :param final: Whether all future requests should fail as well.
+        """
+        if final:
+            self._error = e
+        while len(self._pending) > 0:
+            response = self._pending.popleft()
+            if not response.done():
+                response.set_exception(e)
+        for report in self._reports.values():
+            if not report.done():
+                report.set_exception(e)
+        self._reports.clear()
+
+    async def _start(self):
+        """
+        Starts receiving messages from the server and establishes or resumes the session, if sessions are used.
+        :return: Whether the server resumed the session.
+        """
+        self._received = time.monotonic()
+        self._receiver = asyncio.create_task(self._receive())
+        if self._heartbeat is not None and self._heart is None:
+            self._heart = asyncio.create_task(self._beat())
+        if self._reconnect is None:
+            return False
+        self._token, resumed = await asyncio.wait_for(self._request(RequestType.HELLO, self._token), self._timeout)
+        for l in self._session_listeners:
+            l(resumed)
+        return resumed
+
+    async def _recover(self, broken=True):
+        """
+        Starts communicating over the connection. If that fails, or if the connection is already known to be broken,
+        it is replaced, retrying with exponential backoff until this succeeds.
+        :param broken: Whether the current connection is known to be broken.
+        """
+        t0 = time.monotonic_ns()
+        reconnected = broken
+        delay, maximum = self._backoff
+        try:
+            while True:
+                try:
+                    if broken:
+                        self._connection.close()
+                        self._connection = await self._reconnect()
+                    resumed = await self._start()
+                    break
+                except (OSError, EOFError, asyncio.TimeoutError):
+                    if self._reconnect is None:
+                        raise
+                    if self._receiver is not None:
+                        self._receiver.cancel()
+                        self._receiver = None
+                    broken = reconnected = True
+                    await asyncio.sleep(delay)
+                    delay = min(maximum, 2 * delay)
+        finally:
+            self._recovery = None
+        if reconnected and self._on_reconnect is not None:
+            self._on_reconnect(time.monotonic_ns() - t0, resumed)
+
+    async def _beat(self):
+        """
+        Sends HEARTBEAT requests whenever the server has been silent for a while, and closes the connection if they are
+        not answered in time.
+        """
+        while True:
+            await asyncio.sleep(max(0.0, self._received + self._heartbeat - time.monotonic()))
+            if self._recovery is not None:
+                await asyncio.shield(self._recovery)
+                continue
+            if time.monotonic() - self._received < self._heartbeat:
+                continue
+            try:
+                await asyncio.wait_for(self._request(RequestType.HEARTBEAT), self._timeout)
+            except asyncio.TimeoutError:
+                # Closing the connection makes the receiver notice that it is broken:
+                self._connection.close()
+            except (OSError, EOFError):
+                pass
+
+    async def _request(self, command, *args):
+        """
+        Sends a request over the current connection and awaits the response.
+        """
+        response = asyncio.get_running_loop().create_future()
+        self._pending.append(response)
+        try:
+            await self._connection.send(*encode_request(command, *args))
+        except:
+            response.cancel()
+            raise
+        rt, values, _ = decode_response(command, await response)
+
+        return interpret(command, rt, values)
 
     async def request(self, command, *args):
         """
@@ -98,43 +668,91 @@ class PlayerClient:
         :param args: The arguments for the command to send.
         :return: A tuple (possibly of length 0), that contains the return values received for this request.
         """
-        await self._connection.send(*map(c2b, (command, *args)))
-        rt, *values = await self._connection.recv()
+        if self._error is not None:
+            raise self._error
+        if self._recovery is None and self._receiver is None:
+            self._recovery = asyncio.create_task(self._recover(broken=False))
+        if self._recovery is not None:
+            await asyncio.shield(self._recovery)
 
-        rt = b2c(ResponseType, rt)
+        return await self._request(command, *args)
 
-        if rt == ResponseType.SUCCESS:
-            if len(values) != 0:
-                raise IOError("The server responded with {}, but also sent values, which is a violation of the protocol!".format(rt))
-            return
-        elif rt == ResponseType.ERROR_FORMAT:
-            raise ValueError("The server claims that the arguments given for {}"
-                             " were of the wrong kind or number!".format(command))
-        elif rt == ResponseType.ERROR_UNKNOWN:
-            raise IOError("The server reported an unknown error!")
-        elif rt == ResponseType.ERROR_NOSEQUENCES:
-            raise RuntimeError("The remote playlist is empty!")
-        elif rt == ResponseType.ERROR_UNINITIALIZED:
-            raise RuntimeError("The remote player has not been initialized ever!")
-        elif rt == ResponseType.ERROR_NOTIMPLEMENTED:
-            raise NotImplementedError("Serving this request has not been implemented in the server!")
-        elif rt == ResponseType.VALUE:
-
-            if command == RequestType.GETNUMSEQUENCES:
-                t = int
-            elif command == RequestType.GETSEQUENCE:
-                t = bytes
-            elif command == RequestType.GETSTATUS:
-                t = PlayerStatus
+    async def schedule(self, t, command, *args):
+        """
+        Makes the server execute a transport command at a given point in time.
+        :param t: The time at which the effect of the command should become audible, as a number of nanoseconds in the
+                  clock domain of the server (see trigs.remote.clock).
+        :param command: One of RequestType.PLAY, PAUSE, STOP, NEXT, PREVIOUS and SETPOSITION.
+        :param args: The arguments for the command.
+        :return: A future that will hold the skew of the execution, i.e. the number of nanoseconds by which the effect
+                 became audible later than requested.
+        """
+        ticket = self._num_scheduled
+        self._num_scheduled = (self._num_scheduled + 1) % 2 ** 32
+        report = asyncio.get_running_loop().create_future()
+        self._reports[ticket] = report
+        try:
+            await self.request(RequestType.SCHEDULE, ticket, t, command, *args)
+        except:
+            self._reports.pop(ticket, None)
+            raise
+        return report
+
+    async def batch(self, requests, atomic=False):
+        """
+        Sends a number of requests to the server in one message and awaits the responses to all of them.
+        :param requests: An iterable of pairs (command, args), where command is a RequestType and args is a tuple of
+                         arguments for that command.
+        :param atomic: Whether the server should execute the requests such that no audio is produced while only some of
+                       them have taken effect. In that case the server stops executing requests after the first one
+                       that fails. Atomic batches may only contain the requests in protocol.atomic_requests.
+        :return: A list of futures, one for each request, that are done. Each future holds either the value that the
+                 server responded with, or the error it reported. The futures of those requests that the server did
+                 not execute are cancelled.
+        """
+        requests = list(requests)
+        if any(command == RequestType.BATCH for command, _ in requests):
+            raise ValueError("Batches must not be nested!")
+        if atomic and any(command not in atomic_requests for command, _ in requests):
+            raise ValueError("Atomic batches may only contain transport requests, SETMUTED and SETVOLUME!")
+
+        chunks = await self.request(RequestType.BATCH, atomic, requests)
+
+        loop = asyncio.get_running_loop()
+        results = []
+        idx = 0
+        for command, _ in requests:
+            f = loop.create_future()
+            if idx < len(chunks):
+                rt, values, idx = decode_response(command, chunks, idx)
+                try:
+                    f.set_result(interpret(command, rt, values))
+                except Exception as e:
+                    f.set_exception(e)
             else:
-                t = float
+                f.cancel()
+            results.append(f)
+        return results
 
-            return b2c(t, values[0])
-        else:
-            raise IOError("The server reported an unknown error!")
+    def close(self):
+        """
+        Stops receiving messages from the server. The underlying connection is not closed.
+        Requests that are still pending fail with an EOFError.
+        """
+        for task in (self._receiver, self._recovery, self._heart):
+            if task is not None:
+                task.cancel()
+        self._receiver = self._recovery = self._heart = None
+        self._fail(EOFError("The client has been closed!"))
 
 
 class PlayerServer:
+    """
+    Receives requests from the clients of the player protocol and passes them to a handler.
+    Every client has a bounded queue of requests, that are handled one after the other, in the order in which they
+    were received. Requests that may be handled concurrently are handled right away, all others one at a time: Their
+    handling waits until all other such requests that were received earlier, from any client, have been handled.
+    """
 
     class Request:
         """
@@ -151,16 +769,6 @@ class PlayerServer:
             self._connection = connection
             self._rt = rt
             self._args = args
-            self._response = asyncio.Future()
-
-        def serve(self, rt, *values):
-            """
-            Provides the response and (possibly) the return values to this request. Must be called on every request
-            eventually.
-            :param rt: The ResponseType.
-            :param values: The values to send along with the response.
-            """
-            self._response.set_result((rt, *values))
 
         @property
         def args(self):
@@ -186,56 +794,242 @@ class PlayerServer:
             """
             return self._connection
 
-        @property
-        def response(self):
-            return self._response
-
         def __str__(self):
             return pformat(self._rt, *self._args)
 
-    def __init__(self):
+    def __init__(self, handler, concurrent=(), timeout=None, backlog=16, outbox=256, on_close=None):
         """
         Instantiates a new server for the player protocol.
+        :param handler: A coroutine function that accepts a PlayerServer.Request object and returns a pair (rt, values),
+                        where rt is the ResponseType and values is a tuple of values to respond with.
+        :param concurrent: The RequestTypes that may be handled concurrently with all other requests.
+        :param timeout: The number of seconds after which the connection to a client that has not sent anything is
+                        closed. Clients that use heartbeats must send them more often than this.
+        :param backlog: The number of requests per client that may be waiting to be handled. Once this is exceeded,
+                        the server stops receiving from that client, until some of its requests have been handled.
+        :param outbox: The number of messages per client that may be waiting to be sent. Messages are sent in the
+                       background, such that a client that does not receive fast enough does not delay the others. A
+                       client that falls further behind than this on pushed messages is disconnected.
+        :param on_close: A procedure that is called with the connection to a client once that has been closed, for
+                         whatever reason.
         """
-        self._requests = asyncio.Queue()
+        self._handler = handler
+        self._concurrent = frozenset(concurrent)
+        self._timeout = timeout
+        self._backlog = backlog
+        self._on_close = on_close
+        self._outbox = outbox
+        self._exclusive = asyncio.Lock()  # Waiters are woken in the order in which they started waiting.
+        self._holder = None  # The task that holds the exclusive lock.
+        self._locks = {}
+        self._outboxes = {}  # Maps the connections served by serve_client to the queues of messages to be sent.
+        self._subscribers = set()
+        self._state = None
+        self._version = 0
 
-    async def serve_client(self, connection):
+    async def _send(self, connection, command, rt, *values):
         """
-        Serves a protocol client, as long as the connection to that client is open.
-        Note that the requests received from the client will only be answered if self.next_request is awaited
-        sufficiently many times!
+        Sends a message to a client, making sure that it is not interleaved with other messages to the same client.
         :param connection: The Connection to the client.
+        :param command: The RequestType that is responded to, see encode_response.
+        :param rt: The ResponseType of the message.
+        :param values: The values of the message.
         """
-        while True:
+        chunks = encode_response(command, rt, *values)
+        outbox = self._outboxes.get(connection)
+        if outbox is None:  # The connection is not (or no longer) served by serve_client.
+            async with self._locks.setdefault(connection, asyncio.Lock()):
+                await connection.send(*chunks)
+        elif command is not None:
+            # Responses are throttled by the client receiving them, which is what limits the requests it can make:
+            await outbox.put(chunks)
+        else:
             try:
-                rt, *args = await connection.recv()
-            except EOFError:
+                outbox.put_nowait(chunks)
+            except asyncio.QueueFull:
                 connection.close()
-                return
-            rt = b2c(RequestType, rt)
+                raise ConnectionError("The client does not receive the messages pushed to it fast enough!")
 
-            if rt == RequestType.GETSEQUENCE:
-                ts = (int, )
-            elif rt == RequestType.APPENDWAV:
-                ts = (int, int, int, bytes)
-            else:
-                ts = (float, )
+    async def _write(self, connection, outbox):
+        """
+        Sends the messages for a client, until cancelled or until the connection fails, in which case it is closed.
+        :param connection: The Connection to the client.
+        :param outbox: The asyncio.Queue of the messages to be sent, as lists of chunks.
+        """
+        try:
+            while True:
+                await connection.send(*(await outbox.get()))
+                outbox.task_done()
+        except (IOError, AttributeError):  # The client is gone.
+            connection.close()
+
+    @property
+    def version(self):
+        """
+        The version of the player state that has been published last. This is incremented with every change.
+        """
+        return self._version
+
+    def subscribe(self, connection):
+        """
+        Makes this server push EVENT messages to a client whenever the state of the player changes.
+        :param connection: The Connection to the client.
+        """
+        self._subscribers.add(connection)
+
+    async def publish(self, status, sidx, position, duration, end=False, connections=None):
+        """
+        Pushes the current state of the player to subscribed clients, if it has changed since the last call.
+        :param status: The PlayerStatus of the player.
+        :param sidx: The index of the current sequence.
+        :param position: The position in the current sequence, in seconds.
+        :param duration: The duration of the current sequence, in seconds.
+        :param end: Whether the state change was caused by the player reaching the end of a sequence.
+        :param connections: The connections to push the state to. By default, all subscribers are addressed.
+                            If this is given, the state is pushed even if it has not changed.
+        """
+        state = (status, sidx, position, duration)
+        if end:
+            et = EventType.ENDOFSEQUENCE
+        elif self._state is None or self._state[1] != sidx or self._state[3] != duration:
+            et = EventType.SEQUENCE
+        elif self._state[0] != status:
+            et = EventType.STATUS
+        elif self._state[2] != position:
+            et = EventType.POSITION
+        else:
+            et = None
+        self._state = state
+        if et is not None:
+            self._version = (self._version + 1) % 2 ** 32
+
+        targets = set() if et is None else set(self._subscribers)
+        if connections is not None:
+            targets.update(connections)
+
+        for c in targets:
+            try:
+                await self._send(c, None, ResponseType.EVENT, EventType.POSITION if et is None else et, *state,
+                                 self._version)
+            except (IOError, AttributeError):  # The connection has been closed in the meantime.
+                self._subscribers.discard(c)
+
+    async def push(self, rt, *values, connections=None):
+        """
+        Pushes a message to subscribed clients.
+        :param rt: The ResponseType of the message, for example ResponseType.TRIGGER.
+        :param values: The values of the message.
+        :param connections: The connections to push the message to. By default, all subscribers are addressed.
+        """
+        for c in list(self._subscribers if connections is None else connections):
+            try:
+                await self._send(c, None, rt, *values)
+            except (IOError, AttributeError):  # The connection has been closed in the meantime.
+                self._subscribers.discard(c)
+
+    async def report(self, connection, ticket, skew):
+        """
+        Reports to a client the skew with which a scheduled command has been executed.
+        :param connection: The Connection to the client.
+        :param ticket: The integer by which the client identified the SCHEDULE request.
+        :param skew: The number of nanoseconds by which the effect of the command became audible later than requested.
+        """
+        try:
+            await self._send(connection, None, ResponseType.REPORT, ticket, skew)
+        except (IOError, AttributeError):  # The connection has been closed in the meantime.
+            pass
+
+    async def serve_client(self, connection):
+        """
+        Serves a protocol client, as long as the connection to that client is open.
+        :param connection: The Connection to the client.
+        """
+        queue = asyncio.Queue(self._backlog)
+        outbox = self._outboxes[connection] = asyncio.Queue(self._outbox)
+        writer = asyncio.create_task(self._write(connection, outbox))
+        worker = asyncio.create_task(self._work(connection, queue))
+        try:
+            while not worker.done() and not writer.done():
+                try:
+                    chunks = await asyncio.wait_for(connection.recv(), self._timeout)
+                    t1 = time.monotonic_ns()
+                    rt, args, _ = decode_request(chunks)
+                except (EOFError, ConnectionError, asyncio.TimeoutError):
+                    return
 
-            args = [b2c(t, a) for a, t in zip(args, ts)]
+                # If the client sends requests faster than they can be handled, this stops receiving from it:
+                await queue.put((t1, PlayerServer.Request(connection, rt, *args)))
+        finally:
+            worker.cancel()
+            writer.cancel()
+            self._subscribers.discard(connection)
+            self._locks.pop(connection, None)
+            self._outboxes.pop(connection, None)
+            connection.close()
+            if self._on_close is not None:
+                self._on_close(connection)
 
-            r = PlayerServer.Request(connection, rt, *args)
-            await self._requests.put(r)
-            await connection.send(*map(c2b, await r.response))
+    async def execute(self, request):
+        """
+        Passes a request to the handler, making sure that it is not handled concurrently with any other request that
+        may not be.
+        :param request: A PlayerServer.Request object.
+        :return: The pair (rt, values) returned by the handler.
+        """
+        if request.rtype in self._concurrent:
+            return await self._handler(request)
+        async with self.exclusively():
+            return await self._handler(request)
 
-            if rt == RequestType.TERMINATECONNECTION and r.response == ResponseType.SUCCESS:
-                return
+    @contextlib.asynccontextmanager
+    async def exclusively(self):
+        """
+        Makes sure that the code in the context is not executed concurrently with any request that may not be handled
+        concurrently. Handlers of concurrent requests use this for those of their parts that must not overlap with
+        such requests. The handlers of the latter may enter the context as well, which has no effect then.
+        :return: An asynchronous context manager.
+        """
+        task = asyncio.current_task()
+        if self._holder is task:
+            yield
+            return
+        async with self._exclusive:
+            self._holder = task
+            try:
+                yield
+            finally:
+                self._holder = None
 
-    async def next_request(self):
+    async def _work(self, connection, queue):
         """
-        Waits for a request from a client.
-        :return: A Request object. It must be processed by the caller in order to respond to the request!
+        Handles the requests of a client, one after the other, and sends the responses.
+        :param connection: The Connection to the client.
+        :param queue: The asyncio.Queue holding pairs (t, request), where t is the time.monotonic_ns() at which the
+                      request was received.
         """
-        return await self._requests.get()
+        try:
+            while True:
+                t1, r = await queue.get()
+                if r.rtype == RequestType.GETTIME:
+                    # The server clock is read as close to the network as possible:
+                    response = (ResponseType.VALUE, t1, time.monotonic_ns())
+                elif r.rtype == RequestType.HEARTBEAT:
+                    response = (ResponseType.SUCCESS, )
+                else:
+                    rt, values = await self.execute(r)
+                    response = (rt, *values)
+                await self._send(connection, r.rtype, *response)
+
+                if r.rtype == RequestType.TERMINATECONNECTION and response[0] == ResponseType.SUCCESS:
+                    # The response must have been sent before the connection is closed:
+                    outbox = self._outboxes.get(connection)
+                    if outbox is not None:
+                        await outbox.join()
+                    return
+        except ConnectionError:  # The client is gone.
+            pass
+        finally:
+            connection.close()
 
 
 def pformat(rt, *args):
@@ -252,7 +1046,7 @@ def pformat(rt, *args):
     prefix = ""
     for a in args:
         s.write(prefix)
-        if isinstance(a, bytes):
+        if isinstance(a, (bytes, bytearray, memoryview)):
             s.write('<bytes>')
         else:
             s.write(str(a))
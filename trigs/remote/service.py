@@ -0,0 +1,569 @@
+import asyncio
+import contextlib
+import json
+import os
+
+from trigs.players.base import PlayerStatus
+from .protocol import PlayerServer, RequestType, ResponseType, atomic_requests, pformat, pack_playlist_info
+from .session import SessionTable
+from .store import SequenceStore
+
+# The requests after which the state of the player may have changed:
+mutating = {RequestType.APPENDWAV, RequestType.SETPLAYLIST, RequestType.CLEAR, RequestType.REMOVESEQUENCE,
+            RequestType.PLAY, RequestType.PAUSE, RequestType.STOP, RequestType.NEXT, RequestType.PREVIOUS,
+            RequestType.SETPOSITION}
+
+# The requests that do not affect the player, or whose handlers take the exclusive lock only for those parts that do,
+# and that may thus be executed concurrently with any other request:
+concurrent = {RequestType.GETSTATUS, RequestType.GETPOSITION, RequestType.GETDURATION, RequestType.GETVOLUME,
+              RequestType.GETNUMSEQUENCES, RequestType.GETSEQUENCE, RequestType.GETSNAPSHOT,
+              RequestType.GETPLAYLISTINFO, RequestType.QUERYDIGESTS, RequestType.STOREWAV, RequestType.BEGINUPLOAD,
+              RequestType.UPLOADCHUNK, RequestType.ENDUPLOAD, RequestType.APPENDWAV}
+
+# The requests that can be scheduled, with the names under which PyAudioPlayer.schedule knows them:
+schedulable = {RequestType.PLAY: 'play', RequestType.PAUSE: 'pause', RequestType.STOP: 'stop',
+               RequestType.NEXT: 'next', RequestType.PREVIOUS: 'previous', RequestType.SETPOSITION: 'set_position'}
+
+# What a request needs in order to be executed:
+NOTHING = 0
+PLAYER = 1  # The player must have been created.
+SEQUENCES = 2  # The playlist of the player must not be empty.
+
+# Maps every RequestType to a pair (handler, requirement):
+_handlers = {}
+
+
+def _handles(*rtypes, requires=NOTHING):
+    """
+    Registers a method of PlayerService as the handler for some request types.
+    :param rtypes: The RequestTypes the method handles.
+    :param requires: One of NOTHING, PLAYER and SEQUENCES.
+    """
+    def decorate(f):
+        for rt in rtypes:
+            _handlers[rt] = (f, requires)
+        return f
+    return decorate
+
+
+def mutates(rtype, args):
+    """
+    Decides whether a request may change the state of the player.
+    :param rtype: The RequestType.
+    :param args: The arguments of the request.
+    :return: A bool.
+    """
+    if rtype == RequestType.BATCH:
+        _, requests = args
+        return any(rt in mutating for rt, _ in requests)
+    elif rtype == RequestType.ATINDEX:
+        return args[1] in mutating
+    return rtype in mutating
+
+
+async def state(player):
+    """
+    Determines the state of the player.
+    :param player: The player the state of which should be determined. May be None.
+    :return: A tuple (status, sidx, position, duration).
+    """
+    if player is None or await player.num_sequences == 0:
+        return PlayerStatus.STOPPED, 0, 0.0, 0.0
+    return await player.status, await player.sequence_index, await player.position, await player.duration
+
+
+class PlayerService:
+    """
+    Executes the requests that a PlayerServer receives from its clients, on a player that is created once the format
+    of the audio sequences is known.
+    Requests are looked up in a dispatch table. Those that do not affect the player are executed concurrently, the
+    others one at a time.
+    """
+
+    def __init__(self, create, directory=None, timeout=None, backlog=16, mute_on_loss=False, verbose=True):
+        """
+        Creates a new service.
+        :param create: A procedure that accepts sample width, number of channels and frame rate, as well as a keyword
+                       argument 'on_end', and returns a new player, for example the PyAudioPlayer constructor.
+        :param directory: The path of a directory in which the sequences, the playlist and the transport state are to be
+                          persisted, such that they can be restored after a restart. If this is None, nothing is
+                          persisted.
+        :param timeout: The number of seconds after which the connection to a silent client is closed.
+        :param backlog: The number of requests per client that may be waiting for execution. Once this is exceeded,
+                        the server stops receiving from that client.
+        :param mute_on_loss: Whether the player should be muted when the connection to the client that unmuted it last
+                             is lost, rather than terminated by the client, such that a standby server can take over
+                             without both being audible. Once the client resumes its session, the player is unmuted
+                             again.
+        :param verbose: Whether every request and response should be printed.
+        """
+        self._create = create
+        self._verbose = verbose
+        self._player = None
+        self._muted = False
+        self._mute_on_loss = mute_on_loss
+        self._audible = None  # The connection via which the player was unmuted last.
+        self._silenced = None  # The session whose connection was lost while the player was audible.
+        self._store = SequenceStore(directory)
+        self._state_path = None if directory is None else os.path.join(directory, 'state.json')
+        self._saving = None  # The task that is about to persist the state, if any.
+        self._writing = asyncio.Lock()
+        self._sessions = SessionTable()
+        self._digests = []  # The digests of the sequences in the playlist of the player.
+        self._server = PlayerServer(self.handle, concurrent=concurrent, timeout=timeout, backlog=backlog,
+                                    on_close=self._on_close)
+
+    @property
+    def server(self):
+        """
+        The PlayerServer that receives the requests for this service.
+        """
+        return self._server
+
+    @property
+    def player(self):
+        """
+        The player this service controls, or None if it has not been created yet.
+        """
+        return self._player
+
+    @property
+    def store(self):
+        """
+        The SequenceStore that holds the sequences clients have transferred.
+        """
+        return self._store
+
+    async def publish(self, end=False, connections=None):
+        """
+        Pushes the state of the player to the clients that have subscribed to it.
+        :param end: Whether the end of a sequence has been reached.
+        :param connections: The connections to push the state to, regardless of whether it has changed.
+        """
+        await self._server.publish(*(await state(self._player)), end=end, connections=connections)
+
+    def _on_end(self):
+        async def end():
+            await self.publish(end=True)
+            self._save_soon()
+        asyncio.create_task(end())
+
+    def _on_close(self, connection):
+        # Uploads cannot be continued via another connection, so those that are unfinished are abandoned:
+        self._store.drop_uploads(connection)
+        if connection is self._audible:
+            self._audible = None
+            if self._mute_on_loss and not self._muted:
+                self._silenced = self._sessions.get(connection)
+                asyncio.create_task(self._mute_lost())
+
+    async def _mute_lost(self):
+        """
+        Mutes the player after the connection to the client that made it audible has been lost.
+        """
+        self._muted = True
+        if self._player is not None:
+            await self._player.set_muted(True)
+        if self._verbose:
+            print("Muted the player, because the connection to the client that unmuted it was lost.")
+        self._save_soon()
+
+    def _write(self, s):
+        tmp = self._state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(s, f)
+        os.replace(tmp, self._state_path)
+
+    async def save(self):
+        """
+        Persists the playlist and the transport state of the player, if a directory for this has been given.
+        """
+        if self._state_path is None:
+            return
+        status, sidx, position, _ = await state(self._player)
+        s = {'digests': [d.hex() for d in self._digests], 'status': status.name, 'sidx': sidx, 'position': position,
+             'muted': self._muted}
+        async with self._writing:
+            await asyncio.to_thread(self._write, s)
+
+    def _save_soon(self):
+        """
+        Makes sure that the state is persisted soon, without delaying the caller. Changes that are made in the
+        meantime are persisted together.
+        """
+        if self._state_path is not None and self._saving is None:
+            self._saving = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(0.05)
+        # Changes that are made while this save is running need another one:
+        self._saving = None
+        try:
+            await self.save()
+        except OSError as e:
+            print("Failed to persist the state of the player: {}".format(e))
+
+    async def restore(self):
+        """
+        Restores the playlist and the transport state that have been persisted by a previous instance of this service,
+        and creates the player. If the player had been playing, it is restored as paused.
+        :return: The number of sequences in the restored playlist.
+        """
+        if self._state_path is None or not os.path.exists(self._state_path):
+            return 0
+        with open(self._state_path) as f:
+            s = json.load(f)
+        digests = [bytes.fromhex(d) for d in s['digests']]
+        if not all(d in self._store for d in digests):
+            return 0
+        self._muted = s['muted']
+        wavs = [self._store.get(d) for d in digests]
+        if len(wavs) > 0:
+            await self._ensure_player(*wavs[0][:3])
+            await self._player.set_sequences(wavs)
+            for _ in range(s['sidx']):
+                await self._player.next()
+            if s['position'] > 0:
+                await self._player.set_position(s['position'])
+        self._digests[:] = digests
+        return len(digests)
+
+    async def persist(self, interval=1.0):
+        """
+        Keeps persisting the transport state while the player is playing, until cancelled.
+        :param interval: The number of seconds between two updates.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if self._player is not None and await self._player.status == PlayerStatus.PLAYING:
+                await self.save()
+
+    async def _ensure_player(self, sw, nc, fr):
+        """
+        Creates the player, if that has not happened yet.
+        """
+        if self._player is None:
+            self._player = self._create(sw, nc, fr, on_end=self._on_end)
+            await self._player.set_muted(self._muted)
+
+    async def handle(self, request):
+        """
+        Serves a request that the PlayerServer has received.
+        :param request: A PlayerServer.Request object.
+        :return: A pair (rt, values), where rt is the ResponseType and values is a tuple of values to respond with.
+        """
+        rt = None
+        values = ()
+        try:
+            rt, values = await self.execute(request.rtype, request.args, request.connection)
+        except NotImplementedError:
+            rt = ResponseType.ERROR_NOTIMPLEMENTED
+            values = ()
+        except:
+            rt = ResponseType.ERROR_UNKNOWN
+            values = ()
+        finally:
+            if rt in (ResponseType.SUCCESS, ResponseType.VALUE) and mutates(request.rtype, request.args):
+                await self.publish()
+                self._save_soon()
+                session = self._sessions.get(request.connection)
+                if session is not None and self._player is not None:
+                    session.sidx = await self._player.sequence_index
+            elif rt == ResponseType.SUCCESS and request.rtype == RequestType.SETMUTED:
+                self._save_soon()
+            if self._verbose:
+                print("<-- {}".format(request))
+                print("\t--> {}".format(pformat(rt, *values)))
+        return rt, values
+
+    async def execute(self, rtype, args, connection):
+        """
+        Executes a request.
+        :param rtype: The RequestType.
+        :param args: The arguments that were sent along with the request.
+        :param connection: The connection via which the request was received.
+        :return: A pair (rt, values), where rt is the ResponseType and values is a tuple of values to respond with.
+        """
+        try:
+            handler, requires = _handlers[rtype]
+        except KeyError:
+            raise NotImplementedError(rtype)
+        if requires >= PLAYER and self._player is None:
+            return ResponseType.ERROR_UNINITIALIZED, ()
+        if requires >= SEQUENCES and await self._player.num_sequences == 0:
+            return ResponseType.ERROR_NOSEQUENCES, ()
+        return await handler(self, args, connection)
+
+    # region Sequences
+
+    @_handles(RequestType.APPENDWAV)
+    async def _append_wav(self, args, connection):
+        # Hashing and persisting the sequence takes long, but does not affect the player:
+        d = await asyncio.to_thread(self._store.add, args)
+        async with self._server.exclusively():
+            await self._ensure_player(*args[:3])
+            await self._player.append_sequence(args)
+            self._digests.append(d)
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.QUERYDIGESTS)
+    async def _query_digests(self, args, connection):
+        return ResponseType.VALUE, (bytes(d in self._store for d in args), )
+
+    @_handles(RequestType.STOREWAV)
+    async def _store_wav(self, args, connection):
+        return ResponseType.VALUE, (await asyncio.to_thread(self._store.add, args), )
+
+    @_handles(RequestType.BEGINUPLOAD)
+    async def _begin_upload(self, args, connection):
+        return ResponseType.VALUE, (self._store.begin_upload(*args, owner=connection), )
+
+    @_handles(RequestType.UPLOADCHUNK)
+    async def _upload_chunk(self, args, connection):
+        uid, offset, compression, chunk = args
+        try:
+            upload = self._store.upload(uid)
+        except KeyError:
+            return ResponseType.ERROR_MISSING, ()
+        try:
+            chunk = compression.decompress(chunk, limit=max(0, len(upload) - offset))
+        except ValueError:
+            return ResponseType.ERROR_FORMAT, ()
+        return ResponseType.VALUE, (upload.write(offset, chunk), )
+
+    @_handles(RequestType.ENDUPLOAD)
+    async def _end_upload(self, args, connection):
+        uid, = args
+        try:
+            # The bookkeeping of uploads is only ever touched on the thread of the event loop:
+            wav = self._store.take_upload(uid)
+        except KeyError:
+            return ResponseType.ERROR_MISSING, ()
+        return ResponseType.VALUE, (await asyncio.to_thread(self._store.add, wav), )
+
+    @_handles(RequestType.SETPLAYLIST)
+    async def _set_playlist(self, args, connection):
+        if not all(d in self._store for d in args):
+            return ResponseType.ERROR_MISSING, ()
+        wavs = [self._store.get(d) for d in args]
+        if len(wavs) > 0:
+            await self._ensure_player(*wavs[0][:3])
+        if self._player is not None:
+            await self._player.set_sequences(wavs)
+        self._digests[:] = map(bytes, args)
+        session = self._sessions.get(connection)
+        if session is not None:
+            session.digests = list(self._digests)
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.GETNUMSEQUENCES)
+    async def _get_num_sequences(self, args, connection):
+        return ResponseType.VALUE, ((0, ) if self._player is None else (await self._player.num_sequences, ))
+
+    @_handles(RequestType.CLEAR)
+    async def _clear(self, args, connection):
+        if self._player is not None:
+            await self._player.clear_sequences()
+        self._digests.clear()
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.GETPLAYLISTINFO)
+    async def _get_playlist_info(self, args, connection):
+        infos = []
+        for d in self._digests:
+            sw, nc, fr, data = self._store.get(d)
+            infos.append((len(data) / (sw * nc * fr), sw, nc, fr, d))
+        return ResponseType.VALUE, (pack_playlist_info(infos), )
+
+    @_handles(RequestType.GETSEQUENCE, requires=SEQUENCES)
+    async def _get_sequence(self, args, connection):
+        sidx, = args
+        return ResponseType.VALUE, (await self._player.get_sequence(sidx), )
+
+    @_handles(RequestType.REMOVESEQUENCE, requires=SEQUENCES)
+    async def _remove_sequence(self, args, connection):
+        sidx, = args
+        await self._player.remove_sequence(sidx)
+        del self._digests[sidx]
+        return ResponseType.SUCCESS, ()
+
+    # endregion
+
+    # region State
+
+    @_handles(RequestType.GETSTATUS)
+    async def _get_status(self, args, connection):
+        return ResponseType.VALUE, ((PlayerStatus.STOPPED, ) if self._player is None else (await self._player.status, ))
+
+    @_handles(RequestType.GETSNAPSHOT)
+    async def _get_snapshot(self, args, connection):
+        volume = 1.0 if self._player is None else await self._player.volume
+        return ResponseType.VALUE, (*(await state(self._player)), volume)
+
+    @_handles(RequestType.SETMUTED)
+    async def _set_muted(self, args, connection):
+        muted, = args
+        self._muted = bool(muted)
+        self._audible = None if self._muted else connection
+        self._silenced = None
+        if self._player is not None:
+            await self._player.set_muted(self._muted)
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.GETVOLUME, requires=PLAYER)
+    async def _get_volume(self, args, connection):
+        return ResponseType.VALUE, (await self._player.volume, )
+
+    @_handles(RequestType.SETVOLUME, requires=PLAYER)
+    async def _set_volume(self, args, connection):
+        await self._player.set_volume(*args)
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.GETDURATION, requires=SEQUENCES)
+    async def _get_duration(self, args, connection):
+        return ResponseType.VALUE, (await self._player.duration, )
+
+    @_handles(RequestType.GETPOSITION, requires=SEQUENCES)
+    async def _get_position(self, args, connection):
+        return ResponseType.VALUE, (await self._player.position, )
+
+    # endregion
+
+    # region Transport
+
+    @_handles(RequestType.PLAY, requires=SEQUENCES)
+    async def _play(self, args, connection):
+        await self._player.play()
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.PAUSE, requires=SEQUENCES)
+    async def _pause(self, args, connection):
+        await self._player.pause()
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.STOP, requires=SEQUENCES)
+    async def _stop(self, args, connection):
+        await self._player.stop()
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.NEXT, requires=SEQUENCES)
+    async def _next(self, args, connection):
+        await self._player.next()
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.PREVIOUS, requires=SEQUENCES)
+    async def _previous(self, args, connection):
+        await self._player.previous()
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.SETPOSITION, requires=SEQUENCES)
+    async def _set_position(self, args, connection):
+        await self._player.set_position(*args)
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.SCHEDULE, requires=SEQUENCES)
+    async def _schedule(self, args, connection):
+        ticket, t, srt, *sargs = args
+        if srt not in schedulable:
+            raise NotImplementedError(srt)
+
+        async def report(skew):
+            # Publishing first makes sure that clients know the new state once they learn about the skew.
+            await self.publish()
+            await self._server.report(connection, ticket, skew)
+            if self._verbose:
+                print("Executed scheduled {} with a skew of {:.3f}ms".format(srt, skew / 10 ** 6))
+
+        self._player.schedule(t, schedulable[srt], *sargs, on_done=lambda skew: asyncio.create_task(report(skew)))
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.ATINDEX, requires=SEQUENCES)
+    async def _at_index(self, args, connection):
+        sidx, srt, *sargs = args
+        if srt not in schedulable:
+            raise NotImplementedError(srt)
+        if await self._player.sequence_index == sidx:
+            rt, values = await self.execute(srt, sargs, connection)
+            if rt != ResponseType.SUCCESS:
+                return rt, values
+        # Otherwise the command has been executed before, via another path, or has been overtaken by another command.
+        # Either way, the client learns the resulting state, which may be ahead of the events it has received:
+        await self.publish()
+        return ResponseType.VALUE, (*(await state(self._player)), self._server.version)
+
+    # endregion
+
+    # region Connection
+
+    @_handles(RequestType.SUBSCRIBE)
+    async def _subscribe(self, args, connection):
+        self._server.subscribe(connection)
+        session = self._sessions.get(connection)
+        if session is not None:
+            session.subscribed = True
+        await self.publish(connections=(connection, ))
+        return ResponseType.SUCCESS, ()
+
+    @_handles(RequestType.HELLO)
+    async def _hello(self, args, connection):
+        token, = args
+        session, resumed = self._sessions.open(token, connection)
+        if resumed and session.digests is not None and session.digests != self._digests \
+                and all(d in self._store for d in session.digests):
+            # The playlist has changed since the client was last connected, so we restore it from the store:
+            rt, _ = await self._set_playlist(session.digests, connection)
+            if self._player is not None and rt == ResponseType.SUCCESS:
+                for _ in range(session.sidx):
+                    await self._player.next()
+                await self.publish()
+        if resumed and session.subscribed:
+            self._server.subscribe(connection)
+            await self.publish(connections=(connection, ))
+        if resumed and session is self._silenced:
+            # The player was muted only because the connection to this client was lost:
+            await self._set_muted((0, ), connection)
+            self._save_soon()
+        return ResponseType.VALUE, (session.token, int(resumed))
+
+    @_handles(RequestType.BATCH)
+    async def _batch(self, args, connection):
+        atomic, requests = args
+        if atomic and any(srt not in atomic_requests for srt, _ in requests):
+            # Other requests may have to wait for something, while the player would be kept from producing audio:
+            return ResponseType.ERROR_FORMAT, ()
+        values = []
+        with self._player.atomic() if atomic and self._player is not None else contextlib.nullcontext():
+            for srt, sargs in requests:
+                if srt == RequestType.BATCH:
+                    raise NotImplementedError("Batches must not be nested!")
+                try:
+                    rt, svalues = await self.execute(srt, sargs, connection)
+                except NotImplementedError:
+                    rt, svalues = ResponseType.ERROR_NOTIMPLEMENTED, ()
+                except:
+                    rt, svalues = ResponseType.ERROR_UNKNOWN, ()
+                values.append((srt, rt, svalues))
+                if atomic and rt not in (ResponseType.SUCCESS, ResponseType.VALUE):
+                    break
+        return ResponseType.VALUE, values
+
+    @_handles(RequestType.TERMINATECONNECTION)
+    async def _terminate_connection(self, args, connection):
+        if connection is self._audible:
+            # The client leaves on purpose, so there is no reason to mute the player once the connection is closed:
+            self._audible = None
+        return ResponseType.SUCCESS, ()
+
+    # endregion
+
+    async def terminate(self):
+        """
+        Persists the state of the player and releases it.
+        """
+        pending, self._saving = self._saving, None
+        if pending is not None:
+            pending.cancel()
+        if self._player is not None or pending is not None:
+            await self.save()
+        if self._player is not None:
+            await self._player.terminate()
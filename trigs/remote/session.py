@@ -0,0 +1,63 @@
+import collections
+import secrets
+import weakref
+
+
+class Session:
+    """
+    The state that a server keeps for a client, beyond the lifetime of the connection to that client.
+    """
+
+    def __init__(self, token):
+        """
+        Creates a new session.
+        :param token: The bytes object by which the client identifies the session.
+        """
+        self.token = token
+        self.subscribed = False
+        self.digests = None  # The playlist the client set last, as a list of digests.
+        self.sidx = 0  # The index of the sequence the player was at after the last request of the client.
+
+
+class SessionTable:
+    """
+    Keeps track of the sessions of the clients of a server.
+    """
+
+    def __init__(self, capacity=256):
+        """
+        Creates an empty session table.
+        :param capacity: The maximum number of sessions to keep. When it is exceeded, the sessions that have been
+                         resumed least recently are forgotten.
+        """
+        self._capacity = capacity
+        self._sessions = collections.OrderedDict()
+        self._connections = weakref.WeakKeyDictionary()
+
+    def open(self, token, connection):
+        """
+        Opens a new session, or resumes an existing one.
+        :param token: The token the client has sent. If this does not identify a known session, a new one is opened.
+        :param connection: The Connection via which the client has sent the token.
+        :return: A pair (session, resumed), where resumed indicates whether the session existed before.
+        """
+        token = bytes(token)
+        session = self._sessions.get(token)
+        resumed = session is not None
+        if resumed:
+            self._sessions.move_to_end(token)
+        else:
+            session = Session(secrets.token_bytes(16))
+            self._sessions[session.token] = session
+            while len(self._sessions) > self._capacity:
+                self._sessions.popitem(last=False)
+        self._connections[connection] = session
+        return session, resumed
+
+    def get(self, connection):
+        """
+        Retrieves the session a connection belongs to.
+        :param connection: A Connection.
+        :return: A Session object, or None if no session has been opened via the connection.
+        """
+        return self._connections.get(connection)
@@ -0,0 +1,83 @@
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from .unix import UnixConnection
+
+
+class _Segment(SharedMemory):
+    """
+    A shared memory segment that has been received from the other side of a connection.
+    """
+
+    def __del__(self):
+        # SharedMemory.__del__ would try to unmap the segment, which fails as long as the views we handed out are
+        # still in use. The segment is unmapped when the last of these views has been released. Its file descriptor
+        # has been closed by _import already.
+        pass
+
+
+def _export(chunk):
+    """
+    Copies a chunk into a new shared memory segment.
+    The segment is not unlinked by this process: It is owned by the receiver, which is expected to unlink it.
+    :param chunk: A bytes-like object.
+    :return: A bytes object that identifies the segment.
+    """
+    try:
+        shm = SharedMemory(create=True, size=len(chunk), track=False)
+    except TypeError:  # Python < 3.13 does not support 'track'.
+        shm = SharedMemory(create=True, size=len(chunk))
+        resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        shm.buf[:len(chunk)] = chunk
+        return len(chunk).to_bytes(4, 'big') + shm.name.encode('ascii')
+    finally:
+        shm.close()
+
+
+def _import(handle):
+    """
+    Maps a shared memory segment that has been created by _export.
+    :param handle: The bytes-like object returned by _export.
+    :return: A memoryview of the contents of the segment.
+    """
+    size = int.from_bytes(handle[:4], 'big')
+    shm = _Segment(bytes(handle[4:]).decode('ascii'))
+    shm.unlink()
+    # The mapping holds a file descriptor of its own, so the one SharedMemory has opened is not needed anymore:
+    if shm._fd >= 0:
+        os.close(shm._fd)
+        shm._fd = -1
+    return shm.buf[:size]
+
+
+class SharedMemoryConnection(UnixConnection):
+    """
+    A Unix domain socket that connects a client to a server on the same machine, such that large chunks are not sent
+    over the socket, but passed in shared memory segments. The receiver of a message maps these segments, so
+    the chunks it receives are not copied.
+    Segments that are never received (for example because the connection breaks down) are not freed before reboot.
+    """
+
+    def __init__(self, reader, writer, threshold=2 ** 16, **kwargs):
+        """
+        Wraps a pair of asyncio streams.
+        :param reader: The asyncio.StreamReader of the connection.
+        :param writer: The asyncio.StreamWriter of the connection.
+        :param threshold: The number of bytes from which on chunks are passed in shared memory.
+        """
+        super().__init__(reader, writer, **kwargs)
+        self._threshold = threshold
+
+    async def send(self, cmd, *args):
+        # The first chunk of every message marks those chunks that are passed in shared memory:
+        chunks = (cmd, *args)
+        shared = bytes(len(c) >= self._threshold for c in chunks)
+        await super().send(shared, *(_export(c) if s else c for c, s in zip(chunks, shared)))
+
+    async def recv(self, max_chunks=1024):
+        shared, *chunks = await super().recv(max_chunks=max_chunks + 1)
+        if len(shared) != len(chunks):
+            raise IOError("The message received does not indicate which of its chunks are in shared memory!")
+        return [_import(c) if s else c for c, s in zip(chunks, shared)]
@@ -0,0 +1,233 @@
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+
+from trigs.playlist import wav_digest
+
+# The header of the files in which a SequenceStore persists sequences: A magic number, sample width, number of channels
+# and frame rate. The samples follow immediately.
+_header = struct.Struct('>4sBBI')
+_magic = b'TRGS'
+_suffix = '.seq'
+
+
+class Upload:
+    """
+    A sequence that is being transferred to a SequenceStore in chunks.
+    """
+
+    def __init__(self, sampwidth, nchannels, framerate, length):
+        """
+        Preallocates the storage for a sequence.
+        :param length: The number of bytes the samples of the sequence will take up.
+        """
+        self._swncfr = (sampwidth, nchannels, framerate)
+        self._data = bytearray(length)
+        self._ranges = []  # The sorted, disjoint pairs (start, end) of the byte ranges that have been received.
+        self._received = 0  # The number of bytes these ranges cover.
+
+    def write(self, offset, chunk):
+        """
+        Writes a chunk of samples into the preallocated storage.
+        :param offset: The byte offset at which the chunk is to be written.
+        :param chunk: A bytes-like object.
+        :return: The total number of distinct bytes received so far. Chunks that are received more than once, for
+                 example because they have been repeated, are counted only once.
+        """
+        if offset < 0 or offset + len(chunk) > len(self._data):
+            raise ValueError("The given chunk does not fit into the storage that has been allocated for the upload!")
+        memoryview(self._data)[offset:offset + len(chunk)] = chunk
+        if len(chunk) > 0:
+            self._cover(offset, offset + len(chunk))
+        return self._received
+
+    def _cover(self, start, end):
+        """
+        Records that a range of bytes has been received, merging it with the ranges it overlaps or touches.
+        """
+        ranges = self._ranges
+        i = bisect.bisect_left(ranges, (start, start))
+        if i > 0 and ranges[i - 1][1] >= start:
+            i -= 1
+        j = i
+        while j < len(ranges) and ranges[j][0] <= end:
+            s, e = ranges[j]
+            start, end = min(start, s), max(end, e)
+            self._received -= e - s
+            j += 1
+        ranges[i:j] = [(start, end)]
+        self._received += end - start
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def complete(self):
+        """
+        Indicates whether all bytes of this upload have been received.
+        """
+        return self._received >= len(self._data)
+
+    @property
+    def wav(self):
+        """
+        The uploaded sequence.
+        :return: A tuple (w, c, r, data).
+        """
+        return (*self._swncfr, self._data)
+
+
+class SequenceStore:
+    """
+    A content-addressed collection of sequences, that a server holds independently of the playlist of its player.
+    The store can be backed by a directory, in which case every sequence is persisted in a file of its own. Those files
+    are only memory-mapped when the sequences are needed, so opening a store is fast regardless of its size.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Opens a sequence store.
+        :param directory: The path of the directory in which sequences are to be persisted. If this is None, the store
+                          is held in memory only.
+        """
+        self._directory = directory
+        self._sequences = {}
+        self._uploads = {}
+        self._owners = {}  # Maps the identifiers of uploads to the objects on whose behalf they are being received.
+        self._next_upload = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for name in os.listdir(directory):
+                stem, ext = os.path.splitext(name)
+                if ext == _suffix:
+                    try:
+                        self._sequences[bytes.fromhex(stem)] = None  # Mapped on first use.
+                    except ValueError:
+                        pass
+
+    @property
+    def directory(self):
+        """
+        The path of the directory in which sequences are persisted, or None.
+        """
+        return self._directory
+
+    def _path(self, digest):
+        return os.path.join(self._directory, digest.hex() + _suffix)
+
+    def __contains__(self, digest):
+        return digest in self._sequences
+
+    def __len__(self):
+        return len(self._sequences)
+
+    def add(self, wav):
+        """
+        Adds a sequence to this store.
+        :param wav: A tuple (w, c, r, data), as returned by trigs.playlist.load_wav.
+        :return: The digest under which the sequence has been stored.
+        """
+        d = wav_digest(wav)
+        if d in self._sequences:
+            return d
+        if self._directory is not None:
+            sw, nc, fr, data = wav
+            # Writing to a temporary file first makes sure that no incomplete file is ever found under the final name:
+            fd, tmp = tempfile.mkstemp(dir=self._directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(_header.pack(_magic, sw, nc, fr))
+                    f.write(data)
+                os.replace(tmp, self._path(d))
+            except:
+                os.unlink(tmp)
+                raise
+        self._sequences[d] = tuple(wav)
+        return d
+
+    def get(self, digest):
+        """
+        Retrieves a sequence from this store.
+        :param digest: The digest of the sequence, as computed by trigs.playlist.wav_digest.
+        :return: A tuple (w, c, r, data).
+        :exception KeyError: If the store does not hold a sequence with the given digest.
+        """
+        wav = self._sequences[digest]
+        if wav is None:
+            wav = self._sequences[digest] = self._map(digest)
+        return wav
+
+    def _map(self, digest):
+        """
+        Maps a persisted sequence into memory.
+        :param digest: The digest of the sequence.
+        :return: A tuple (w, c, r, data), where data is a memoryview of the mapped file.
+        """
+        with open(self._path(digest), 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, sw, nc, fr = _header.unpack_from(m)
+        if magic != _magic:
+            raise IOError("{} is not a sequence file!".format(self._path(digest)))
+        return sw, nc, fr, memoryview(m)[_header.size:]
+
+    def begin_upload(self, sampwidth, nchannels, framerate, length, owner=None):
+        """
+        Prepares this store for receiving a sequence in chunks.
+        :param length: The number of bytes the samples of the sequence will take up.
+        :param owner: The object on whose behalf the sequence is received, for example the connection to the client.
+                      Uploads that their owner abandons can be dropped via drop_uploads.
+        :return: An integer identifying the upload.
+        """
+        uid = self._next_upload
+        self._next_upload += 1
+        self._uploads[uid] = Upload(sampwidth, nchannels, framerate, length)
+        self._owners[uid] = owner
+        return uid
+
+    def drop_uploads(self, owner):
+        """
+        Forgets about all unfinished uploads of an owner, releasing the storage allocated for them.
+        :param owner: The owner that was given to begin_upload.
+        :return: The number of uploads that have been dropped.
+        """
+        uids = [uid for uid, o in self._owners.items() if o is owner]
+        for uid in uids:
+            del self._uploads[uid]
+            del self._owners[uid]
+        return len(uids)
+
+    def upload(self, uid):
+        """
+        Retrieves an unfinished upload.
+        :param uid: The integer identifying the upload, as returned by begin_upload.
+        :return: An Upload object.
+        :exception KeyError: If there is no unfinished upload with the given identifier.
+        """
+        return self._uploads[uid]
+
+    def take_upload(self, uid):
+        """
+        Concludes a completely received upload, without adding the sequence to this store yet. Unlike 'add', this is
+        quick, and must not be called concurrently with the other methods that deal with uploads.
+        :param uid: The integer identifying the upload, as returned by begin_upload.
+        :return: The uploaded sequence, as a tuple (w, c, r, data), to be passed to 'add'.
+        :exception KeyError: If there is no unfinished upload with the given identifier.
+        :exception ValueError: If not all bytes of the sequence have been received yet. The upload can still be
+                               continued in this case.
+        """
+        u = self._uploads[uid]
+        if not u.complete:
+            raise ValueError("The upload has not been completed yet!")
+        del self._uploads[uid]
+        del self._owners[uid]
+        return u.wav
+
+    def finish_upload(self, uid):
+        """
+        Adds a completely received sequence to this store. See take_upload.
+        :param uid: The integer identifying the upload, as returned by begin_upload.
+        :return: The digest under which the sequence has been stored.
+        """
+        return self.add(self.take_upload(uid))
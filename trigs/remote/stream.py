@@ -0,0 +1,106 @@
+import asyncio
+import struct
+
+from .connection import Connection
+
+
+_uint32 = struct.Struct('>I')
+_headers = {}  # Maps numbers of integers to the precompiled structs that pack them.
+
+
+def _header(n):
+    """
+    Retrieves a struct that packs a number of four byte integers.
+    :param n: The number of integers.
+    :return: A struct.Struct object.
+    """
+    try:
+        return _headers[n]
+    except KeyError:
+        return _headers.setdefault(n, struct.Struct('>{}I'.format(n)))
+
+
+class StreamConnection(Connection):
+    """
+    A connection over a pair of asyncio streams.
+    Every message is framed as a four byte integer n, followed by n four byte integers giving the lengths of the
+    n chunks of the message, followed by the chunks themselves.
+    """
+
+    def __init__(self, reader, writer, bulk=2 ** 16):
+        """
+        Wraps a pair of asyncio streams.
+        :param reader: The asyncio.StreamReader of the connection.
+        :param writer: The asyncio.StreamWriter of the connection.
+        :param bulk: The number of bytes above which the payload of a message is received into preallocated memory,
+                     instead of being accumulated in the buffer of the reader, and above which the chunks of a message
+                     are not joined before sending.
+        """
+        super().__init__()
+        self._reader = reader
+        self._writer = writer
+        self._bulk = bulk
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+
+    async def send(self, cmd, *args):
+        chunks = (cmd, *args)
+        lengths = [len(c) for c in chunks]
+        assert all(n.bit_length() <= 32 for n in lengths)
+        header = _header(1 + len(chunks)).pack(len(chunks), *lengths)
+        if sum(lengths) <= self._bulk:
+            self._writer.writelines((header, *chunks))
+        else:
+            # writelines would join the chunks into one bytes object, i.e. copy the entire payload.
+            self._writer.write(header)
+            for c in chunks:
+                self._writer.write(c)
+        await self._writer.drain()
+
+    async def recv(self, max_chunks=1024):
+        try:
+            num_chunks, = _uint32.unpack(await self._reader.readexactly(4))
+        except asyncio.IncompleteReadError as e:
+            if len(e.partial) == 0:
+                raise EOFError("The connection seems to have been closed.") from e
+            raise IOError("The connection was closed in the middle of a message!") from e
+
+        if num_chunks < 1:
+            raise IOError("The message received should start with a four byte integer >= 1, but starts with {}".format(num_chunks))
+        if num_chunks > max_chunks:
+            raise IOError("Expected at most {} chunks, but other side has announced {}!".format(max_chunks, num_chunks))
+
+        try:
+            lengths = _header(num_chunks).unpack(await self._reader.readexactly(4 * num_chunks))
+        except asyncio.IncompleteReadError as e:
+            raise IOError("The connection was closed in the middle of a message!") from e
+
+        total = sum(lengths)
+        if total <= self._bulk:
+            try:
+                payload = memoryview(await self._reader.readexactly(total))
+            except asyncio.IncompleteReadError as e:
+                raise IOError("The connection was closed in the middle of a message!") from e
+        else:
+            # Large payloads are received into preallocated memory, in pieces no larger than the stream buffer.
+            # This avoids the stream buffer growing to the size of the entire payload.
+            payload = memoryview(bytearray(total))
+            received = 0
+            while received < total:
+                piece = await self._reader.read(total - received)
+                if len(piece) == 0:
+                    raise IOError("The connection was closed in the middle of a message!")
+                payload[received:received + len(piece)] = piece
+                received += len(piece)
+
+        # Slicing the memoryview splits the payload into chunks without copying it:
+        chunks = []
+        offset = 0
+        for n in lengths:
+            chunks.append(payload[offset:offset + n])
+            offset += n
+        return chunks
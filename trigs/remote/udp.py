@@ -0,0 +1,258 @@
+import asyncio
+import collections
+import secrets
+import struct
+
+from .protocol import PlayerServer, RequestType, ResponseType, encode_request, decode_request, encode_response, \
+    decode_response, interpret
+
+# The requests that may be sent via datagrams. Executing any of them twice has the same effect as executing it once:
+idempotent = {RequestType.PLAY, RequestType.PAUSE, RequestType.STOP, RequestType.SETPOSITION, RequestType.SETVOLUME,
+              RequestType.SETMUTED, RequestType.ATINDEX}
+
+# Every datagram starts with the id of the channel, a sequence number and the number of chunks it contains:
+_header = struct.Struct('>QQB')
+
+# The maximum size of a datagram, such that it is not fragmented on common networks:
+max_size = 1200
+
+
+def _pack(channel, seq, chunks):
+    """
+    Frames a message as a datagram.
+    :param channel: The integer id of the channel the message is sent over.
+    :param seq: The sequence number of the message.
+    :param chunks: The bytes-like chunks of the message.
+    :return: A bytes object.
+    """
+    lengths = [len(c) for c in chunks]
+    return b''.join((_header.pack(channel, seq, len(chunks)), struct.pack('>{}H'.format(len(chunks)), *lengths),
+                     *chunks))
+
+
+def _unpack(datagram):
+    """
+    Reverses _pack.
+    :param datagram: A bytes-like object.
+    :return: A triple (channel, seq, chunks).
+    :exception IOError: If the datagram is malformed.
+    """
+    try:
+        channel, seq, n = _header.unpack_from(datagram)
+        lengths = struct.unpack_from('>{}H'.format(n), datagram, _header.size)
+    except struct.error as e:
+        raise IOError("Received a malformed datagram!") from e
+    datagram = memoryview(datagram)
+    offset = _header.size + 2 * n
+    if offset + sum(lengths) != len(datagram):
+        raise IOError("Received a malformed datagram!")
+    chunks = []
+    for length in lengths:
+        chunks.append(datagram[offset:offset + length])
+        offset += length
+    return channel, seq, chunks
+
+
+class DatagramServer(asyncio.DatagramProtocol):
+    """
+    Receives idempotent requests for a PlayerServer via UDP.
+    Every datagram carries the id of the channel it was sent over and a sequence number. Of the copies of a request
+    that arrive, only the first one is executed, and a request is dropped if a later request of the same channel has
+    arrived before it. Every copy that arrives is answered, such that the client learns about the outcome even if some
+    of the answers are lost.
+    """
+
+    # The number of answers that are remembered for every channel:
+    history = 16
+
+    def __init__(self, server, capacity=256):
+        """
+        Creates a new datagram server.
+        :param server: The PlayerServer that executes the requests.
+        :param capacity: The maximum number of channels to keep track of. When it is exceeded, the channels that have
+                         been silent for the longest time are forgotten.
+        """
+        super().__init__()
+        self._server = server
+        self._capacity = capacity
+        # Maps channel ids to OrderedDicts that map the sequence numbers of the latest requests to their answers:
+        self._channels = collections.OrderedDict()
+        self._transport = None
+        self._tasks = set()
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            channel, seq, chunks = _unpack(data)
+            rt, args, _ = decode_request(chunks)
+        except IOError:
+            return
+
+        answers = self._channels.get(channel)
+        if answers is None:
+            answers = self._channels[channel] = collections.OrderedDict()
+            while len(self._channels) > self._capacity:
+                self._channels.popitem(last=False)
+        self._channels.move_to_end(channel)
+
+        if seq in answers:  # A copy of a request that is being executed or has been executed.
+            if answers[seq] is not None:
+                self._transport.sendto(answers[seq], addr)
+            return
+        if len(answers) > 0 and seq < next(reversed(answers)):  # Overtaken by a later request.
+            return
+        answers[seq] = None
+        while len(answers) > DatagramServer.history:
+            answers.popitem(last=False)
+
+        task = asyncio.create_task(self._execute(channel, seq, answers, PlayerServer.Request(self, rt, *args), addr))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, channel, seq, answers, request, addr):
+        """
+        Executes a request and answers it.
+        :param channel: The id of the channel the request was received over.
+        :param seq: The sequence number of the request.
+        :param answers: The OrderedDict in which the answers for the channel are remembered.
+        :param request: The PlayerServer.Request.
+        :param addr: The address of the client.
+        """
+        if request.rtype in idempotent:
+            rt, values = await self._server.execute(request)
+        else:
+            rt, values = ResponseType.ERROR_NOTIMPLEMENTED, ()
+        answer = _pack(channel, seq, encode_response(request.rtype, rt, *values))
+        if seq in answers:
+            answers[seq] = answer
+        if self._transport is not None:
+            self._transport.sendto(answer, addr)
+
+    def connection_lost(self, exc):
+        self._transport = None
+        for task in self._tasks:
+            task.cancel()
+
+    @staticmethod
+    async def serve(host, port, server):
+        """
+        Receives datagrams for a PlayerServer, until cancelled.
+        :param host: The host name for which datagrams should be received.
+        :param port: The UDP port on which datagrams should be received.
+        :param server: The PlayerServer that executes the requests.
+        """
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(lambda: DatagramServer(server), local_addr=(host, port))
+        try:
+            await loop.create_future()
+        finally:
+            transport.close()
+
+
+class DatagramChannel(asyncio.DatagramProtocol):
+    """
+    Sends idempotent requests to a server via UDP, in parallel to the Connection that carries all other requests.
+    Every request is sent several times, at short intervals, until the server answers it. Unlike with TCP, the loss of
+    a packet does not delay the requests that follow it.
+    """
+
+    def __init__(self, copies=3, interval=0.002, timeout=0.05):
+        """
+        Creates a new channel.
+        :param copies: The maximum number of times every request is sent.
+        :param interval: The number of seconds between two copies of a request.
+        :param timeout: The number of seconds after which a request that has not been answered fails.
+        """
+        super().__init__()
+        self._id = int.from_bytes(secrets.token_bytes(8), 'big')
+        self._seq = 0
+        self._copies = copies
+        self._interval = interval
+        self._timeout = timeout
+        self._pending = {}  # Maps sequence numbers to pairs (command, future).
+        self._transport = None
+
+    @staticmethod
+    async def open(host, port, **kwargs):
+        """
+        Opens a channel to a remote server.
+        :param host: The host name of the remote machine.
+        :param port: The UDP port the server receives datagrams on.
+        :param kwargs: Further arguments for the DatagramChannel constructor.
+        :return: A DatagramChannel object.
+        """
+        loop = asyncio.get_running_loop()
+        _, channel = await loop.create_datagram_endpoint(lambda: DatagramChannel(**kwargs), remote_addr=(host, port))
+        return channel
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            channel, seq, chunks = _unpack(data)
+        except IOError:
+            return
+        if channel != self._id or seq not in self._pending:
+            return
+        command, response = self._pending.pop(seq)
+        if not response.done():
+            try:
+                rt, values, _ = decode_response(command, chunks)
+                response.set_result((rt, values))
+            except IOError as e:
+                response.set_exception(e)
+
+    def error_received(self, exc):
+        # For example, the server is not listening (yet). Requests keep being sent until they time out.
+        pass
+
+    def connection_lost(self, exc):
+        self._transport = None
+        for _, response in self._pending.values():
+            if not response.done():
+                response.set_exception(EOFError("The channel has been closed!"))
+        self._pending.clear()
+
+    async def request(self, command, *args):
+        """
+        Sends a request to the server and awaits the response.
+        :param command: One of the RequestTypes in udp.idempotent.
+        :param args: The arguments for the request.
+        :return: The value the server responded with.
+        :exception asyncio.TimeoutError: If the request has not been answered in time. The server may or may not have
+                                         executed it.
+        """
+        if command not in idempotent:
+            raise ValueError("{} must not be sent via datagrams, because it is not idempotent!".format(command))
+        if self._transport is None:
+            raise EOFError("The channel has been closed!")
+        self._seq += 1
+        seq = self._seq
+        datagram = _pack(self._id, seq, encode_request(command, *args))
+        if len(datagram) > max_size:
+            raise ValueError("The request is too large to be sent via datagrams!")
+
+        loop = asyncio.get_running_loop()
+        response = loop.create_future()
+        self._pending[seq] = (command, response)
+        deadline = loop.time() + self._timeout
+        try:
+            for _ in range(self._copies):
+                self._transport.sendto(datagram)
+                await asyncio.wait((response, ), timeout=self._interval)
+                if response.done() or self._transport is None:
+                    break
+            rt, values = await asyncio.wait_for(asyncio.shield(response), max(0.0, deadline - loop.time()))
+        finally:
+            self._pending.pop(seq, None)
+        return interpret(command, rt, values)
+
+    def close(self):
+        """
+        Closes this channel. Requests that are still pending fail with an EOFError.
+        """
+        if self._transport is not None:
+            self._transport.close()
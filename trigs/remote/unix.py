@@ -0,0 +1,32 @@
+import asyncio
+
+from .stream import StreamConnection
+
+
+class UnixConnection(StreamConnection):
+    """
+    A Unix domain socket that connects a client to a server on the same machine.
+    """
+
+    @classmethod
+    async def open_outgoing(cls, path):
+        """
+        Opens a connection to a server on the local machine.
+        :param path: The filesystem path of the socket the server is listening on.
+        :return: A UnixConnection object.
+        """
+        return cls(*(await asyncio.open_unix_connection(path)))
+
+    @classmethod
+    async def serve(cls, path, s):
+        """
+        Creates a server that accepts UnixConnections.
+        :param path: The filesystem path of the socket this server should listen on.
+        :param s: A callback that accepts a UnixConnection as its only argument. This callback will be responsible
+                 for the entire communication with the client.
+        """
+        async def handle_client(reader, writer):
+            await s(cls(reader, writer))
+        server = await asyncio.start_unix_server(handle_client, path)
+        async with server:
+            await server.serve_forever()
@@ -7,16 +7,32 @@ class TriggerEvent(Event):
     """
     Represent the event of a trigger being triggered.
     """
-    def __init__(self, trigger, time_ns):
+    def __init__(self, trigger, time_ns, pressed=True):
         """
         Creates a new trigger event.
         :param trigger: The Trigger that raised this event.
         :param time_ns: The time at which the event has occurred, as a nanosecond integer. The reference point is that of
                      time.monotonic_ns.
+        :param pressed: Whether the trigger has been pressed, as opposed to released. Not all triggers report releases.
         """
         if not isinstance(trigger, Trigger):
             raise TypeError("TriggerEvents can only be raised by Triggers!")
         super().__init__(trigger, time_ns)
+        self._pressed = pressed
+
+    @property
+    def pressed(self):
+        """
+        Whether the trigger has been pressed, as opposed to released.
+        """
+        return self._pressed
+
+    @property
+    def key(self):
+        """
+        The key under which actions are bound to this event. For plain presses, this is the uniq of the trigger.
+        """
+        return self._source.uniq
 
 
 class TriggerError(Exception):
@@ -1,4 +1,7 @@
+import collections
+import os
 import os.path
+import struct
 import subprocess
 
 import evdev
@@ -10,44 +13,16 @@ from trigs.events import unix2mono
 
 _path_discover_shutters = "/usr/local/sbin/trigs_discover_shutters.py"
 
+# The layout of struct input_event (see linux/input.h) on this machine: A struct timeval, type, code and value.
+_input_event = struct.Struct('@llHHi')
 
-class ReadIterator:
-    """
-    This class is a hacked copy from site-packages/evdev/eventio_asyncio.py .
-    We created this copy to work around an irritating exception message that occurs when the Bluetooth shutter devices
-    lose connection while we are waiting for events (see below).
-    """
-    def __init__(self, device):
-        self.current_batch = iter(())
-        self.device = device
-
-    def __aiter__(self):
-        return self
+EV_VAL_RELEASED = 0
+EV_VAL_PRESSED = 1
+EV_VAL_REPEATED = 2
+BTN_SHUTTER = 115
 
-    def __anext__(self):
-        future = asyncio.Future()
-        try:
-            # Read from the previous batch of events.
-            future.set_result(next(self.current_batch))
-        except StopIteration:
-            def next_batch_ready(batch):
-                try:
-                    self.current_batch = batch.result()
-                    future.set_result(next(self.current_batch))
-                except Exception as e:
-                    # It can apparently happen that the future is already done at this point.
-                    # We observed this to be the case when the bluetooth shutter devices lose connection while we are
-                    # waiting for events.
-                    # If it *is* the case, future.set_exception will cause an InvalidStateError
-                    # that pollutes the console output, but does not actually crash the process (as it affects only
-                    # a future that we anyways stopped listening to...)
-                    # See https://github.com/gvalkov/python-evdev/issues/123
-                    try:
-                        future.set_exception(e)
-                    except asyncio.InvalidStateError:
-                        pass
-            self.device.async_read().add_done_callback(next_batch_ready)
-        return future
+# The maximum number of input events that are read from a device at once:
+_batch = 64
 
 
 class BluetoothTrigger(Trigger):
@@ -61,11 +36,47 @@ class BluetoothTrigger(Trigger):
     __open = []
 
     @staticmethod
-    def discover():
+    def _attribute(device_path, name):
         """
-        Discovers all currently connected trigger devices.
-        This procedure first invalidates all BluetoothTrigger instances!
-        :return: An iterable of Trigger object.
+        Reads an attribute that the kernel reports for an input device. This does not require any privileges.
+        :param device_path: The absolute path under which the Linux kernel exposes the input device.
+        :param name: The name of the attribute, for example 'name' or 'uniq'.
+        :return: A string, or None if the device has vanished or is not an input device.
+        """
+        try:
+            with open(os.path.join('/sys/class/input', os.path.basename(device_path), 'device', name)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def is_shutter(device_path):
+        """
+        Decides whether an input device is of the type that this class supports, by the name the kernel reports for it.
+        This does not require any privileges.
+        :param device_path: The absolute path under which the Linux kernel exposes the input device.
+        :return: A bool.
+        """
+        name = BluetoothTrigger._attribute(device_path, 'name')
+        # This is the criterion that discover_shutters.py applies as well:
+        return name is not None and "Shutter" in name and "Control" in name
+
+    @staticmethod
+    def uniq_of(device_path):
+        """
+        Determines the unique identifier of an input device, without opening it. This does not require any privileges.
+        :param device_path: The absolute path under which the Linux kernel exposes the input device.
+        :return: The string that the 'uniq' property of a BluetoothTrigger for the device would have, or None if the
+                 device has vanished.
+        """
+        return BluetoothTrigger._attribute(device_path, 'uniq')
+
+    @staticmethod
+    def grant_access():
+        """
+        Makes all currently connected trigger devices accessible to all users, by running the discovery script that
+        install.sh has set up for use with sudo. Triggers that have been opened already are not affected.
+        :return: A list of the paths of the devices.
         """
 
         if not os.path.isfile(_path_discover_shutters):
@@ -80,14 +91,46 @@ class BluetoothTrigger(Trigger):
                                   " be a rule in /etc/sudoers.d to avoid this. "
                                   "Did you run ./install.sh properly?".format(_path_discover_shutters))
 
+        return [path.strip() for path in lines.splitlines()]
+
+    @staticmethod
+    async def attach(device_path):
+        """
+        Opens an input device, if it is of the type that this class supports. If the device cannot be accessed, the
+        privileges to do so are acquired by grant_access, only once they are needed.
+        :param device_path: The absolute path under which the Linux kernel exposes the input device.
+        :return: A BluetoothTrigger, or None if the device is not supported or has vanished already.
+        :exception OSError: If the device cannot be opened.
+        """
+        if not BluetoothTrigger.is_shutter(device_path):
+            return None
+        try:
+            try:
+                return BluetoothTrigger(device_path)
+            except PermissionError:
+                await asyncio.to_thread(BluetoothTrigger.grant_access)
+                return BluetoothTrigger(device_path)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def discover():
+        """
+        Discovers all currently connected trigger devices.
+        This procedure first invalidates all BluetoothTrigger instances!
+        :return: An iterable of Trigger object.
+        """
+
+        paths = BluetoothTrigger.grant_access()
+
         for t in list(BluetoothTrigger.__open):
             t.close()
 
         discovered = []
         try:
-            for path in lines.splitlines():
+            for path in paths:
                 try:
-                    t = BluetoothTrigger(path.strip())
+                    t = BluetoothTrigger(path)
                     discovered.append(t)
                 except FileNotFoundError as e:
                     raise TriggerError("A trigger that we just discovered seems to have vanished again!", None) from e
@@ -119,6 +162,10 @@ class BluetoothTrigger(Trigger):
                                                                                      _path_discover_shutters))
         super().__init__(d.uniq)
         self._device = d
+        self._loop = None
+        self._events = collections.deque(maxlen=256)  # Presses that have been read, but not handed out yet.
+        self._error = None
+        self._waiter = None
         d.grab()
         BluetoothTrigger.__open.append(self)
 
@@ -128,30 +175,75 @@ class BluetoothTrigger(Trigger):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def _fail(self, e):
+        """
+        Stops reading from the device and makes next raise an error, once all presses read so far have been handed
+        out.
+        :param e: The exception that caused the failure.
+        """
+        if self._loop is not None:
+            self._loop.remove_reader(self._device.fd)
+            self._loop = None
+        self._error = e
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _read(self):
+        """
+        Reads all pending input events from the device, in one system call, and keeps the presses and releases of the
+        shutter button. This procedure is called by the event loop whenever the device is readable.
+        """
+        try:
+            data = os.read(self._device.fd, _batch * _input_event.size)
+        except BlockingIOError:
+            return
+        except OSError as e:  # Likely: Bluetooth connection interrupted.
+            self._fail(e)
+            return
+        if len(data) == 0:
+            self._fail(EOFError("The device has been removed!"))
+            return
+
+        for sec, usec, etype, code, value in _input_event.iter_unpack(data):
+            if code == BTN_SHUTTER and etype == evdev.ecodes.EV_KEY and value != EV_VAL_REPEATED:
+                self._events.append(TriggerEvent(self, unix2mono(sec * 10 ** 9 + usec * 10 ** 3),
+                                                 pressed=value == EV_VAL_PRESSED))
+
+        if len(self._events) > 0 and self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
     async def next(self):
         """
         Waits for this trigger to be used one more time.
-        :return: A TriggerEvent.
+        Once this has been called, the device is read whenever it has input, even while no call of this method is
+        pending, such that no presses are lost.
+        :return: A TriggerEvent. Releases of the button are reported as well, with TriggerEvent.pressed being False.
         """
         if self._device is None:
             raise RuntimeError("This Trigger object has been closed and cannot be used anymore!")
 
-        EV_VAL_PRESSED = 1
-        BTN_SHUTTER = 115
+        if self._loop is None and self._error is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop.add_reader(self._device.fd, self._read)
 
-        try:
-            async for event in ReadIterator(self._device):
-                if (event.type, event.value, event.code) == (evdev.ecodes.EV_KEY, EV_VAL_PRESSED, BTN_SHUTTER):
-                    return TriggerEvent(self, unix2mono(event.sec * 10 ** 9 + event.usec * 10 ** 3))
-        except OSError as e:  # Likely: Bluetooth connection interrupted.
-            raise TriggerError("Failed to await an event, likely "
-                               "because the connection to the device was interrupted!", self) from e
+        while len(self._events) == 0:
+            if self._error is not None:
+                raise TriggerError("Failed to await an event, likely "
+                                   "because the connection to the device was interrupted!", self) from self._error
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        return self._events.popleft()
 
     def close(self):
         """
         Closes this instance.
         """
         if self._device is not None:
+            self._fail(EOFError("The trigger has been closed!"))
             d = self._device
             self._device = None
 
@@ -0,0 +1,302 @@
+import asyncio
+import collections
+import time
+from enum import Enum
+
+from .base import TriggerEvent, TriggerError
+
+
+class Gesture(Enum):
+    """
+    The ways in which triggers can be used.
+    """
+    TAP = 'tap'  # A single press.
+    DOUBLE = 'double'  # Two presses of the same trigger in quick succession.
+    LONG = 'long'  # A press that is held for a while. This requires triggers that report releases.
+    CHORD = 'chord'  # Presses of several triggers at (almost) the same time.
+
+
+def binding(gesture, *uniqs):
+    """
+    Computes the key under which an action is bound to a gesture.
+    :param gesture: A Gesture.
+    :param uniqs: The unique identifiers of the triggers that perform the gesture. For CHORD, these are at least two,
+                  for all other gestures exactly one.
+    :return: A hashable object. For TAP, this is the uniq itself, such that taps are bound like plain trigger events.
+    """
+    if gesture is Gesture.CHORD:
+        if len(set(uniqs)) < 2:
+            raise ValueError("A chord requires at least two distinct triggers!")
+        return gesture, frozenset(uniqs)
+    if len(uniqs) != 1:
+        raise ValueError("A {} gesture is performed by exactly one trigger!".format(gesture.value))
+    if gesture is Gesture.TAP:
+        return uniqs[0]
+    return gesture, uniqs[0]
+
+
+class GestureEvent(TriggerEvent):
+    """
+    Represents the event of a gesture having been recognized.
+    """
+
+    def __init__(self, trigger, time_ns, gesture, key, decided_ns):
+        """
+        Creates a new gesture event.
+        :param trigger: The Trigger whose input completed the gesture.
+        :param time_ns: The time at which the input that completed the gesture occurred, as a nanosecond integer
+                        relative to the reference point of time.monotonic_ns.
+        :param gesture: The Gesture that has been recognized.
+        :param key: The key under which actions are bound to the gesture, see gestures.binding.
+        :param decided_ns: The time at which the gesture was recognized, in the same format as time_ns.
+        """
+        super().__init__(trigger, time_ns)
+        self._gesture = gesture
+        self._key = key
+        self._decided_ns = decided_ns
+
+    @property
+    def gesture(self):
+        """
+        The Gesture that has been recognized.
+        """
+        return self._gesture
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def delay_ns(self):
+        """
+        The number of nanoseconds that passed between the input that completed the gesture and its recognition. This
+        includes the time it took to deliver the input, as well as the time the recognizer had to wait for the gesture
+        to become unambiguous.
+        """
+        return self._decided_ns - self._time_ns
+
+    def __str__(self):
+        return "{} of {}".format(self._gesture.name, self._source.uniq)
+
+
+class _Press:
+    """
+    A press that has not been resolved into a gesture yet.
+    """
+
+    def __init__(self, event, chord, double, long):
+        self.event = event
+        self.held = True
+        self.chord = chord  # Whether a chord may still complete.
+        self.double = double  # Whether a double tap may still complete.
+        self.long = long  # Whether a long press may still complete.
+        self.timer = None
+
+    @property
+    def open(self):
+        return self.chord or self.double or self.long
+
+
+class GestureRecognizer:
+    """
+    Turns the TriggerEvents of a number of triggers into GestureEvents, for those gestures that actions are bound to.
+    All decisions are made by the time stamps of the TriggerEvents, which the kernel provides. A gesture is reported as
+    soon as no other gesture that is bound can explain the input anymore: If only taps are bound for a trigger, every
+    press is reported without any delay, and a double tap is reported right when the second press arrives.
+    """
+
+    def __init__(self, source, keys, debounce=0.03, double=0.5, long=0.8, chord=0.05):
+        """
+        Creates a new recognizer.
+        :param source: An object with a 'next' coroutine function that returns TriggerEvents, for example a TriggerHub.
+        :param keys: An iterable of the keys that actions are bound to, see gestures.binding. Only the gestures these
+                     describe are recognized, all other input is ignored.
+        :param debounce: The number of seconds within which a repeated press of the same trigger is ignored.
+        :param double: The maximum number of seconds between the two presses of a double tap.
+        :param long: The minimum number of seconds that a press must be held to count as a long press.
+        :param chord: The maximum number of seconds between the presses of a chord.
+        """
+        self._source = source
+        self._taps, self._doubles, self._longs = set(), set(), set()
+        self._chords = collections.defaultdict(list)  # Maps uniqs to lists of the frozensets of uniqs they chord with.
+        for key in keys:
+            if isinstance(key, str):
+                self._taps.add(key)
+            elif key[0] is Gesture.DOUBLE:
+                self._doubles.add(key[1])
+            elif key[0] is Gesture.LONG:
+                self._longs.add(key[1])
+            elif key[0] is Gesture.CHORD:
+                for uniq in key[1]:
+                    self._chords[uniq].append(key[1])
+            else:
+                raise ValueError("Unsupported binding {}!".format(key))
+
+        self._debounce = int(debounce * 10 ** 9)
+        self._double = int(double * 10 ** 9)
+        self._long = int(long * 10 ** 9)
+        self._chord = int(chord * 10 ** 9)
+
+        self._pending = {}  # Maps uniqs to _Press objects.
+        self._latest = {}  # Maps uniqs to the times of their latest presses that were not ignored, for debouncing.
+        self._gestures = collections.deque()
+        self._errors = collections.deque()
+        self._waiter = None
+        self._loop = asyncio.get_running_loop()
+        self._reader = self._loop.create_task(self._read())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _read(self):
+        """
+        Feeds the events of the source into this recognizer, until cancelled.
+        """
+        while True:
+            try:
+                self.feed(await self._source.next())
+            except TriggerError as e:
+                self._errors.append(e)
+                self._wake()
+
+    def _emit(self, event, gesture, key):
+        self._gestures.append(GestureEvent(event.source, event.time_ns, gesture, key, time.monotonic_ns()))
+        self._wake()
+
+    def _discard(self, uniq):
+        """
+        Forgets about a pending press.
+        """
+        press = self._pending.pop(uniq)
+        if press.timer is not None:
+            press.timer.cancel()
+
+    def _settle(self, uniq):
+        """
+        Reports a pending press as a tap, if no other gesture can explain it anymore, and otherwise makes sure that it
+        is looked at again as soon as one of the other gestures becomes impossible.
+        :param uniq: The uniq of the trigger that has been pressed.
+        """
+        press = self._pending[uniq]
+        if not press.open:
+            self._discard(uniq)
+            if uniq in self._taps:
+                self._emit(press.event, Gesture.TAP, uniq)
+            return
+        t = press.event.time_ns
+        deadline = min(d for d, o in ((t + self._chord, press.chord), (t + self._double, press.double),
+                                      (t + self._long, press.long)) if o)
+        if press.timer is not None:
+            press.timer.cancel()
+        # The reference point of loop.time() is that of time.monotonic:
+        press.timer = self._loop.call_at(deadline / 10 ** 9, self._expire, uniq)
+
+    def _expire(self, uniq):
+        """
+        Rules out the gestures that have not completed in time. This procedure is called by the event loop.
+        :param uniq: The uniq of the trigger that has been pressed.
+        """
+        press = self._pending[uniq]
+        press.timer = None
+        now = time.monotonic_ns()
+        t = press.event.time_ns
+        if press.long and now >= t + self._long:
+            # The trigger has not been released in time, so this is a long press, no matter what else might follow:
+            self._discard(uniq)
+            self._emit(TriggerEvent(press.event.source, t + self._long), Gesture.LONG, (Gesture.LONG, uniq))
+            return
+        press.chord = press.chord and now < t + self._chord
+        press.double = press.double and now < t + self._double
+        self._settle(uniq)
+
+    def _press(self, event):
+        uniq = event.source.uniq
+        t = event.time_ns
+
+        latest = self._latest.get(uniq)
+        if latest is not None and t - latest < self._debounce:
+            return
+        self._latest[uniq] = t
+
+        for chord in self._chords.get(uniq, ()):
+            others = [self._pending.get(u) for u in chord if u != uniq]
+            if all(p is not None and p.chord and t - p.event.time_ns <= self._chord for p in others):
+                for u in chord:
+                    if u != uniq:
+                        self._discard(u)
+                press = self._pending.get(uniq)
+                if press is not None:
+                    # An earlier press of this trigger is not part of the chord and cannot become anything but a tap:
+                    press.chord = press.double = press.long = False
+                    self._settle(uniq)
+                self._emit(event, Gesture.CHORD, (Gesture.CHORD, chord))
+                return
+
+        press = self._pending.get(uniq)
+        if press is not None:
+            if press.double and t - press.event.time_ns <= self._double:
+                self._discard(uniq)
+                self._emit(event, Gesture.DOUBLE, (Gesture.DOUBLE, uniq))
+                return
+            # The earlier press cannot become anything but a tap anymore:
+            press.chord = press.double = press.long = False
+            self._settle(uniq)
+
+        self._pending[uniq] = _Press(event, uniq in self._chords, uniq in self._doubles, uniq in self._longs)
+        self._settle(uniq)
+
+    def _release(self, event):
+        uniq = event.source.uniq
+        press = self._pending.get(uniq)
+        if press is None or not press.held:
+            return
+        press.held = False
+        if press.long:
+            if event.time_ns - press.event.time_ns >= self._long:
+                self._discard(uniq)
+                self._emit(event, Gesture.LONG, (Gesture.LONG, uniq))
+                return
+            press.long = False
+            self._settle(uniq)
+
+    def feed(self, event):
+        """
+        Processes a TriggerEvent. Gestures that this completes can be obtained from 'next'.
+        :param event: A TriggerEvent.
+        """
+        if event.pressed:
+            self._press(event)
+        else:
+            self._release(event)
+
+    async def next(self):
+        """
+        Waits for a gesture to be recognized.
+        :return: A GestureEvent.
+        :exception TriggerError: If the source has reported an error. Gestures that have been recognized before are
+                                 handed out first.
+        """
+        while len(self._gestures) == 0 and len(self._errors) == 0:
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        if len(self._gestures) > 0:
+            return self._gestures.popleft()
+        raise self._errors.popleft()
+
+    def close(self):
+        """
+        Stops recognizing gestures. The source is not closed.
+        """
+        self._reader.cancel()
+        for uniq in list(self._pending.keys()):
+            self._discard(uniq)
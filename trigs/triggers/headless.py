@@ -0,0 +1,70 @@
+import asyncio
+import collections
+import time
+
+from .base import Trigger, TriggerEvent, TriggerError
+
+
+class HeadlessTrigger(Trigger):
+    """
+    A trigger that is emulated in software and fired by a program, for example to replay or to script input. Unlike
+    VirtualTriggerWindow, this does not need a display.
+    """
+
+    def __init__(self, uniq, capacity=65536):
+        """
+        Creates a new HeadlessTrigger.
+        :param uniq: The unique identifier of this trigger.
+        :param capacity: The maximum number of events that are kept while nobody awaits them. Beyond this, the oldest
+                         events are dropped, which is counted in 'dropped'.
+        """
+        super().__init__(uniq)
+        self._events = collections.deque(maxlen=capacity)
+        self._dropped = 0
+        self._waiter = None
+        self._closed = False
+
+    @property
+    def dropped(self):
+        """
+        The number of events that have been dropped so far, because they were fired faster than they were awaited.
+        """
+        return self._dropped
+
+    def fire(self, time_ns=None, pressed=True):
+        """
+        Makes this trigger register an event.
+        :param time_ns: The time at which the event occurred, as a nanosecond integer relative to the reference point
+                        of time.monotonic_ns. By default, this is the current time.
+        :param pressed: Whether the trigger has been pressed, as opposed to released.
+        """
+        if self._closed:
+            raise RuntimeError("This HeadlessTrigger has been closed and cannot be used anymore!")
+        if len(self._events) == self._events.maxlen:
+            self._dropped += 1
+        self._events.append(TriggerEvent(self, time.monotonic_ns() if time_ns is None else time_ns, pressed=pressed))
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def next(self):
+        """
+        Waits for this trigger to be fired one more time.
+        :return: A TriggerEvent.
+        """
+        while len(self._events) == 0:
+            if self._closed:
+                raise TriggerError("The headless trigger was closed!", self)
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._events.popleft()
+
+    def close(self):
+        """
+        Closes this instance. Events that have been fired before are still handed out.
+        """
+        self._closed = True
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
@@ -0,0 +1,99 @@
+import asyncio
+import collections
+import heapq
+
+from .base import TriggerError
+
+
+class TriggerHub:
+    """
+    Receives the events of a number of triggers in one place.
+    For every trigger, a task keeps awaiting its events for as long as the trigger is part of the hub, such that no
+    event is lost while nobody is waiting for one. The events are handed out in the order of their time stamps.
+    """
+
+    def __init__(self, triggers=()):
+        """
+        Creates a new hub.
+        :param triggers: An iterable of Trigger objects whose events should be received.
+        """
+        self._readers = {}
+        self._events = []  # A heap of TriggerEvents.
+        self._errors = collections.deque()
+        self._waiter = None
+        for t in triggers:
+            self.add(t)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def triggers(self):
+        """
+        The triggers whose events this hub receives.
+        :return: A tuple of Trigger objects.
+        """
+        return tuple(self._readers.keys())
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _read(self, trigger):
+        """
+        Receives the events of a trigger, until the trigger fails.
+        """
+        try:
+            while True:
+                heapq.heappush(self._events, await trigger.next())
+                self._wake()
+        except TriggerError as e:
+            self._errors.append(e)
+            self._wake()
+
+    def add(self, trigger):
+        """
+        Makes this hub receive the events of a trigger.
+        :param trigger: A Trigger object.
+        """
+        if trigger not in self._readers:
+            self._readers[trigger] = asyncio.get_running_loop().create_task(self._read(trigger))
+
+    def remove(self, trigger):
+        """
+        Makes this hub stop receiving the events of a trigger. Events that have already been received are still
+        handed out. The trigger is not closed.
+        :param trigger: A Trigger object.
+        """
+        reader = self._readers.pop(trigger, None)
+        if reader is not None:
+            reader.cancel()
+
+    async def next(self):
+        """
+        Waits for any of the triggers to be used.
+        :return: The TriggerEvent with the earliest time stamp among those that have been received.
+        :exception TriggerError: If one of the triggers has failed. The events it had raised before have been handed
+                                 out already. The trigger remains part of the hub until it is removed, but does not
+                                 raise any more events.
+        """
+        while len(self._events) == 0 and len(self._errors) == 0:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        if len(self._events) > 0:
+            return heapq.heappop(self._events)
+        raise self._errors.popleft()
+
+    def close(self):
+        """
+        Stops receiving events from all triggers. The triggers are not closed.
+        """
+        for reader in self._readers.values():
+            reader.cancel()
+        self._readers.clear()
@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import struct
+
+from trigs.events import Event
+
+# See inotify(7):
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+_inotify_event = struct.Struct('iIII')
+
+_libc = None
+
+
+def _inotify():
+    """
+    Loads the inotify functions of the C library.
+    :return: The ctypes.CDLL object for the C library.
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+
+class DeviceEvent(Event):
+    """
+    Represents an input device being added or removed.
+    """
+
+    def __init__(self, monitor, path, added):
+        """
+        Creates a new device event.
+        :param monitor: The DeviceMonitor that observed the event.
+        :param path: The path of the device file.
+        :param added: Whether the device has been added (or has become accessible), as opposed to removed.
+        """
+        super().__init__(monitor)
+        self._path = path
+        self._added = added
+
+    @property
+    def path(self):
+        """
+        The path of the device file.
+        """
+        return self._path
+
+    @property
+    def added(self):
+        """
+        Whether the device has been added (or has become accessible), as opposed to removed.
+        """
+        return self._added
+
+    def __str__(self):
+        return "{} {}".format("Added" if self._added else "Removed", self._path)
+
+
+class DeviceMonitor:
+    """
+    Watches a directory of device files via inotify, reporting the input devices that are added or removed.
+    While no device is added or removed, this does not consume any CPU time.
+    """
+
+    def __init__(self, directory='/dev/input', pattern='event*'):
+        """
+        Starts watching a directory of device files.
+        :param directory: The directory to watch.
+        :param pattern: A glob pattern for the names of the device files that are of interest.
+        """
+        libc = _inotify()
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        # The access rights of a device file are usually adjusted by udev only after the file has been created:
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+            e = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(e, os.strerror(e), directory)
+        self._fd = fd
+        self._directory = directory
+        self._pattern = pattern
+        self._events = collections.deque()
+        self._waiter = None
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(fd, self._read)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def devices(self):
+        """
+        The device files that are present at the moment.
+        :return: A sorted list of paths.
+        """
+        return sorted(glob.glob(os.path.join(self._directory, self._pattern)))
+
+    def _read(self):
+        """
+        Reads all pending inotify events. This procedure is called by the event loop whenever there are any.
+        """
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            _, mask, _, n = _inotify_event.unpack_from(data, offset)
+            offset += _inotify_event.size
+            name = os.fsdecode(data[offset:offset + n].rstrip(b'\0'))
+            offset += n
+            if mask & IN_IGNORED or not fnmatch.fnmatch(name, self._pattern):
+                continue
+            self._events.append(DeviceEvent(self, os.path.join(self._directory, name), not mask & IN_DELETE))
+        if len(self._events) > 0 and self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def next(self):
+        """
+        Waits for a device to be added or removed.
+        :return: A DeviceEvent.
+        """
+        if self._fd is None:
+            raise RuntimeError("This DeviceMonitor has been closed and cannot be used anymore!")
+        while len(self._events) == 0:
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._events.popleft()
+
+    def close(self):
+        """
+        Stops watching.
+        """
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,73 @@
+import json
+import os
+
+
+class RoleMap:
+    """
+    Records which trigger device plays which role, identifying the devices by their unique and persistent identifiers.
+    The record is kept in a file, such that the roles survive restarts of the process.
+    """
+
+    def __init__(self, path=None):
+        """
+        Creates a new role map, loading the roles that have been recorded before.
+        :param path: The path of the file in which the roles are recorded. If this is None, the roles are not persisted.
+                     If the file does not exist or cannot be parsed, the map starts out empty.
+        """
+        self._path = path
+        self._roles = {}  # Maps uniqs to role names.
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    roles = json.load(f)
+            except (OSError, ValueError):
+                roles = {}
+            if isinstance(roles, dict):
+                self._roles = {str(u): str(r) for u, r in roles.items()}
+
+    def __len__(self):
+        return len(self._roles)
+
+    def __iter__(self):
+        return iter(self._roles.items())
+
+    def role(self, uniq):
+        """
+        Looks up the role of a trigger device.
+        :param uniq: The unique identifier of the device.
+        :return: The name of the role, or None if the device does not have one.
+        """
+        return self._roles.get(uniq)
+
+    def uniq(self, role):
+        """
+        Looks up the trigger device that plays a role.
+        :param role: The name of the role.
+        :return: The unique identifier of the device, or None if no device plays the role.
+        """
+        for u, r in self._roles.items():
+            if r == role:
+                return u
+        return None
+
+    def assign(self, uniq, role):
+        """
+        Makes a trigger device play a role. The device that has played the role so far does not anymore.
+        :param uniq: The unique identifier of the device.
+        :param role: The name of the role.
+        """
+        for u, r in list(self._roles.items()):
+            if r == role:
+                del self._roles[u]
+        self._roles[uniq] = role
+
+    def save(self):
+        """
+        Persists the roles, if a path has been given for this.
+        """
+        if self._path is None:
+            return
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._roles, f)
+        os.replace(tmp, self._path)
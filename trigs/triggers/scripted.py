@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+import os
+import random
+import sys
+import time
+
+from trigs.error import TrigsError
+
+
+def _fire(trigger, word, time_ns):
+    """
+    Fires a trigger as instructed by a word of a script.
+    :param trigger: A HeadlessTrigger.
+    :param word: 'down' for a press, 'up' for a release, or None for a press that is released right away.
+    :param time_ns: The time stamp for the event(s).
+    """
+    if word is None:
+        trigger.fire(time_ns, pressed=True)
+        trigger.fire(time_ns, pressed=False)
+    elif word == 'down':
+        trigger.fire(time_ns, pressed=True)
+    elif word == 'up':
+        trigger.fire(time_ns, pressed=False)
+    else:
+        raise ValueError(word)
+
+
+async def follow(reader, triggers):
+    """
+    Fires triggers as instructed by the lines of a stream, until it ends. Every line names a trigger, optionally
+    followed by 'down' or 'up' for a mere press or release. A line that consists of just a name stands for a press
+    that is released right away. Lines that cannot be followed are ignored.
+    :param reader: An asyncio.StreamReader.
+    :param triggers: A dict mapping names to HeadlessTriggers.
+    :return: The number of lines that have been followed.
+    """
+    n = 0
+    while True:
+        line = await reader.readline()
+        if len(line) == 0:
+            return n
+        words = line.decode('utf-8', errors='replace').split()
+        if len(words) == 0 or len(words) > 2 or words[0] not in triggers:
+            continue
+        try:
+            _fire(triggers[words[0]], words[1] if len(words) > 1 else None, time.monotonic_ns())
+        except ValueError:
+            continue
+        n += 1
+
+
+async def _pipe(f):
+    """
+    Makes a file readable as a stream.
+    :param f: A file object of a pipe, a FIFO or a terminal.
+    :return: A pair (reader, transport).
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), f)
+    return reader, transport
+
+
+async def from_stdin(triggers):
+    """
+    Fires triggers as instructed by the lines of the standard input, until it ends. See 'follow' for the format.
+    :param triggers: A dict mapping names to HeadlessTriggers.
+    :return: The number of lines that have been followed.
+    """
+    reader, transport = await _pipe(sys.stdin)
+    try:
+        return await follow(reader, triggers)
+    finally:
+        transport.close()
+
+
+async def from_fifo(path, triggers):
+    """
+    Fires triggers as instructed by the lines written into a named pipe, until cancelled. Writers may come and go.
+    See 'follow' for the format.
+    :param path: The path of the FIFO. It is created if it does not exist.
+    :param triggers: A dict mapping names to HeadlessTriggers.
+    """
+    if not os.path.exists(path):
+        os.mkfifo(path)
+    while True:
+        # Opening the FIFO for writing as well keeps it from reporting EOF while no writer is connected:
+        f = open(os.open(path, os.O_RDWR | os.O_NONBLOCK), 'rb', buffering=0)
+        reader, transport = await _pipe(f)
+        try:
+            await follow(reader, triggers)
+        finally:
+            transport.close()
+
+
+async def from_unix(path, triggers):
+    """
+    Fires triggers as instructed by the lines that clients send to a Unix domain socket, until cancelled. See 'follow'
+    for the format.
+    :param path: The path of the socket.
+    :param triggers: A dict mapping names to HeadlessTriggers.
+    """
+    async def handle(reader, writer):
+        try:
+            await follow(reader, triggers)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, path)
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+async def generate(triggers, rate, hold=0.02, seed=None):
+    """
+    Fires randomly chosen triggers at random times, until cancelled. The presses form a Poisson process, every press
+    being released after a fixed time. Events that fall due at the same time are fired in one go, such that rates far
+    beyond the resolution of the event loop's timers are possible.
+    :param triggers: A dict mapping names to HeadlessTriggers.
+    :param rate: The average number of presses per second.
+    :param hold: The number of seconds after which every press is released.
+    :param seed: The seed for the random number generator, to make the process repeatable.
+    """
+    rng = random.Random(seed)
+    triggers = list(triggers.values())
+    hold = int(hold * 10 ** 9)
+    due = []  # A heap of triples (time_ns, counter, trigger) for the releases that are still to be fired.
+    counter = 0
+    t = time.monotonic_ns()
+    while True:
+        t += int(rng.expovariate(rate) * 10 ** 9)
+        delay = t - time.monotonic_ns()
+        if delay > 0:
+            await asyncio.sleep(delay / 10 ** 9)
+        while len(due) > 0 and due[0][0] <= t:
+            rt, _, trigger = heapq.heappop(due)
+            trigger.fire(rt, pressed=False)
+        trigger = rng.choice(triggers)
+        trigger.fire(t, pressed=True)
+        heapq.heappush(due, (t + hold, counter, trigger))
+        counter += 1
+
+
+def script(spec, triggers):
+    """
+    Creates a source of scripted trigger events.
+    :param spec: A string describing the source: 'stdin', 'fifo:PATH', 'unix:PATH' or 'random:RATE', where RATE is
+                 the average number of presses per second.
+    :param triggers: A dict mapping names to HeadlessTriggers.
+    :return: A coroutine that fires the triggers until the source ends or the coroutine is cancelled.
+    :exception TrigsError: If the spec is invalid.
+    """
+    kind, _, arg = spec.partition(':')
+    if kind == 'stdin' and arg == '':
+        return from_stdin(triggers)
+    if kind == 'fifo' and arg != '':
+        return from_fifo(arg, triggers)
+    if kind == 'unix' and arg != '':
+        return from_unix(arg, triggers)
+    if kind == 'random':
+        try:
+            rate = float(arg)
+        except ValueError:
+            rate = 0
+        if rate > 0:
+            return generate(triggers, rate)
+    raise TrigsError("Invalid source of scripted trigger events: '{}'! Use stdin, fifo:PATH, unix:PATH"
+                     " or random:RATE.".format(spec))
@@ -18,11 +18,12 @@ class VirtualTriggerWindow:
         A trigger that does not exist physically, but is emulated in software. It can be activated by mouse click or key press.
         """
 
-        def __init__(self, ):
+        def __init__(self, uniq=None):
             """
             Creates a new VirtualTrigger.
+            :param uniq: The unique identifier of this trigger. If this is None, an identifier is generated.
             """
-            super().__init__(str(id(self)))
+            super().__init__(str(id(self)) if uniq is None else uniq)
             self._futures = []
 
         def __enter__(self):
@@ -105,7 +106,7 @@ class VirtualTriggerWindow:
         self._triggers = {}
         self._buttons = []
         for (label, key), (x, y) in zip(lkpairs, itertools.product(range(num_cols), range(num_rows))):
-            t = VirtualTriggerWindow.VirtualTrigger()
+            t = VirtualTriggerWindow.VirtualTrigger(key)
             b = tkinter.Button(root, text=label, command=t.activate)
             b.grid(row=y, column=x, sticky='NSEW')
             self._buttons.append(b)